@@ -0,0 +1,415 @@
+import asyncio
+import json
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from metrics import ADMISSION_DECISIONS, ADMISSION_QUEUE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Highest first; a full queue always serves a higher class before a lower one
+PRIORITIES = ('interactive', 'default', 'batch')
+
+# (remaining, reset) header pairs sent by Anthropic, OpenRouter and OpenAI-style APIs
+RATE_LIMIT_HEADERS = (
+    ('anthropic-ratelimit-requests-remaining', 'anthropic-ratelimit-requests-reset'),
+    ('anthropic-ratelimit-tokens-remaining', 'anthropic-ratelimit-tokens-reset'),
+    ('anthropic-ratelimit-input-tokens-remaining', 'anthropic-ratelimit-input-tokens-reset'),
+    ('anthropic-ratelimit-output-tokens-remaining', 'anthropic-ratelimit-output-tokens-reset'),
+    ('x-ratelimit-remaining', 'x-ratelimit-reset'),
+    ('x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests'),
+    ('x-ratelimit-remaining-tokens', 'x-ratelimit-reset-tokens'),
+)
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def priority_rank(priority):
+    return PRIORITIES.index(priority) if priority in PRIORITIES else PRIORITIES.index('default')
+
+def request_priority(granted, requested=None):
+    """A request may ask for a lower class than its client's, never a higher one."""
+    rank = priority_rank(granted)
+    if requested in PRIORITIES:
+        rank = max(rank, priority_rank(requested))
+    return PRIORITIES[rank]
+
+class TokenBucket:
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class RateLimiter:
+    """Token buckets per client and per model, in requests per minute.
+
+    A rate of 0 leaves that key unlimited. Client buckets are kept for
+    the most recent max_clients clients only.
+    """
+
+    def __init__(self, client_rate=0, client_burst=10, model_rates=None, model_burst=10, max_clients=10000, clock=time.monotonic):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.model_rates = model_rates or {}
+        self.model_burst = model_burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self._clients = OrderedDict()
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _client_bucket(self, client, now):
+        bucket = self._clients.get(client)
+        if bucket is None:
+            bucket = self._clients[client] = TokenBucket(self.client_rate / 60, self.client_burst, now)
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(client)
+        return bucket
+
+    def _model_bucket(self, model, now):
+        bucket = self._models.get(model)
+        if bucket is None:
+            bucket = self._models[model] = TokenBucket(self.model_rates[model] / 60, self.model_burst, now)
+        return bucket
+
+    def acquire(self, client, model):
+        """Take one request from both buckets, or raise AdmissionRejected without taking any."""
+        now = self.clock()
+        with self._lock:
+            buckets = []
+            if self.client_rate:
+                buckets.append(('client', self._client_bucket(client, now)))
+            if self.model_rates.get(model):
+                buckets.append(('model', self._model_bucket(model, now)))
+            for kind, bucket in buckets:
+                wait = bucket.wait_time(now)
+                if wait > 0:
+                    raise AdmissionRejected(f"Rate limit exceeded for this {kind}", wait)
+            for kind, bucket in buckets:
+                bucket.take()
+
+def parse_reset(value, now=None):
+    """Seconds until a rate-limit reset header's moment, or None if unreadable.
+
+    Accepts delta seconds, Unix timestamps in seconds or milliseconds,
+    RFC 3339 times and Go-style durations such as "1m30s" or "250ms".
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    now = time.time() if now is None else now
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None:
+        if number > 1e11:
+            return number / 1000 - now
+        if number > 1e9:
+            return number - now
+        return number
+    durations = re.fullmatch(r'(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m(?!s))?(?:(\d+(?:\.\d+)?)s)?(?:(\d+(?:\.\d+)?)ms)?', value)
+    if durations and any(durations.groups()):
+        hours, minutes, seconds, millis = (float(part or 0) for part in durations.groups())
+        return hours * 3600 + minutes * 60 + seconds + millis / 1000
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() - now
+    except ValueError:
+        return None
+
+def request_model(request):
+    # The model is a top-level key, and quotes inside message text are escaped
+    match = re.search(rb'"model":\s*"([^"]+)"', request.content or b'') if request.method == 'POST' else None
+    return match.group(1).decode() if match else None
+
+class ProviderRateLimits:
+    """What providers say about their rate limits, from their response headers.
+
+    A route whose remaining requests or tokens reach zero, or that
+    answered 429, is blocked until the reset the provider announced
+    (at most max_block seconds). Limits seen without a model, such as
+    OpenRouter's per-key limit, block the whole provider.
+    """
+
+    def __init__(self, default_block=5.0, max_block=300.0, clock=time.monotonic):
+        self.default_block = default_block
+        self.max_block = max_block
+        self.clock = clock
+        self._remaining = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+
+    def observe(self, provider, model, headers, status_code):
+        remaining = {}
+        block = 0.0
+        for remaining_header, reset_header in RATE_LIMIT_HEADERS:
+            try:
+                value = int(float(headers[remaining_header]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            remaining[remaining_header] = value
+            if value <= 0:
+                block = max(block, parse_reset(headers.get(reset_header)) or self.default_block)
+        if status_code == 429:
+            block = max(block, parse_reset(headers.get('retry-after')) or self.default_block)
+        if not remaining and not block:
+            return
+        key = (provider, model)
+        now = self.clock()
+        with self._lock:
+            if remaining:
+                self._remaining[key] = remaining
+            if block > 0:
+                until = now + min(block, self.max_block)
+                if until > self._blocked_until.get(key, 0):
+                    logger.warning(f"{provider} rate limit reached for {model or 'all models'}, pausing for {until - now:.1f} s")
+                self._blocked_until[key] = max(self._blocked_until.get(key, 0), until)
+
+    def blocked_for(self, provider, model):
+        now = self.clock()
+        with self._lock:
+            until = max(self._blocked_until.get((provider, model), 0), self._blocked_until.get((provider, None), 0))
+        return max(0.0, until - now)
+
+    def stats(self):
+        now = self.clock()
+        with self._lock:
+            keys = set(self._remaining) | set(self._blocked_until)
+            return {
+                f"{provider}:{model or '*'}": {
+                    "remaining": self._remaining.get((provider, model), {}),
+                    "blocked_for": round(max(0.0, self._blocked_until.get((provider, model), 0) - now), 3),
+                }
+                for provider, model in sorted(keys, key=lambda key: (key[0], key[1] or ''))
+            }
+
+    def response_hooks(self, provider, asynchronous=False):
+        """httpx event hooks that feed a provider SDK client's responses to observe()."""
+        def observe_response(response):
+            self.observe(provider, request_model(response.request), response.headers, response.status_code)
+
+        async def observe_response_async(response):
+            observe_response(response)
+
+        return {'response': [observe_response_async if asynchronous else observe_response]}
+
+class FairQueue:
+    """Waiters by priority class, taken round robin across clients within a class.
+
+    A client with many queued requests gets one turn per round, so a
+    burst from one client cannot push everyone else's requests back.
+    """
+
+    def __init__(self):
+        self._classes = {priority: OrderedDict() for priority in PRIORITIES}
+        self.size = 0
+
+    def push(self, priority, client, waiter):
+        self._classes[priority].setdefault(client, deque()).append(waiter)
+        self.size += 1
+
+    def pop(self):
+        for clients in self._classes.values():
+            if clients:
+                client, waiters = next(iter(clients.items()))
+                waiter = waiters.popleft()
+                del clients[client]
+                if waiters:
+                    clients[client] = waiters
+                self.size -= 1
+                return waiter
+        return None
+
+    def remove(self, priority, client, waiter):
+        waiters = self._classes[priority].get(client)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._classes[priority][client]
+            self.size -= 1
+
+    def counts(self):
+        return {priority: sum(len(waiters) for waiters in clients.values()) for priority, clients in self._classes.items()}
+
+class Slot:
+    """A held admission; release() is idempotent."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.started = controller.clock()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.controller.clock() - self.started)
+
+class AdmissionController:
+    """Decides whether a chat turn may call a provider now, later, or not at all.
+
+    Turns first pass the rate limiter and the providers' own limits, then
+    take one of max_concurrent slots. When all are busy they wait in a
+    FairQueue for up to queue_timeout seconds; a full queue is rejected
+    at once, with a Retry-After estimated from recent turn durations.
+    """
+
+    def __init__(self, max_concurrent=32, max_queue=64, queue_timeout=30.0, rate_limiter=None, provider_limits=None, clock=time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.provider_limits = provider_limits
+        self.clock = clock
+        self.active = 0
+        self.queue = FairQueue()
+        # Mean time a slot is held, for Retry-After when the queue is full
+        self.hold_seconds = 1.0
+        self._lock = threading.Lock()
+
+    def check(self, client, model, routes, priority):
+        if self.provider_limits and routes:
+            wait = min(self.provider_limits.blocked_for(route.provider, route.model) for route in routes)
+            if wait > 0:
+                ADMISSION_DECISIONS.inc(result='provider_limited', priority=priority)
+                raise AdmissionRejected("The model's providers are rate limited", wait)
+        try:
+            self.rate_limiter.acquire(client, model)
+        except AdmissionRejected:
+            ADMISSION_DECISIONS.inc(result='rate_limited', priority=priority)
+            raise
+
+    def queue_full(self, priority):
+        ADMISSION_DECISIONS.inc(result='queue_full', priority=priority)
+        # The queue drains max_concurrent turns per hold_seconds
+        return AdmissionRejected("Too many requests are waiting", self.hold_seconds * (self.queue.size + 1) / max(1, self.max_concurrent))
+
+    def timed_out(self, priority):
+        ADMISSION_DECISIONS.inc(result='queue_timeout', priority=priority)
+        return AdmissionRejected("Timed out waiting for capacity", self.hold_seconds)
+
+    def admitted(self, priority, queued_at=None):
+        ADMISSION_DECISIONS.inc(result='queued' if queued_at is not None else 'admitted', priority=priority)
+        if queued_at is not None:
+            ADMISSION_QUEUE_SECONDS.observe(self.clock() - queued_at, priority=priority)
+        return Slot(self)
+
+    def admit(self, client, model, priority='default', routes=()):
+        """Block until the turn holds a slot and return it, or raise AdmissionRejected."""
+        with self._lock:
+            idle = self.active < self.max_concurrent and not self.queue.size
+            if not idle and self.queue.size >= self.max_queue:
+                raise self.queue_full(priority)
+            # Only a turn that runs or waits spends the client's budget
+            self.check(client, model, routes, priority)
+            if idle:
+                self.active += 1
+                return self.admitted(priority)
+            waiter = threading.Event()
+            self.queue.push(priority, client, waiter)
+        queued_at = self.clock()
+        if not waiter.wait(self.queue_timeout):
+            with self._lock:
+                # Granted between the timeout and taking the lock: the slot is ours
+                if not waiter.is_set():
+                    self.queue.remove(priority, client, waiter)
+                    raise self.timed_out(priority)
+        return self.admitted(priority, queued_at)
+
+    def release(self, held=None):
+        with self._lock:
+            if held is not None:
+                self.hold_seconds += (held - self.hold_seconds) * 0.1
+            waiter = self.queue.pop()
+            if waiter is None:
+                self.active -= 1
+            else:
+                # The slot passes straight to the next waiter
+                waiter.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "max_concurrent": self.max_concurrent,
+                "queued": self.queue.counts(),
+                "max_queue": self.max_queue,
+                "mean_hold_seconds": round(self.hold_seconds, 3),
+            }
+
+class AsyncAdmissionController(AdmissionController):
+    """AdmissionController for one event loop; waiters are futures."""
+
+    async def admit(self, client, model, priority='default', routes=()):
+        with self._lock:
+            idle = self.active < self.max_concurrent and not self.queue.size
+            if not idle and self.queue.size >= self.max_queue:
+                raise self.queue_full(priority)
+            self.check(client, model, routes, priority)
+            if idle:
+                self.active += 1
+                return self.admitted(priority)
+            waiter = asyncio.get_running_loop().create_future()
+            self.queue.push(priority, client, waiter)
+        queued_at = self.clock()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if not waiter.done():
+                    waiter.cancel()
+                    self.queue.remove(priority, client, waiter)
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    raise self.timed_out(priority)
+            if isinstance(e, asyncio.CancelledError):
+                # Granted just as the request went away: pass the slot on
+                self.release()
+                raise
+        return self.admitted(priority, queued_at)
+
+    def release(self, held=None):
+        with self._lock:
+            if held is not None:
+                self.hold_seconds += (held - self.hold_seconds) * 0.1
+            waiter = self.queue.pop()
+            if waiter is None:
+                self.active -= 1
+            else:
+                waiter.set_result(True)
+
+def admission_from_env(env, provider_limits=None, asynchronous=False):
+    """Build the controller from CLIENT_RATE_LIMIT, MODEL_RATE_LIMITS and ADMISSION_* settings."""
+    controller = AsyncAdmissionController if asynchronous else AdmissionController
+    return controller(
+        max_concurrent=int(env.get('ADMISSION_MAX_CONCURRENT', 32)),
+        max_queue=int(env.get('ADMISSION_MAX_QUEUE', 64)),
+        queue_timeout=float(env.get('ADMISSION_QUEUE_TIMEOUT', 30)),
+        rate_limiter=RateLimiter(
+            client_rate=float(env.get('CLIENT_RATE_LIMIT', 0)),
+            client_burst=int(env.get('CLIENT_RATE_BURST', 10)),
+            model_rates=json.loads(env.get('MODEL_RATE_LIMITS') or '{}'),
+            model_burst=int(env.get('MODEL_RATE_BURST', 10)),
+        ),
+        provider_limits=provider_limits,
+    )
@@ -1,40 +1,213 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_migrate import Migrate
-from openai import OpenAI
-import anthropic
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.orm import load_only
 import os
-import time
+import hashlib
+import itertools
+import json
 import logging
-import requests
-import yfinance as yf
+import sys
+import threading
+import time
+from admission import AdmissionRejected, ProviderRateLimits, admission_from_env, request_priority
+from blob_store import BlobStore, data_url_media_type, parse_data_url
+from context_cache import ContextMessage, ConversationContextCache
+from database import configure_engine, database_url_from_env, engine_options_from_env
+from jobs import JobRunner, delete_in_chunks, serialize_job, update_in_chunks
+from context_window import IMAGE_TOKEN_ESTIMATE, ContextWindow, estimate_tokens
+from metrics import CACHE_REQUESTS, CONTENT_TYPE, RequestTrace, observe_queries, observe_usage, registry as metrics_registry, request_logger
+from model_catalog import catalog_from_env
+from pagination import before, collect_page, parse_page_request, stream_json_page
+from pricing import PricingEngine, TurnUsage
+from prompt_cache import cached_tools, with_cache_breakpoints
+from provider_router import CircuitBreaker, LatencyTracker, ProviderRouter, RetryPolicy
+from providers import OPENROUTER_BASE_URL, AnthropicRoute, LazyClient, OpenRouterRoute
+from response_cache import response_cache_from_env, response_cache_key
+from search import SEARCH_CONFIG, MessageSearch, create_sqlite_search, parse_search_request, search_page
+from stats_reconciler import StatsReconciler
+from summaries import SUMMARY_CONTEXT_PREFIX, SUMMARY_SYSTEM_PROMPT, ConversationSummarizer
+from tool_cache import ToolResultCache
+from tools import Tool, ToolRegistry
+from unit_of_work import GroupCommitter, TurnJournal
+from wire import MIN_COMPRESS_SIZE, compress, compress_chunks, is_msgpack, negotiate_encoding, negotiate_mimetype, pack, should_compress
 
 app = Flask(__name__)
 CORS(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat_history.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url_from_env()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['BLOB_STORE_PATH'] = os.getenv('BLOB_STORE_PATH', os.path.join(app.instance_path, 'blobs'))
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
-openrouter_client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENROUTER_API_KEY"),
+with app.app_context():
+    configure_engine(db.engine)
+    observe_queries(db.engine)
+
+blob_store = BlobStore(app.config['BLOB_STORE_PATH'])
+
+# Retries happen in provider_router, so the SDKs' own retries are off
+PROVIDER_TIMEOUT = float(os.getenv('PROVIDER_TIMEOUT', 60))
+
+# Fed by the rate-limit headers of every provider response
+provider_limits = ProviderRateLimits()
+
+def create_openrouter_client():
+    from openai import DefaultHttpxClient, OpenAI
+    return OpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        max_retries=0,
+        timeout=PROVIDER_TIMEOUT,
+        http_client=DefaultHttpxClient(event_hooks=provider_limits.response_hooks('openrouter')),
+    )
+
+def create_anthropic_client():
+    import anthropic
+    return anthropic.Anthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"),
+        max_retries=0,
+        timeout=PROVIDER_TIMEOUT,
+        http_client=anthropic.DefaultHttpxClient(event_hooks=provider_limits.response_hooks('anthropic')),
+    )
+
+# The SDKs are imported when a chat first needs them
+openrouter_client = LazyClient(create_openrouter_client)
+anthropic_client = LazyClient(create_anthropic_client)
+
+admission = admission_from_env(os.environ, provider_limits)
+
+provider_router = ProviderRouter(
+    RetryPolicy(
+        max_attempts=int(os.getenv('PROVIDER_MAX_ATTEMPTS', 3)),
+        base_delay=float(os.getenv('PROVIDER_RETRY_BASE_DELAY', 0.5)),
+        max_delay=float(os.getenv('PROVIDER_RETRY_MAX_DELAY', 8)),
+    ),
+    CircuitBreaker(
+        threshold=int(os.getenv('CIRCUIT_BREAKER_THRESHOLD', 5)),
+        reset_after=float(os.getenv('CIRCUIT_BREAKER_RESET', 30)),
+    ),
+    LatencyTracker(default_delay=float(os.getenv('PROVIDER_HEDGE_DELAY', 5))),
+    hedging=os.getenv('PROVIDER_HEDGING', 'false').lower() in ('1', 'true', 'yes'),
+    # Room for every admitted turn's call and its hedge
+    max_workers=2 * admission.max_concurrent,
+    limits=provider_limits,
+)
+
+context_cache = ConversationContextCache(estimate_tokens, max_conversations=int(os.getenv('CONTEXT_CACHE_SIZE', 256)))
+
+DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', 'claude-3-haiku-20240307')
+
+model_catalog = catalog_from_env(os.environ, default_model=DEFAULT_MODEL)
+
+pricing = PricingEngine(model_catalog.prices())
+
+response_cache = response_cache_from_env(os.path.join(app.instance_path, 'response_cache.db'))
+
+context_window = ContextWindow(model_catalog.context_limits(), token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 32000)))
+
+tool_cache = ToolResultCache(max_entries=int(os.getenv('TOOL_CACHE_SIZE', 1024)))
+
+tool_registry = ToolRegistry(tool_cache, max_workers=int(os.getenv('TOOL_MAX_WORKERS', 8)))
+
+def tool_cache_requests():
+    stats = tool_cache.stats()
+    return [({"result": result}, stats[result]) for result in ('hits', 'misses', 'coalesced')]
+
+metrics_registry.collector('tool_cache_requests', "Tool cache lookups by result", tool_cache_requests)
+
+MAX_TOKENS = 2000
+
+# Put Anthropic cache breakpoints on the tools and the conversation prefix
+PROMPT_CACHING = os.getenv('ANTHROPIC_PROMPT_CACHING', 'true').lower() in ('1', 'true', 'yes')
+
+# Model calls allowed after the first one while it keeps asking for tools
+MAX_TOOL_ITERATIONS = int(os.getenv('MAX_TOOL_ITERATIONS', 5))
+
+OPENROUTER_HEADERS = {
+    "HTTP-Referer": "http://localhost:3000",
+    "X-Title": "AI Chatbot",
+}
+
+# OpenRouter models tried, in order, when a model's own provider fails
+DEFAULT_MODEL_FALLBACKS = {
+    'claude-3-haiku-20240307': ['anthropic/claude-3-haiku'],
+    'claude-3-5-sonnet-20240620': ['anthropic/claude-3.5-sonnet'],
+    'claude-3-opus-20240229': ['anthropic/claude-3-opus'],
+}
+MODEL_FALLBACKS = json.loads(os.getenv('MODEL_FALLBACKS', 'null')) or DEFAULT_MODEL_FALLBACKS
+
+# Rows deleted per transaction by background jobs
+JOB_CHUNK_SIZE = int(os.getenv('JOB_CHUNK_SIZE', 500))
+
+# Messages older than this are pruned in the background; 0 keeps them forever
+MESSAGE_RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS', 0))
+
+JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', 7))
+
+# Unreferenced image blobs younger than this are kept; their message may not be saved yet
+BLOB_GC_GRACE = int(os.getenv('BLOB_GC_GRACE', 3600))
+
+# Conversations whose unsummarized turns pass SUMMARY_TRIGGER_TOKENS get their
+# older turns condensed in the background; 0 turns summaries off
+summarizer = ConversationSummarizer(
+    trigger_tokens=int(os.getenv('SUMMARY_TRIGGER_TOKENS', 24000)),
+    keep_tokens=int(os.getenv('SUMMARY_KEEP_TOKENS', 8000)),
 )
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'claude-3-haiku-20240307')
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', 1024))
+
+# Batch the commits of concurrent chat turns into one transaction
+GROUP_COMMIT = os.getenv('GROUP_COMMIT', 'false').lower() in ('1', 'true', 'yes')
 
-anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+# Admission priority per client key, e.g. {"batch-key": "batch"}
+CLIENT_PRIORITIES = json.loads(os.getenv('CLIENT_PRIORITIES') or '{}')
+DEFAULT_PRIORITY = os.getenv('DEFAULT_PRIORITY', 'default')
+
+TOOL_FOLLOW_UP_SYSTEM_PROMPT = "You are an AI assistant. Provide a concise and informative response based on the provided information."
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+# One JSON line per chat request on stdout, with its stage timings
+if os.getenv('REQUEST_LOG', 'true').lower() in ('1', 'true', 'yes'):
+    request_log_handler = logging.StreamHandler(sys.stdout)
+    request_log_handler.setFormatter(logging.Formatter('%(message)s'))
+    request_logger.addHandler(request_log_handler)
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
 # Model definitions
+def default_token_estimate(context):
+    return estimate_tokens(context.get_current_parameters()['content'])
+
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Soft-delete markers; a background job removes the rows later
+    deleted_at = db.Column(db.DateTime, index=True)
+    cleared_through_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 class ChatMessage(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_message_conversation_id_timestamp', 'conversation_id', 'timestamp'),
+        # Context cache watermark: count, min and max id of a conversation from the index alone
+        db.Index('ix_chat_message_conversation_id_id', 'conversation_id', 'id'),
+        # Full-text search on Postgres; SQLite gets an FTS5 table instead
+        db.Index(
+            'ix_chat_message_content_search',
+            func.to_tsvector(SEARCH_CONFIG, db.text('content')),
+            postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+        # A reset hides messages up to an id, so ids of purged rows must never come back
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
     role = db.Column(db.String(10), nullable=False)
@@ -44,64 +217,857 @@ class ChatMessage(db.Model):
     tokens_prompt = db.Column(db.Integer)
     tokens_completion = db.Column(db.Integer)
     total_cost = db.Column(db.Float)
-    image_data = db.Column(db.Text)
+    # Set once OpenRouter's generation stats replace the estimate made at reply time
+    stats_reconciled_at = db.Column(db.DateTime)
+    image_hash = db.Column(db.String(64), index=True)
+    image_media_type = db.Column(db.String(50))
+    token_estimate = db.Column(db.Integer, default=default_token_estimate)
+    cached = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    tokens_cache_read = db.Column(db.Integer)
+    tokens_cache_creation = db.Column(db.Integer)
+    model = db.Column(db.String(100))
+
+create_sqlite_search(ChatMessage.__table__)
+
+class ConversationSummary(db.Model):
+    # Versioned: each summary folds the previous one and the turns after it
+    # into a new row, covering first_message_id through through_message_id
+    __table_args__ = (
+        db.UniqueConstraint('conversation_id', 'version', name='uq_conversation_summary_version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    through_message_id = db.Column(db.Integer, nullable=False)
+    model = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ProviderCall(db.Model):
+    # A usage ledger: rows outlive the messages and conversations they were
+    # billed for, so the ids are plain columns rather than foreign keys.
+    # Message ids are never reused, so a purged message's id stays unambiguous
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, nullable=False, index=True)
+    message_id = db.Column(db.Integer, index=True)
+    provider = db.Column(db.String(20), nullable=False)
+    model = db.Column(db.String(100), nullable=False, index=True)
+    generation_id = db.Column(db.String(50), index=True)
+    tokens_prompt = db.Column(db.Integer)
+    tokens_completion = db.Column(db.Integer)
+    tokens_cache_read = db.Column(db.Integer)
+    tokens_cache_creation = db.Column(db.Integer)
+    cost = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, nullable=False)
+    locked_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+job_runner = JobRunner(db, Job, app.app_context, poll_interval=float(os.getenv('JOB_POLL_INTERVAL', 1)))
+
+# User messages wait here, not in an open transaction, while the reply is generated
+turn_journal = TurnJournal(
+    os.getenv('TURN_JOURNAL_PATH', os.path.join(app.instance_path, 'turns')),
+    fsync=os.getenv('TURN_JOURNAL_FSYNC', 'false').lower() in ('1', 'true', 'yes'),
+)
+
+group_committer = GroupCommitter(
+    db,
+    app.app_context,
+    window=float(os.getenv('GROUP_COMMIT_WINDOW', 0)),
+    max_batch=int(os.getenv('GROUP_COMMIT_MAX_BATCH', 64)),
+) if GROUP_COMMIT else None
+
+# Guards the discarded hedge replies a turn holds until its conversation has an id
+discarded_calls_lock = threading.Lock()
 
 # Tools
-tools = [
-    {
-        "name": "fetch_stock_data",
-        "description": "A function that fetches the current stock price for a given ticker symbol.",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "ticker": {
-                    "type": "string",
-                    "description": "The stock ticker symbol."
-                }
+tool_registry.register(Tool(
+    name="fetch_stock_data",
+    description="A function that fetches the current stock price for a given ticker symbol.",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "ticker": {
+                "type": "string",
+                "description": "The stock ticker symbol."
+            }
+        },
+        "required": ["ticker"]
+    },
+    handler=lambda tool_input: fetch_stock_data(tool_input["ticker"]),
+    # Upper-case tickers so AAPL and aapl share a cache entry
+    normalize=lambda tool_input: {"ticker": tool_input["ticker"].strip().upper()},
+    timeout=int(os.getenv('STOCK_DATA_TIMEOUT', 10)),
+    cache_ttl=int(os.getenv('STOCK_DATA_CACHE_TTL', 60)),
+))
+
+tools = tool_registry.specs()
+
+claude_tools = cached_tools(tools)
+
+TOOLS_TOKEN_ESTIMATE = estimate_tokens(json.dumps(tools))
+
+# Helper functions
+def yfinance_stock_info(ticker):
+    # yfinance pulls in pandas and numpy, so it is imported on the first lookup
+    import yfinance as yf
+    return yf.Ticker(ticker).info
+
+# Swap for a stub to run tool calls offline
+stock_data_source = yfinance_stock_info
+
+def fetch_stock_data(ticker): 
+    stock_info = stock_data_source(ticker)
+    return f"Here's the full stock information for {ticker}:\n{stock_info}"
+
+def read_image(image_data):
+    if not image_data:
+        return None
+    return parse_data_url(image_data)
+
+def image_url(message):
+    return f"/api/images/{message.image_hash}" if message.image_hash else None
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+# Fields the list endpoints can return, with the columns each one needs
+MESSAGE_FIELDS = {
+    'id': ((), lambda msg: msg.id),
+    'role': ((ChatMessage.role,), lambda msg: msg.role),
+    'content': ((ChatMessage.content,), lambda msg: msg.content),
+    'timestamp': ((), lambda msg: isoformat(msg.timestamp)),
+    'tokens_prompt': ((ChatMessage.tokens_prompt,), lambda msg: msg.tokens_prompt),
+    'tokens_completion': ((ChatMessage.tokens_completion,), lambda msg: msg.tokens_completion),
+    'tokens_cache_read': ((ChatMessage.tokens_cache_read,), lambda msg: msg.tokens_cache_read),
+    'tokens_cache_creation': ((ChatMessage.tokens_cache_creation,), lambda msg: msg.tokens_cache_creation),
+    'total_cost': ((ChatMessage.total_cost,), lambda msg: msg.total_cost),
+    'image_url': ((ChatMessage.image_hash,), image_url),
+    'cached': ((ChatMessage.cached,), lambda msg: msg.cached),
+    'model': ((ChatMessage.model,), lambda msg: msg.model),
+}
+
+CONVERSATION_FIELDS = {
+    'id': ((), lambda conv: conv.id),
+    'name': ((Conversation.name,), lambda conv: conv.name),
+    'created_at': ((), lambda conv: isoformat(conv.created_at)),
+}
+
+def serialize_fields(row, field_map, fields):
+    return {field: field_map[field][1](row) for field in fields}
+
+def load_fields(field_map, fields, *always):
+    return load_only(*always, *[column for field in fields for column in field_map[field][0]])
+
+def cleared_through_statement(conversation_id):
+    # NULL for a deleted or missing conversation, so comparisons against it hide everything
+    return (
+        select(Conversation.cleared_through_id)
+        .where(Conversation.id == conversation_id, Conversation.deleted_at.is_(None))
+        .scalar_subquery()
+    )
+
+def visible_messages(conversation_id):
+    # Messages up to the reset watermark, or of a deleted conversation, stay in the table until a job purges them
+    return ChatMessage.conversation_id == conversation_id, ChatMessage.id > cleared_through_statement(conversation_id)
+
+def latest_summary_statement(conversation_id):
+    return (
+        select(ConversationSummary)
+        # Summaries from before a reset cover messages that are gone
+        .where(ConversationSummary.conversation_id == conversation_id, ConversationSummary.through_message_id > cleared_through_statement(conversation_id))
+        .order_by(ConversationSummary.version.desc())
+        .limit(1)
+    )
+
+def context_watermark_statement(conversation_id):
+    # One cheap row telling whether a cached context is still what the database holds
+    messages = select(func.count(ChatMessage.id), func.min(ChatMessage.id), func.max(ChatMessage.id)).where(*visible_messages(conversation_id)).subquery()
+    return select(
+        messages,
+        cleared_through_statement(conversation_id),
+        select(func.max(ConversationSummary.version)).where(ConversationSummary.conversation_id == conversation_id).scalar_subquery(),
+    )
+
+def unsummarized_messages(conversation_id, summary):
+    criteria = visible_messages(conversation_id)
+    return (*criteria, ChatMessage.id > summary.through_message_id) if summary else criteria
+
+def context_messages(summary, messages):
+    # The summary opens the context as a user turn, in place of the turns it covers
+    if summary is None:
+        return messages
+    return [ContextMessage(summary.through_message_id, 'user', SUMMARY_CONTEXT_PREFIX + summary.content, None), *messages]
+
+def message_page_ids(conversation_id, page):
+    newest_first = select(ChatMessage.id).where(*visible_messages(conversation_id))
+    if page.cursor:
+        newest_first = newest_first.where(before(ChatMessage.timestamp, ChatMessage.id, page.cursor))
+    return newest_first.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(page.limit).subquery()
+
+def message_page_statement(conversation_id, page):
+    newest_first = message_page_ids(conversation_id, page)
+    # Pick the newest page, then return it oldest first for display
+    return select(ChatMessage).options(
+        load_fields(MESSAGE_FIELDS, page.fields, ChatMessage.timestamp)
+    ).join(newest_first, ChatMessage.id == newest_first.c.id).order_by(ChatMessage.timestamp, ChatMessage.id)
+
+def history_version_statement(conversation_id, page):
+    # Everything that can change a history page moves one of these: a new
+    # turn, a reset or purge, or generation stats landing on a reply
+    visible = select(ChatMessage.id).where(*visible_messages(conversation_id)).subquery()
+    page_ids = message_page_ids(conversation_id, page)
+    with_stats = select(
+        func.count(ChatMessage.total_cost) + func.count(ChatMessage.tokens_prompt)
+    ).where(ChatMessage.id.in_(select(page_ids.c.id))).scalar_subquery()
+    return select(func.count(), func.max(visible.c.id), with_stats).select_from(visible)
+
+def history_etag(version, mimetype, query_string):
+    return hashlib.sha1(json.dumps([list(version), mimetype, query_string]).encode()).hexdigest()
+
+def older_messages_statement(conversation_id, key):
+    return select(exists().where(
+        *visible_messages(conversation_id),
+        before(ChatMessage.timestamp, ChatMessage.id, key)
+    ))
+
+def conversation_page_statement(page):
+    statement = select(Conversation).options(
+        load_fields(CONVERSATION_FIELDS, page.fields, Conversation.created_at)
+    ).where(Conversation.deleted_at.is_(None))
+    if page.cursor:
+        statement = statement.where(before(Conversation.created_at, Conversation.id, page.cursor))
+    return statement.order_by(Conversation.created_at.desc(), Conversation.id.desc()).limit(page.limit)
+
+def older_conversations_statement(key):
+    return select(exists().where(Conversation.deleted_at.is_(None), before(Conversation.created_at, Conversation.id, key)))
+
+def start_chat_turn(user_message, image, conversation_id, model):
+    """Journal the user's message; its row is written along with the reply."""
+    turn = {
+        "conversation_id": conversation_id or None,
+        "model": model,
+        "content": user_message or "",
+        "image_hash": None,
+        "image_media_type": None,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+    if image:
+        turn['image_media_type'], image_bytes = image
+        turn['image_hash'] = blob_store.put(image_bytes)
+    return turn_journal.begin(turn)
+
+def turn_context(turn, context):
+    # The user's message is still pending, so add it to the committed history by hand
+    return context_cache.extend(context, ContextMessage(None, 'user', turn['content'], None))
+
+def new_conversation(count):
+    return Conversation(name=f"Conversation {count + 1}")
+
+def user_message_row(turn, conversation_id):
+    return ChatMessage(
+        conversation_id=conversation_id,
+        role='user',
+        content=turn['content'],
+        image_hash=turn['image_hash'],
+        image_media_type=turn['image_media_type'],
+        timestamp=datetime.fromisoformat(turn['timestamp']),
+        model=turn.get('model')
+    )
+
+def assistant_message_row(turn, conversation_id, reply):
+    stats = reply['usage'].stats()
+    return ChatMessage(
+        conversation_id=conversation_id,
+        role='assistant',
+        model=turn.get('model'),
+        content=reply['message'],
+        generation_id=reply['generation_id'],
+        tokens_prompt=stats['tokens_prompt'],
+        tokens_completion=stats['tokens_completion'],
+        tokens_cache_read=stats['tokens_cache_read'],
+        tokens_cache_creation=stats['tokens_cache_creation'],
+        total_cost=stats['total_cost'],
+        cached=reply['cached']
+    )
+
+def chat_reply(bot_message, generation_id, usage, cached=False):
+    return {"message": bot_message, "generation_id": generation_id, "usage": usage, "cached": cached}
+
+def summary_job(conversation_id, messages):
+    """A summary job for the conversation if this turn takes its context past the trigger."""
+    tokens = context_cache.tokens(conversation_id)
+    if tokens is not None:
+        tokens += sum(estimate_tokens(content) for message_id, role, content in messages)
+    if summarizer.should_request(conversation_id, tokens):
+        return job_runner.job('summarize_conversation', conversation_id=conversation_id)
+    return None
+
+def write_turn(session, turn, reply=None):
+    """Add a turn's rows to `session` and flush them for their ids; the caller commits.
+
+    Without a reply only the conversation and the user's message are
+    written, as for a turn whose provider call failed.
+    """
+    conversation_id = turn['conversation_id']
+    if not conversation_id:
+        conversation = new_conversation(session.scalar(select(func.count()).select_from(Conversation)))
+        session.add(conversation)
+        session.flush()
+        conversation_id = conversation.id
+    user_message = user_message_row(turn, conversation_id)
+    session.add(user_message)
+    session.flush()
+    written = {"conversation_id": conversation_id, "messages": [(user_message.id, 'user', turn['content'])], "message_id": None}
+    if reply is not None:
+        new_message = assistant_message_row(turn, conversation_id, reply)
+        session.add(new_message)
+        session.flush()
+        session.add_all(provider_calls(conversation_id, new_message.id, reply['usage']))
+        written['messages'].append((new_message.id, 'assistant', reply['message']))
+        written['message_id'] = new_message.id
+    # Enqueued with the turn, so requesting a summary costs no commit of its own
+    job = summary_job(conversation_id, written['messages'])
+    if job:
+        session.add(job)
+        written['summary_requested'] = True
+    return written
+
+def turn_written(turn, written):
+    turn_journal.end(turn)
+    with discarded_calls_lock:
+        turn['written_conversation_id'] = written['conversation_id']
+        discarded_calls = turn.pop('discarded_calls', None)
+    if discarded_calls:
+        save_discarded_calls(written['conversation_id'], discarded_calls)
+    for message_id, role, content in written['messages']:
+        context_cache.append(written['conversation_id'], ContextMessage(message_id, role, content, None))
+    if written.get('summary_requested'):
+        job_runner.wake()
+
+def commit_turn(turn, reply=None):
+    def write(session):
+        return write_turn(session, turn, reply)
+
+    if group_committer:
+        return group_committer.submit(write, on_commit=lambda written: turn_written(turn, written))
+    written = write(db.session)
+    db.session.commit()
+    turn_written(turn, written)
+    return written
+
+def get_conversation_context(conversation_id):
+    watermark = tuple(db.session.execute(context_watermark_statement(conversation_id)).one())
+    context = context_cache.get(conversation_id, watermark)
+    CACHE_REQUESTS.inc(cache='context', result='miss' if context is None else 'hit')
+    if context is None:
+        summary = db.session.scalars(latest_summary_statement(conversation_id)).first()
+        chat_history = ChatMessage.query.filter(*unsummarized_messages(conversation_id, summary)).options(
+            load_only(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.token_estimate)
+        ).order_by(ChatMessage.timestamp).all()
+        context = context_cache.load(conversation_id, context_messages(summary, chat_history), watermark)
+    return context
+
+def window_context(context, model, image_data):
+    reserved_tokens = MAX_TOKENS + TOOLS_TOKEN_ESTIMATE + (IMAGE_TOKEN_ESTIMATE if image_data else 0)
+    if 'claude' in model:
+        return context_window.trim(model, context.claude_messages, context.claude_tokens, reserved_tokens)
+    return context_window.trim(model, context.openrouter_messages, context.openrouter_tokens, reserved_tokens)
+
+def provider_messages(model, history, user_message, image_data):
+    if 'claude' in model:
+        return build_claude_messages(history, user_message, image_data)
+    return build_openrouter_messages(history, user_message, image_data)
+
+def response_key(model, messages):
+    if response_cache is None:
+        return None
+    return response_cache_key(model, messages, tools if 'claude' in model else None, MAX_TOKENS)
+
+def lookup_response(cache_key):
+    if not cache_key:
+        return None
+    bot_message = response_cache.get(cache_key)
+    CACHE_REQUESTS.inc(cache='response', result='miss' if bot_message is None else 'hit')
+    return bot_message
+
+def store_response(cache_key, bot_message, tools_used):
+    # Replies built from live tool output (stock prices) go stale, so only
+    # cache them when every tool involved is marked cacheable
+    if cache_key and bot_message and tool_registry.cacheable(tools_used):
+        response_cache.set(cache_key, bot_message)
+
+def build_claude_messages(history, user_message, image_data):
+    formatted_messages = history
+
+    if image_data:
+        image_content = {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": data_url_media_type(image_data),
+                "data": image_data.split(',')[1] if ',' in image_data else image_data,
             },
-            "required": ["ticker"]
         }
-    }
-]
 
-# Helper functions
-def get_claude_costs(model):
-    costs = {
-        'claude-3-5-sonnet-20240620': (3.00, 15.00),
-        'claude-3-opus-20240229': (15.00, 75.00),
-        'claude-3-sonnet-20240229': (3.00, 15.00),
-        'claude-3-haiku-20240307': (0.25, 1.25)
+        if formatted_messages[-1]['role'] == 'user':
+            if isinstance(formatted_messages[-1]['content'], str):
+                formatted_messages[-1]['content'] = [{"type": "text", "text": formatted_messages[-1]['content']}]
+            formatted_messages[-1]['content'].append(image_content)
+        else:
+            formatted_messages.append({"role": "user", "content": [image_content]})
+
+        if user_message:
+            formatted_messages[-1]['content'].append({"type": "text", "text": user_message})
+    return formatted_messages
+
+def build_openrouter_messages(history, user_message, image_data):
+    messages = history
+
+    if image_data:
+        messages.append({
+            "role": "user",
+            "content": [
+                {"type": "text", "text": user_message or ""},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_data,
+                    }
+                }
+            ]
+        })
+    else:
+        messages.append({"role": "user", "content": user_message})
+
+    messages.insert(0, {"role": "system", "content": "You are an AI assistant."})
+    return messages
+
+def model_routes(model):
+    primary = AnthropicRoute(anthropic_client, model) if 'claude' in model else OpenRouterRoute(openrouter_client, model, OPENROUTER_HEADERS)
+    return [primary, *(OpenRouterRoute(openrouter_client, fallback, OPENROUTER_HEADERS) for fallback in MODEL_FALLBACKS.get(model, []))]
+
+def client_key():
+    # There are no user accounts, so callers are told apart by key or address
+    return request.headers.get('X-API-Key') or request.remote_addr or 'unknown'
+
+def admit_chat(model):
+    """Wait for an admission slot for this chat turn; None once admitted, else a 429 response."""
+    client = client_key()
+    priority = request_priority(CLIENT_PRIORITIES.get(client, DEFAULT_PRIORITY), request.headers.get('X-Priority'))
+    try:
+        g.admission_slot = admission.admit(client, model, priority, model_routes(model))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected chat from {client}: {e.reason}")
+        response = jsonify({"error": e.reason})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    return None
+
+def claude_request(messages, system=None):
+    request = {"max_tokens": MAX_TOKENS, "messages": messages, "tools": tools}
+    if PROMPT_CACHING:
+        request.update(messages=with_cache_breakpoints(messages), tools=claude_tools)
+    if system:
+        request["system"] = system
+    return request
+
+def openrouter_request(messages):
+    return {"max_tokens": MAX_TOKENS, "messages": messages}
+
+def summary_request(prompt):
+    # OpenRouter routes take the Claude request shape too
+    return {"max_tokens": SUMMARY_MAX_TOKENS, "system": SUMMARY_SYSTEM_PROMPT, "messages": [{"role": "user", "content": prompt}]}
+
+def record_usage(usage, route, response):
+    if route.provider == 'anthropic':
+        usage.add_claude(route.model, response.usage)
+    else:
+        # OpenRouter replies are translated to Claude's shape, usage included
+        usage.add(route.provider, route.model, response.usage.input_tokens, response.usage.output_tokens, generation_id=response.id)
+    observe_usage(usage.calls[-1])
+
+def tool_uses(response):
+    return [block for block in response.content if block.type == "tool_use"]
+
+def response_text(response):
+    return "".join(block.text for block in response.content if block.type == "text").strip()
+
+def build_tool_follow_up(formatted_messages, response, tool_results):
+    return [
+        *formatted_messages,
+        {"role": "assistant", "content": response.content},
+        {"role": "user", "content": tool_results}
+    ]
+
+def wants_tools(response, iteration):
+    if response.stop_reason != 'tool_use' or not tool_uses(response):
+        return False
+    if iteration >= MAX_TOOL_ITERATIONS:
+        logger.warning(f"Stopping tool loop after {MAX_TOOL_ITERATIONS} iterations")
+        return False
+    return True
+
+def provider_calls(conversation_id, message_id, usage):
+    return [ProviderCall(conversation_id=conversation_id, message_id=message_id, **call) for call in usage.calls]
+
+def reply_calls(route, response):
+    usage = TurnUsage(pricing)
+    record_usage(usage, route, response)
+    return usage.calls
+
+def save_discarded_calls(conversation_id, calls):
+    # The slower reply of a hedged request is billed like any other, but belongs to no message
+    with app.app_context():
+        db.session.add_all(ProviderCall(conversation_id=conversation_id, message_id=None, **call) for call in calls)
+        db.session.commit()
+
+def discarded_reply(turn):
+    """on_discarded callback for provider_router.create that bills the reply to the turn's conversation."""
+    def record(route, response):
+        calls = reply_calls(route, response)
+        with discarded_calls_lock:
+            conversation_id = turn['conversation_id'] or turn.get('written_conversation_id')
+            if conversation_id is None:
+                # A new conversation has no id until the turn is written; turn_written saves them then
+                turn.setdefault('discarded_calls', []).extend(calls)
+                return
+        save_discarded_calls(conversation_id, calls)
+    return record
+
+def generation_stats_update(stats):
+    return {
+        ProviderCall.tokens_prompt: stats['tokens_prompt'],
+        ProviderCall.tokens_completion: stats['tokens_completion'],
+        ProviderCall.cost: stats['total_cost'],
     }
-    return costs.get(model, (0, 0))
 
-def fetch_stock_data(ticker): 
+def save_generation_stats(message_id, stats):
+    with app.app_context():
+        message = db.session.get(ChatMessage, message_id)
+        if message is None:
+            return
+        message.tokens_prompt = stats['tokens_prompt']
+        message.tokens_completion = stats['tokens_completion']
+        message.total_cost = stats['total_cost']
+        message.stats_reconciled_at = datetime.utcnow()
+        ProviderCall.query.filter_by(generation_id=message.generation_id).update(generation_stats_update(stats))
+        db.session.commit()
+
+stats_reconciler = StatsReconciler(on_stats=save_generation_stats)
+
+message_search = MessageSearch(ChatMessage, Conversation)
+
+def finish_chat_turn(turn, bot_message, generation_id, usage, cached=False):
+    """Write the user's message and the reply in one transaction."""
+    written = commit_turn(turn, chat_reply(bot_message, generation_id, usage, cached))
+    if generation_id:
+        stats_reconciler.submit(written['message_id'], generation_id)
+    return written
+
+def abandon_chat_turn(turn):
+    """Keep the user's message of a turn that got no reply, returning its conversation id."""
+    if not turn_journal.is_pending(turn):
+        return None
     try:
-        stock = yf.Ticker(ticker)
-        stock_info = stock.info
-        return f"Here's the full stock information for {ticker}:\n{stock_info}"
+        return commit_turn(turn)['conversation_id']
     except Exception as e:
-        return f"Error fetching data for {ticker}: {str(e)}"
+        db.session.rollback()
+        # It stays in the journal and is recovered on the next start
+        logger.error(f"Could not save the user message of a failed turn: {str(e)}", exc_info=True)
+        return None
 
-def process_tool_call(tool_name, tool_input):
-    if tool_name == "fetch_stock_data":
-        ticker = tool_input["ticker"]
-        return fetch_stock_data(ticker)
-    else:
-        return f"Unsupported tool: {tool_name}"
+def recover_turns():
+    def write(turns):
+        for turn in turns:
+            if turn['conversation_id'] and live_conversation(turn['conversation_id']) is None:
+                continue
+            write_turn(db.session, turn)
+        db.session.commit()
+
+    turn_journal.recover(write)
+
+def trace_turn(request_trace, written, usage, cached, tools_used):
+    request_trace.set(
+        conversation_id=written['conversation_id'],
+        message_id=written['message_id'],
+        cached=cached,
+        tools=sorted(tools_used),
+        routes=[f"{call['provider']}:{call['model']}" for call in usage.calls],
+        **usage.stats()
+    )
+
+def usage_rollup_statement(group_by, conversation_id=None, since=None):
+    statement = select(
+        group_by,
+        func.count(ProviderCall.id),
+        func.sum(ProviderCall.tokens_prompt),
+        func.sum(ProviderCall.tokens_completion),
+        func.sum(ProviderCall.tokens_cache_read),
+        func.sum(ProviderCall.tokens_cache_creation),
+        func.sum(ProviderCall.cost),
+    ).group_by(group_by).order_by(func.sum(ProviderCall.cost).desc())
+    if conversation_id is not None:
+        statement = statement.where(ProviderCall.conversation_id == conversation_id)
+    if since is not None:
+        statement = statement.where(ProviderCall.created_at >= since)
+    return statement
+
+def serialize_rollup(key, row):
+    group, calls, tokens_prompt, tokens_completion, tokens_cache_read, tokens_cache_creation, total_cost = row
+    return {
+        key: group,
+        "calls": calls,
+        "tokens_prompt": tokens_prompt or 0,
+        "tokens_completion": tokens_completion or 0,
+        "tokens_cache_read": tokens_cache_read or 0,
+        "tokens_cache_creation": tokens_cache_creation or 0,
+        "total_cost": total_cost or 0.0,
+    }
+
+def parse_usage_filters(args):
+    since = args.get('since')
+    return {
+        'conversation_id': args.get('conversation_id', type=int),
+        'since': datetime.fromisoformat(since) if since else None,
+    }
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
     
-ALLOWED_MODELS = [
-    'claude-3-haiku-20240307',
-    'claude-3-5-sonnet-20240620',
-    'claude-3-opus-20240229',
-    'openai/gpt-4o-2024-08-06',
-    'openai/gpt-4o-mini-2024-07-18'
-]
+
+# Background jobs
+@job_runner.handler('delete_conversation')
+def delete_conversation_job(conversation_id):
+    images = image_hashes(ChatMessage.conversation_id == conversation_id)
+    delete_in_chunks(db.session, ChatMessage, ChatMessage.conversation_id == conversation_id, chunk_size=JOB_CHUNK_SIZE)
+    # A turn may have landed since the last chunk, take it with the conversation
+    db.session.execute(delete(ChatMessage).where(ChatMessage.conversation_id == conversation_id))
+    db.session.execute(delete(ConversationSummary).where(ConversationSummary.conversation_id == conversation_id))
+    db.session.execute(delete(Conversation).where(Conversation.id == conversation_id))
+    db.session.commit()
+    collect_blobs(images)
+
+@job_runner.handler('summarize_conversation')
+def summarize_conversation_job(conversation_id):
+    if live_conversation(conversation_id) is None:
+        return
+    summary = db.session.scalars(latest_summary_statement(conversation_id)).first()
+    messages = ChatMessage.query.filter(*unsummarized_messages(conversation_id, summary)).options(
+        load_only(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.token_estimate)
+    ).order_by(ChatMessage.timestamp).all()
+    tokens = [message.token_estimate or estimate_tokens(message.content) for message in messages]
+    count = summarizer.split(messages, tokens, estimate_tokens(summary.content) if summary else 0)
+    if not count:
+        return
+    covered = messages[:count]
+    first_message_id = summary.first_message_id if summary else covered[0].id
+    through_message_id = covered[-1].id
+    prompt = summarizer.prompt(summary.content if summary else None, covered)
+    # No transaction stays open while the model writes
+    db.session.rollback()
+
+    usage = TurnUsage(pricing)
+    route, response = provider_router.create(
+        model_routes(SUMMARY_MODEL),
+        summary_request(prompt),
+        on_discarded=lambda route, response: save_discarded_calls(conversation_id, reply_calls(route, response))
+    )
+    record_usage(usage, route, response)
+    content = response_text(response)
+    if not content:
+        raise ValueError(f"{route.name} returned an empty summary")
+    latest_version = db.session.scalar(
+        select(func.max(ConversationSummary.version)).where(ConversationSummary.conversation_id == conversation_id)
+    )
+    db.session.add(ConversationSummary(
+        conversation_id=conversation_id,
+        version=(latest_version or 0) + 1,
+        content=content,
+        first_message_id=first_message_id,
+        through_message_id=through_message_id,
+        model=route.model,
+    ))
+    db.session.add_all(provider_calls(conversation_id, None, usage))
+    db.session.commit()
+    # The next turn rebuilds its context from the new summary
+    context_cache.invalidate(conversation_id)
+    summarizer.summarized(conversation_id)
+    logger.info(f"Summarized {count} messages of conversation {conversation_id} through message {through_message_id}")
+
+@job_runner.handler('clear_messages')
+def clear_messages_job(conversation_id, through_id):
+    images = image_hashes(ChatMessage.conversation_id == conversation_id, ChatMessage.id <= through_id)
+    delete_in_chunks(
+        db.session, ChatMessage,
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.id <= through_id,
+        chunk_size=JOB_CHUNK_SIZE
+    )
+    db.session.execute(delete(ConversationSummary).where(
+        ConversationSummary.conversation_id == conversation_id,
+        ConversationSummary.through_message_id <= through_id,
+    ))
+    db.session.commit()
+    collect_blobs(images)
+
+@job_runner.handler('assign_orphans')
+def assign_orphans_job(conversation_id):
+    update_in_chunks(
+        db.session, ChatMessage, {ChatMessage.conversation_id: conversation_id},
+        ChatMessage.conversation_id.is_(None),
+        chunk_size=JOB_CHUNK_SIZE
+    )
+
+@job_runner.handler('prune')
+def prune_job(older_than_days=None):
+    if older_than_days:
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        # Cached contexts, in this process or another, reload once their watermark moves
+        delete_in_chunks(db.session, ChatMessage, ChatMessage.timestamp < cutoff, chunk_size=JOB_CHUNK_SIZE)
+        delete_in_chunks(db.session, ConversationSummary, ConversationSummary.created_at < cutoff, chunk_size=JOB_CHUNK_SIZE)
+    # Also picks up blobs the delete and reset jobs left inside their grace period
+    collect_blobs(blob_store.digests())
+    delete_in_chunks(
+        db.session, Job,
+        Job.status.in_(('done', 'failed')),
+        Job.finished_at < datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS),
+        chunk_size=JOB_CHUNK_SIZE
+    )
+
+def image_hashes(*criteria):
+    return set(db.session.scalars(select(ChatMessage.image_hash).where(*criteria, ChatMessage.image_hash.isnot(None)).distinct()))
+
+def collect_blobs(digests):
+    """Delete the blobs among `digests` that no message refers to any more, returning how many."""
+    older_than = time.time() - BLOB_GC_GRACE
+    digests = iter(digests)
+    collected = 0
+    while True:
+        chunk = set(itertools.islice(digests, JOB_CHUNK_SIZE))
+        if not chunk:
+            break
+        referenced = set(db.session.scalars(select(ChatMessage.image_hash).where(ChatMessage.image_hash.in_(chunk)).distinct()))
+        db.session.rollback()
+        collected += sum(blob_store.delete(digest, older_than) for digest in chunk - referenced)
+    if collected:
+        logger.info(f"Deleted {collected} unreferenced image blobs")
+    return collected
+
+def run_maintenance(statement):
+    # VACUUM cannot run inside a transaction
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql(statement)
+
+@job_runner.handler('vacuum')
+def vacuum_job():
+    run_maintenance("VACUUM")
+
+@job_runner.handler('analyze')
+def analyze_job():
+    run_maintenance("ANALYZE")
+
+job_runner.schedule('prune', int(os.getenv('MAINTENANCE_INTERVAL', 3600)), older_than_days=MESSAGE_RETENTION_DAYS or None)
+
+def clear_conversation(conversation):
+    """Hide a conversation's messages now and enqueue their deletion."""
+    through_id = db.session.scalar(select(func.max(ChatMessage.id)).where(ChatMessage.conversation_id == conversation.id))
+    if through_id is None or through_id <= conversation.cleared_through_id:
+        return None
+    conversation.cleared_through_id = through_id
+    return job_runner.enqueue('clear_messages', conversation_id=conversation.id, through_id=through_id)
+
+def maintenance_payload(kind, args):
+    if kind != 'prune':
+        return {}
+    older_than_days = (args or {}).get('older_than_days', MESSAGE_RETENTION_DAYS)
+    if not isinstance(older_than_days, int) or older_than_days < 0:
+        raise ValueError("older_than_days must be a non-negative integer")
+    return {"older_than_days": older_than_days or None}
+
+def live_conversation(conversation_id):
+    return Conversation.query.filter_by(id=conversation_id, deleted_at=None).first()
+
+def negotiated_response(payload, status=200):
+    # MessagePack for clients that ask for it, JSON for everyone else
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    if is_msgpack(mimetype):
+        response = Response(pack(payload), status=status, mimetype=mimetype)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+    response.vary.add('Accept')
+    return response
+
+def page_response(mimetype, *page, **options):
+    # MessagePack has no streaming writer here, but pages are capped at MAX_PAGE_SIZE rows
+    if is_msgpack(mimetype):
+        response = Response(pack(collect_page(*page, **options)), mimetype=mimetype)
+    else:
+        response = Response(stream_with_context(stream_json_page(*page, **options)), mimetype='application/json')
+    response.vary.add('Accept')
+    return response
+
+@app.teardown_request
+def release_admission(exc):
+    # Streamed replies keep the request context, so this runs once the stream ends
+    slot = g.pop('admission_slot', None)
+    if slot:
+        slot.release()
+
+@app.after_request
+def compress_response(response):
+    if not should_compress(response.mimetype, response.status_code, response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        # Compress as the rows are written, without buffering the page
+        response.response = compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 # Routes
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
-    conversations = Conversation.query.order_by(Conversation.created_at.desc()).all()
-    return jsonify([{"id": conv.id, "name": conv.name} for conv in conversations])
+    try:
+        page = parse_page_request(request.args, CONVERSATION_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conversations = db.session.scalars(conversation_page_statement(page).execution_options(yield_per=100))
+    return page_response(
+        negotiate_mimetype(request.accept_mimetypes),
+        'conversations',
+        conversations,
+        lambda conv: serialize_fields(conv, CONVERSATION_FIELDS, page.fields),
+        lambda conv: (conv.created_at, conv.id),
+        lambda key: db.session.scalar(older_conversations_statement(key))
+    )
 
 @app.route('/api/conversations', methods=['POST'])
 def create_conversation():
@@ -112,222 +1078,400 @@ def create_conversation():
 
 @app.route('/api/conversations/<int:conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
-    conversation = Conversation.query.get_or_404(conversation_id)
-    ChatMessage.query.filter_by(conversation_id=conversation_id).delete()
-    db.session.delete(conversation)
+    conversation = live_conversation(conversation_id)
+    if conversation is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    conversation.deleted_at = datetime.utcnow()
+    job = job_runner.enqueue('delete_conversation', conversation_id=conversation_id)
     db.session.commit()
-    return jsonify({"status": "success"})
+    job_runner.wake()
+    context_cache.invalidate(conversation_id)
+    return jsonify({"status": "success", "job_id": job.id}), 202
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    request_trace = RequestTrace('chat')
+    turn = None
     try:
         user_message = request.json.get('message')
-        model = request.json.get('model', 'claude-3-haiku-20240307')
+        model = request.json.get('model', DEFAULT_MODEL)
         image_data = request.json.get('image_data')
         conversation_id = request.json.get('conversation_id')
         generation_id = None
+        request_trace.model = model
         
-        if model not in ALLOWED_MODELS:
+        if model not in model_catalog:
             return jsonify({"error": "Invalid model selected"}), 400
-
-        print(f"Received request - Message: {user_message}, Model: {model}, Conversation ID: {conversation_id}")
         
         if not user_message and not image_data:
             return jsonify({"error": "No message or image provided"}), 400
 
-        if not conversation_id:
-            new_conversation = Conversation(name=f"Conversation {Conversation.query.count() + 1}")
-            db.session.add(new_conversation)
-            db.session.commit()
-            conversation_id = new_conversation.id
-
-        new_user_message = ChatMessage(
-            conversation_id=conversation_id,
-            role='user',
-            content=user_message or "",
-            image_data=image_data
-        )
-        db.session.add(new_user_message)
-        db.session.commit()
+        try:
+            image = read_image(image_data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if conversation_id and live_conversation(conversation_id) is None:
+            return jsonify({"error": "Conversation not found"}), 404
+
+        with request_trace.stage('admission'):
+            rejected = admit_chat(model)
+        if rejected:
+            request_trace.finish('rejected')
+            return rejected
 
-        chat_history = ChatMessage.query.filter_by(conversation_id=conversation_id).order_by(ChatMessage.timestamp).all()
+        with request_trace.stage('start_turn'):
+            turn = start_chat_turn(user_message, image, conversation_id, model)
+
+        with request_trace.stage('history'):
+            context = get_conversation_context(conversation_id) if conversation_id else None
+            history = window_context(turn_context(turn, context), model, image_data)
+        usage = TurnUsage(pricing)
+        with request_trace.stage('format'):
+            request_messages = provider_messages(model, history, user_message, image_data)
+        with request_trace.stage('response_cache'):
+            cache_key = response_key(model, request_messages)
+            bot_message = lookup_response(cache_key)
+        cached = bot_message is not None
+        tools_used = set()
         
-        if 'claude' in model:
-            formatted_messages = []
-            for msg in chat_history:
-                if not formatted_messages or formatted_messages[-1]['role'] != msg.role:
-                    formatted_messages.append({"role": msg.role, "content": msg.content})
-                else:
-                    formatted_messages[-1]['content'] += f"\n\n{msg.content}"
-            
-            if image_data:
-                image_content = {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": image_data.split(',')[1] if ',' in image_data else image_data,
-                    },
-                }
-                
-                if formatted_messages[-1]['role'] == 'user':
-                    if isinstance(formatted_messages[-1]['content'], str):
-                        formatted_messages[-1]['content'] = [{"type": "text", "text": formatted_messages[-1]['content']}]
-                    formatted_messages[-1]['content'].append(image_content)
-                else:
-                    formatted_messages.append({"role": "user", "content": [image_content]})
-                
-                if user_message:
-                    formatted_messages[-1]['content'].append({"type": "text", "text": user_message})
+        if 'claude' in model and not cached:
+            formatted_messages = request_messages
             
-            print(f"Sending request to Claude API with {len(formatted_messages)} messages")
-            response = anthropic_client.messages.create(
-                model=model,
-                max_tokens=2000,
-                messages=formatted_messages,
-                tools=tools
-            )
-            print(f"Claude response: {response}")
-
-            if response.stop_reason == 'tool_use':
-                tool_use = next((block for block in response.content if block.type == "tool_use"), None)
-                if tool_use:
-                    tool_name = tool_use.name
-                    tool_input = tool_use.input
-
-                    tool_result = process_tool_call(tool_name, tool_input)
-                    
-                    follow_up_response = anthropic_client.messages.create(
-                        model=model,
-                        max_tokens=2000,
-                        messages=[
-                            *formatted_messages,
-                            {"role": "assistant", "content": response.content},
-                            {
-                                "role": "user",
-                                "content": [
-                                    {
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_use.id,
-                                    "content": tool_result
-                                    }
-                                ]
-                            }
-                        ],
-                        system="You are an AI assistant. Provide a concise and informative response based on the provided information.",
-                        tools=tools
-                    )
-                    
-                    bot_message = follow_up_response.content[0].text + "\n"
-            else:
-                bot_message = response.content[0].text + "\n"
-            bot_message = bot_message.strip()
+            with request_trace.stage('provider'):
+                route, response = provider_router.create(model_routes(model), claude_request(formatted_messages), on_discarded=discarded_reply(turn))
+            record_usage(usage, route, response)
 
-            print(f"Calculating costs for model: {model}")
-            input_cost, output_cost = get_claude_costs(model)
-            total_cost = (response.usage.input_tokens / 1000000 * input_cost) + (response.usage.output_tokens / 1000000 * output_cost)
-            
-            stats = {
-                'tokens_prompt': response.usage.input_tokens,
-                'tokens_completion': response.usage.output_tokens,
-                'total_cost': total_cost
-            }
-            print(f"Generation stats: {stats}")
-        else:
-            messages = [{"role": msg.role, "content": msg.content} for msg in chat_history]
-            
-            if image_data:
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": user_message or ""},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_data,
-                            }
-                        }
-                    ]
-                })
-            else:
-                messages.append({"role": "user", "content": user_message})
-            
-            messages.insert(0, {"role": "system", "content": "You are an AI assistant."})
+            iteration = 0
+            while wants_tools(response, iteration):
+                tools_used.update(tool_use.name for tool_use in tool_uses(response))
+                with request_trace.stage('tools'):
+                    tool_results = tool_registry.run_all(tool_uses(response))
+                formatted_messages = build_tool_follow_up(formatted_messages, response, tool_results)
+                with request_trace.stage('provider'):
+                    route, response = provider_router.create(
+                        model_routes(model),
+                        claude_request(formatted_messages, system=TOOL_FOLLOW_UP_SYSTEM_PROMPT),
+                        on_discarded=discarded_reply(turn)
+                    )
+                record_usage(usage, route, response)
+                iteration += 1
+            bot_message = response_text(response)
+        elif not cached:
+            messages = request_messages
             
-            completion = openrouter_client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "http://localhost:3000",
-                    "X-Title": "AI Chatbot",
-                },
-                model=model,
-                messages=messages,
-                max_tokens=2000,
-            )
+            with request_trace.stage('provider'):
+                route, response = provider_router.create(model_routes(model), openrouter_request(messages), on_discarded=discarded_reply(turn))
             
-            if not completion.choices or not completion.choices[0].message:
-                logger.error(f"Invalid response from OpenRouter: {completion}")
+            bot_message = response_text(response)
+            generation_id = response.id
+            # Same rule as the streamed reply: an empty completion is not saved
+            if not bot_message:
+                logger.error(f"Empty reply from OpenRouter for generation {generation_id}")
+                request_trace.set(conversation_id=abandon_chat_turn(turn), error="Invalid response from OpenRouter")
+                request_trace.finish('error')
                 return jsonify({"error": "Invalid response from OpenRouter"}), 500
-            
-            bot_message = completion.choices[0].message.content
-            generation_id = completion.id
+            record_usage(usage, route, response)
 
-            logger.info(f"Received bot message: {bot_message}")
-
-            time.sleep(2)
-
-            try:
-                stats_response = requests.get(
-                    f"https://openrouter.ai/api/v1/generation?id={generation_id}",
-                    headers={
-                        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                        "HTTP-Referer": "http://localhost:3000",
-                        "X-Title": "AI Chatbot",
-                    }
-                )
-                stats_response.raise_for_status()
-                stats = stats_response.json()['data']
-            except Exception as stats_error:
-                logger.error(f"Error fetching generation stats: {str(stats_error)}")
-                stats = {'tokens_prompt': None, 'tokens_completion': None, 'total_cost': None}
-
-        print(f"Saving new message to database: {bot_message[:50]}...")
-        new_message = ChatMessage(
-            conversation_id=conversation_id,
-            role='assistant',
-            content=bot_message,
-            generation_id=generation_id,
-            tokens_prompt=stats['tokens_prompt'],
-            tokens_completion=stats['tokens_completion'],
-            total_cost=stats['total_cost']
-        )
-        db.session.add(new_message)
-        db.session.commit()
+        with request_trace.stage('save'):
+            if not cached:
+                store_response(cache_key, bot_message, tools_used)
+            stats = usage.stats()
+            written = finish_chat_turn(turn, bot_message, generation_id, usage, cached=cached)
+        trace_turn(request_trace, written, usage, cached, tools_used)
+        request_trace.finish('ok')
         
-        print("Returning response to client")
-        return jsonify({
+        return negotiated_response({
             "message": bot_message,
-            "generation_stats": stats
+            "message_id": written['message_id'],
+            "generation_id": generation_id,
+            "generation_stats": stats,
+            "stats_pending": generation_id is not None,
+            "cached": cached,
+            "conversation_id": written['conversation_id']
         })
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
-        print(f"Error occurred: {str(e)}")
+        if turn is not None:
+            request_trace.set(conversation_id=abandon_chat_turn(turn))
+        request_trace.set(error=str(e))
+        request_trace.finish('error')
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    user_message = request.json.get('message')
+    model = request.json.get('model', DEFAULT_MODEL)
+    image_data = request.json.get('image_data')
+    conversation_id = request.json.get('conversation_id')
+
+    if model not in model_catalog:
+        return jsonify({"error": "Invalid model selected"}), 400
+
+    if not user_message and not image_data:
+        return jsonify({"error": "No message or image provided"}), 400
+
+    try:
+        image = read_image(image_data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if conversation_id and live_conversation(conversation_id) is None:
+        return jsonify({"error": "Conversation not found"}), 404
+
+    request_trace = RequestTrace('chat_stream', model)
+    with request_trace.stage('admission'):
+        rejected = admit_chat(model)
+    if rejected:
+        request_trace.finish('rejected')
+        return rejected
+    try:
+        with request_trace.stage('start_turn'):
+            turn = start_chat_turn(user_message, image, conversation_id, model)
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}", exc_info=True)
+        request_trace.set(error=str(e))
+        request_trace.finish('error')
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    def failed(error):
+        # The user's message is kept, so a new conversation still gets its id out
+        failed_conversation_id = abandon_chat_turn(turn)
+        request_trace.set(conversation_id=failed_conversation_id, error=error)
+        request_trace.finish('error')
+        if failed_conversation_id and not conversation_id:
+            yield format_sse('conversation', {"conversation_id": failed_conversation_id})
+        yield format_sse('error', {"error": error})
+
+    def generate():
+        generation_id = None
+        try:
+            if conversation_id:
+                yield format_sse('conversation', {"conversation_id": conversation_id})
+
+            with request_trace.stage('history'):
+                context = get_conversation_context(conversation_id) if conversation_id else None
+                history = window_context(turn_context(turn, context), model, image_data)
+            usage = TurnUsage(pricing)
+            with request_trace.stage('format'):
+                request_messages = provider_messages(model, history, user_message, image_data)
+            with request_trace.stage('response_cache'):
+                cache_key = response_key(model, request_messages)
+                bot_message = lookup_response(cache_key)
+            cached = bot_message is not None
+            tools_used = set()
+
+            if cached:
+                yield format_sse('delta', {"text": bot_message})
+            elif 'claude' in model:
+                formatted_messages = request_messages
+
+                with request_trace.stage('provider'):
+                    for event, data in provider_router.stream(model_routes(model), claude_request(formatted_messages)):
+                        if event == 'response':
+                            route, response = data
+                        else:
+                            yield format_sse('delta', {"text": data})
+                record_usage(usage, route, response)
+
+                iteration = 0
+                while wants_tools(response, iteration):
+                    for tool_use in tool_uses(response):
+                        tools_used.add(tool_use.name)
+                        yield format_sse('tool', {"name": tool_use.name})
+                    with request_trace.stage('tools'):
+                        tool_results = tool_registry.run_all(tool_uses(response))
+                    formatted_messages = build_tool_follow_up(formatted_messages, response, tool_results)
+                    with request_trace.stage('provider'):
+                        for event, data in provider_router.stream(
+                            model_routes(model),
+                            claude_request(formatted_messages, system=TOOL_FOLLOW_UP_SYSTEM_PROMPT)
+                        ):
+                            if event == 'response':
+                                route, response = data
+                            else:
+                                yield format_sse('delta', {"text": data})
+                    record_usage(usage, route, response)
+                    iteration += 1
+
+                bot_message = response_text(response)
+            else:
+                messages = request_messages
+
+                with request_trace.stage('provider'):
+                    for event, data in provider_router.stream(model_routes(model), openrouter_request(messages)):
+                        if event == 'response':
+                            route, response = data
+                        else:
+                            yield format_sse('delta', {"text": data})
+
+                generation_id = response.id
+                bot_message = response_text(response)
+                if not bot_message:
+                    logger.error(f"Empty stream from OpenRouter for generation {generation_id}")
+                    yield from failed("Invalid response from OpenRouter")
+                    return
+
+                record_usage(usage, route, response)
+
+            with request_trace.stage('save'):
+                if not cached:
+                    store_response(cache_key, bot_message, tools_used)
+                stats = usage.stats()
+                written = finish_chat_turn(turn, bot_message, generation_id, usage, cached=cached)
+            trace_turn(request_trace, written, usage, cached, tools_used)
+            request_trace.finish('ok')
+            if not conversation_id:
+                yield format_sse('conversation', {"conversation_id": written['conversation_id']})
+            yield format_sse('done', {
+                "message": bot_message,
+                "message_id": written['message_id'],
+                "generation_id": generation_id,
+                "generation_stats": stats,
+                "stats_pending": generation_id is not None,
+                "cached": cached,
+                "conversation_id": written['conversation_id']
+            })
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error in chat stream endpoint: {str(e)}", exc_info=True)
+            yield from failed(f"An error occurred: {str(e)}")
+        finally:
+            # The client went away mid-stream
+            abandon_chat_turn(turn)
+            request_trace.finish('aborted')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/generation_stats/<int:message_id>', methods=['GET'])
+def get_generation_stats(message_id):
+    message = db.session.get(ChatMessage, message_id)
+    if message is None:
+        return jsonify({"error": "Message not found"}), 404
+    return jsonify({
+        "message_id": message.id,
+        "generation_id": message.generation_id,
+        "tokens_prompt": message.tokens_prompt,
+        "tokens_completion": message.tokens_completion,
+        "total_cost": message.total_cost,
+        "stats_pending": message.generation_id is not None and message.stats_reconciled_at is None
+    })
+
+@app.route('/api/usage/<any(models, conversations):group>', methods=['GET'])
+def get_usage(group):
+    try:
+        filters = parse_usage_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    key, group_by = ('model', ProviderCall.model) if group == 'models' else ('conversation_id', ProviderCall.conversation_id)
+    rows = db.session.execute(usage_rollup_statement(group_by, **filters))
+    return jsonify({group: [serialize_rollup(key, row) for row in rows]})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/maintenance/<any(vacuum, analyze, prune):kind>', methods=['POST'])
+def run_maintenance_job(kind):
+    try:
+        payload = maintenance_payload(kind, request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job = job_runner.enqueue(kind, **payload)
+    db.session.commit()
+    job_runner.wake()
+    return jsonify(serialize_job(job)), 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(serialize_job(job))
+
+@app.route('/api/models', methods=['GET'])
+def get_models():
+    response = negotiated_response({
+        "models": model_catalog.listing(request.args.get('provider'), request.args.get('q')),
+        "default": DEFAULT_MODEL,
+    })
+    # The catalog only changes with a deploy
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+@app.route('/api/providers/stats', methods=['GET'])
+def get_provider_stats():
+    return jsonify({**provider_router.stats(), "admission": admission.stats()})
+
+@app.route('/api/tool_cache/stats', methods=['GET'])
+def get_tool_cache_stats():
+    return jsonify(tool_cache.stats())
+
+@app.route('/api/images/<digest>', methods=['GET'])
+def get_image(digest):
+    message = ChatMessage.query.filter_by(image_hash=digest).first()
+    if message is None:
+        return jsonify({"error": "Image not found"}), 404
+    # Blobs are content addressed, so a given URL never changes
+    try:
+        response = send_file(
+            blob_store.path(digest),
+            mimetype=message.image_media_type,
+            etag=digest,
+            conditional=True,
+            max_age=31536000
+        )
+    except FileNotFoundError:
+        logger.error(f"Blob {digest} is referenced by message {message.id} but missing from the blob store")
+        return jsonify({"error": "Image not found"}), 404
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/api/chat_history/<int:conversation_id>', methods=['GET'])
 def get_chat_history(conversation_id):
-    messages = ChatMessage.query.filter_by(conversation_id=conversation_id).order_by(ChatMessage.timestamp).all()
-    return jsonify([
-        {
-            "role": msg.role,
-            "content": msg.content,
-            "tokens_prompt": msg.tokens_prompt,
-            "tokens_completion": msg.tokens_completion,
-            "total_cost": msg.total_cost,
-            "image_data": msg.image_data
-        }
-        for msg in messages
-    ])
+    try:
+        page = parse_page_request(request.args, MESSAGE_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if live_conversation(conversation_id) is None:
+        return jsonify({"error": "Conversation not found"}), 404
+
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    # Revalidating costs one aggregate query instead of serializing the page
+    version = db.session.execute(history_version_statement(conversation_id, page)).one()
+    etag = history_etag(version, mimetype, request.query_string.decode())
+    headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    messages = db.session.scalars(message_page_statement(conversation_id, page).execution_options(yield_per=100))
+    response = page_response(
+        mimetype,
+        'messages',
+        messages,
+        lambda msg: serialize_fields(msg, MESSAGE_FIELDS, page.fields),
+        lambda msg: (msg.timestamp, msg.id),
+        lambda key: db.session.scalar(older_messages_statement(conversation_id, key)),
+        cursor_from_first=True
+    )
+    response.headers.update(headers)
+    return response
+
+@app.route('/api/search', methods=['GET'])
+def search_messages():
+    try:
+        search = parse_search_request(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = db.session.execute(message_search.statement(db.engine.dialect.name, search)).all()
+    return negotiated_response(search_page(rows, search))
 
 @app.route('/api/chat_history/reset', methods=['POST'])
 def reset_chat_history():
@@ -336,26 +1480,55 @@ def reset_chat_history():
         if not conversation_id:
             return jsonify({"status": "error", "message": "Conversation ID is required"}), 400
 
-        print(f"Resetting chat history for conversation ID: {conversation_id}")
-        ChatMessage.query.filter_by(conversation_id=conversation_id).delete()
+        conversation = live_conversation(conversation_id)
+        if conversation is None:
+            return jsonify({"status": "error", "message": "Conversation not found"}), 404
+        job = clear_conversation(conversation)
         db.session.commit()
-        return jsonify({"status": "success", "message": "Chat history reset successfully"})
+        job_runner.wake()
+        context_cache.invalidate(conversation_id)
+        return jsonify({
+            "status": "success",
+            "message": "Chat history reset successfully",
+            "job_id": job.id if job else None
+        }), 202
     except Exception as e:
         db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.before_first_request
 def initialize_data():
-    with app.app_context():
-        default_conversation = Conversation.query.filter_by(name="Default Conversation").first()
-        if not default_conversation:
-            default_conversation = Conversation(name="Default Conversation")
-            db.session.add(default_conversation)
-            db.session.commit()
+    """Start-up work shared by the Flask and ASGI servers; needs an app context.
 
-        ChatMessage.query.filter_by(conversation_id=None).update({ChatMessage.conversation_id: default_conversation.id})
+    Returns the (message_id, generation_id) pairs whose stats lookups were
+    still queued when the last process exited, for the caller's reconciler.
+    """
+    default_conversation = Conversation.query.filter_by(name="Default Conversation").first()
+    if not default_conversation:
+        default_conversation = Conversation(name="Default Conversation")
+        db.session.add(default_conversation)
         db.session.commit()
 
+    # User messages of turns that were in flight when a process died
+    recover_turns()
+
+    # Messages from before conversations existed are adopted in the background
+    job_runner.enqueue('assign_orphans', unique=True, conversation_id=default_conversation.id)
+    db.session.commit()
+    job_runner.start()
+
+    unreconciled = ChatMessage.query.filter(
+        ChatMessage.generation_id.isnot(None),
+        ChatMessage.stats_reconciled_at.is_(None),
+        ChatMessage.timestamp >= datetime.utcnow() - timedelta(days=1)
+    ).options(load_only(ChatMessage.id, ChatMessage.generation_id)).all()
+    return [(message.id, message.generation_id) for message in unreconciled]
+
+@app.before_first_request
+def initialize_flask():
+    with app.app_context():
+        for message_id, generation_id in initialize_data():
+            stats_reconciler.submit(message_id, generation_id)
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
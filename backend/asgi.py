@@ -0,0 +1,724 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+import httpx
+from quart import Quart, Response, abort, jsonify, request
+from quart.wrappers.response import DataBody, IterableBody
+from quart_cors import cors
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import load_only
+
+from app import (
+    CLIENT_PRIORITIES,
+    DEFAULT_MODEL,
+    DEFAULT_PRIORITY,
+    CONVERSATION_FIELDS,
+    GROUP_COMMIT,
+    MESSAGE_FIELDS,
+    MODEL_FALLBACKS,
+    OPENROUTER_HEADERS,
+    PROVIDER_TIMEOUT,
+    TOOL_FOLLOW_UP_SYSTEM_PROMPT,
+    ChatMessage,
+    Conversation,
+    Job,
+    ProviderCall,
+    app as flask_app,
+    assistant_message_row,
+    blob_store,
+    build_tool_follow_up,
+    chat_reply,
+    claude_request,
+    conversation_page_statement,
+    context_cache,
+    context_messages,
+    context_watermark_statement,
+    db,
+    discarded_reply,
+    format_sse,
+    history_etag,
+    history_version_statement,
+    initialize_data,
+    generation_stats_update,
+    job_runner,
+    latest_summary_statement,
+    lookup_response,
+    maintenance_payload,
+    message_page_statement,
+    message_search,
+    model_catalog,
+    new_conversation,
+    older_conversations_statement,
+    older_messages_statement,
+    openrouter_request,
+    parse_usage_filters,
+    pricing,
+    provider_limits,
+    provider_calls,
+    provider_messages,
+    provider_router,
+    read_image,
+    record_usage,
+    response_key,
+    response_text,
+    serialize_fields,
+    serialize_rollup,
+    start_chat_turn,
+    summary_job,
+    store_response,
+    trace_turn,
+    tool_cache,
+    tool_registry,
+    tool_uses,
+    turn_context,
+    turn_journal,
+    turn_written,
+    unsummarized_messages,
+    usage_rollup_statement,
+    user_message_row,
+    wants_tools,
+    window_context,
+)
+from admission import AdmissionRejected, admission_from_env, request_priority
+from async_db import create_session_factory
+from metrics import CACHE_REQUESTS, CONTENT_TYPE, RequestTrace, observe_queries, registry as metrics_registry
+from database import configure_engine
+from jobs import serialize_job
+from pagination import collect_page_async, parse_page_request, stream_json_page_async
+from pricing import TurnUsage
+from providers import OPENROUTER_BASE_URL, AsyncAnthropicRoute, AsyncOpenRouterRoute, LazyClient
+from search import parse_search_request, search_page
+from stats_reconciler import reconcile_stats_async
+from unit_of_work import AsyncGroupCommitter
+from wire import MIN_COMPRESS_SIZE, compress, compress_chunks_async, is_msgpack, negotiate_encoding, negotiate_mimetype, pack, should_compress
+
+# Asyncio serving mode for the chat API: run with `hypercorn asgi:app`.
+# Every provider, stats and database call is awaited, so one process can
+# keep hundreds of chats in flight without a thread per request.
+app = cors(Quart(__name__))
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', 200))
+
+def create_async_openrouter_client():
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    return AsyncOpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        max_retries=0,
+        timeout=PROVIDER_TIMEOUT,
+        http_client=DefaultAsyncHttpxClient(event_hooks=provider_limits.response_hooks('openrouter', asynchronous=True)),
+    )
+
+def create_async_anthropic_client():
+    import anthropic
+    return anthropic.AsyncAnthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"),
+        max_retries=0,
+        timeout=PROVIDER_TIMEOUT,
+        http_client=anthropic.DefaultAsyncHttpxClient(event_hooks=provider_limits.response_hooks('anthropic', asynchronous=True)),
+    )
+
+async_openrouter_client = LazyClient(create_async_openrouter_client)
+async_anthropic_client = LazyClient(create_async_anthropic_client)
+
+admission = admission_from_env(os.environ, provider_limits, asynchronous=True)
+
+engine = None
+Session = None
+http_client = None
+group_committer = None
+background_tasks = set()
+
+@app.before_serving
+async def startup():
+    global engine, Session, http_client, group_committer
+    # The same start-up work as the Flask server's first request
+    with flask_app.app_context():
+        database_url = db.engine.url
+        unreconciled = initialize_data()
+    engine, Session = create_session_factory(database_url, **flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    configure_engine(engine.sync_engine)
+    observe_queries(engine.sync_engine)
+    if GROUP_COMMIT:
+        group_committer = AsyncGroupCommitter(
+            Session,
+            window=float(os.getenv('GROUP_COMMIT_WINDOW', 0)),
+            max_batch=int(os.getenv('GROUP_COMMIT_MAX_BATCH', 64)),
+        )
+    http_client = httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS // 4,
+        ),
+    )
+    for message_id, generation_id in unreconciled:
+        spawn(reconcile_stats_async(http_client, message_id, generation_id, save_generation_stats))
+
+@app.after_serving
+async def shutdown():
+    for task in list(background_tasks):
+        task.cancel()
+    if group_committer:
+        await group_committer.close()
+    await http_client.aclose()
+    await engine.dispose()
+
+# Helper functions
+class InvalidTurn(Exception):
+    pass
+
+def spawn(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def add_conversation(session):
+    conversation = new_conversation(await session.scalar(select(func.count()).select_from(Conversation)))
+    session.add(conversation)
+    await session.flush()
+    return conversation
+
+async def get_conversation_context(conversation_id):
+    async with Session() as session:
+        watermark = tuple((await session.execute(context_watermark_statement(conversation_id))).one())
+        context = context_cache.get(conversation_id, watermark)
+        CACHE_REQUESTS.inc(cache='context', result='miss' if context is None else 'hit')
+        if context is None:
+            summary = (await session.scalars(latest_summary_statement(conversation_id))).first()
+            chat_history = await session.scalars(
+                select(ChatMessage)
+                .options(load_only(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.token_estimate))
+                .where(*unsummarized_messages(conversation_id, summary))
+                .order_by(ChatMessage.timestamp)
+            )
+            context = context_cache.load(conversation_id, context_messages(summary, chat_history.all()), watermark)
+    return context
+
+async def write_turn(session, turn, reply=None):
+    conversation_id = turn['conversation_id'] or (await add_conversation(session)).id
+    user_message = user_message_row(turn, conversation_id)
+    session.add(user_message)
+    await session.flush()
+    written = {"conversation_id": conversation_id, "messages": [(user_message.id, 'user', turn['content'])], "message_id": None}
+    if reply is not None:
+        new_message = assistant_message_row(turn, conversation_id, reply)
+        session.add(new_message)
+        await session.flush()
+        session.add_all(provider_calls(conversation_id, new_message.id, reply['usage']))
+        written['messages'].append((new_message.id, 'assistant', reply['message']))
+        written['message_id'] = new_message.id
+    job = summary_job(conversation_id, written['messages'])
+    if job:
+        session.add(job)
+        written['summary_requested'] = True
+    return written
+
+async def commit_turn(turn, reply=None):
+    async def write(session):
+        return await write_turn(session, turn, reply)
+
+    if group_committer:
+        return await group_committer.submit(write, on_commit=lambda written: turn_written(turn, written))
+    async with Session() as session:
+        written = await write(session)
+        await session.commit()
+    await asyncio.to_thread(turn_written, turn, written)
+    return written
+
+async def save_generation_stats(message_id, stats):
+    async with Session() as session:
+        message = await session.get(ChatMessage, message_id)
+        if message is None:
+            return
+        message.tokens_prompt = stats['tokens_prompt']
+        message.tokens_completion = stats['tokens_completion']
+        message.total_cost = stats['total_cost']
+        message.stats_reconciled_at = datetime.utcnow()
+        await session.execute(
+            update(ProviderCall)
+            .where(ProviderCall.generation_id == message.generation_id)
+            .values(generation_stats_update(stats))
+        )
+        await session.commit()
+
+async def finish_chat_turn(turn, bot_message, generation_id, usage, cached=False):
+    written = await commit_turn(turn, chat_reply(bot_message, generation_id, usage, cached))
+    if generation_id:
+        spawn(reconcile_stats_async(http_client, written['message_id'], generation_id, save_generation_stats))
+    return written
+
+async def abandon_chat_turn(turn):
+    if not turn_journal.is_pending(turn):
+        return None
+    try:
+        return (await commit_turn(turn))['conversation_id']
+    except Exception as e:
+        logger.error(f"Could not save the user message of a failed turn: {str(e)}", exc_info=True)
+        return None
+
+def model_routes(model):
+    primary = AsyncAnthropicRoute(async_anthropic_client, model) if 'claude' in model else AsyncOpenRouterRoute(async_openrouter_client, model, OPENROUTER_HEADERS)
+    return [primary, *(AsyncOpenRouterRoute(async_openrouter_client, fallback, OPENROUTER_HEADERS) for fallback in MODEL_FALLBACKS.get(model, []))]
+
+async def stream_model(model, request):
+    async for event, data in provider_router.stream_async(model_routes(model), request):
+        yield event, (data if event == 'response' else {"text": data})
+
+async def call_model(endpoint, model, request, turn):
+    # /api/chat waits for the whole reply anyway, so with hedging on it makes one call the router can hedge
+    if endpoint == 'chat' and provider_router.hedging:
+        yield 'response', await provider_router.create_async(model_routes(model), request, on_discarded=discarded_reply(turn))
+        return
+    async for event, data in stream_model(model, request):
+        yield event, data
+
+async def run_chat_turn(endpoint, model, user_message, image_data, image, conversation_id):
+    """Run one chat turn, yielding (event, data) pairs as the reply streams in.
+
+    Both /api/chat and /api/chat/stream drain this generator; the former
+    simply waits for the final 'done' or 'error' event.
+    """
+    generation_id = None
+    turn = None
+    request_trace = RequestTrace(endpoint, model)
+    try:
+        with request_trace.stage('start_turn'):
+            # Writes the image blob and the journal entry
+            turn = await asyncio.to_thread(start_chat_turn, user_message, image, conversation_id, model)
+        if conversation_id:
+            yield 'conversation', {"conversation_id": conversation_id}
+        with request_trace.stage('history'):
+            context = await get_conversation_context(conversation_id) if conversation_id else None
+            history = window_context(turn_context(turn, context), model, image_data)
+        usage = TurnUsage(pricing)
+        with request_trace.stage('format'):
+            request_messages = provider_messages(model, history, user_message, image_data)
+        with request_trace.stage('response_cache'):
+            cache_key = response_key(model, request_messages)
+            # The disk backend is a SQLite file, keep it off the event loop
+            bot_message = await asyncio.to_thread(lookup_response, cache_key)
+        cached = bot_message is not None
+        tools_used = set()
+
+        if cached:
+            yield 'delta', {"text": bot_message}
+        elif 'claude' in model:
+            formatted_messages = request_messages
+
+            with request_trace.stage('provider'):
+                async for event, data in call_model(endpoint, model, claude_request(formatted_messages), turn):
+                    if event == 'response':
+                        route, response = data
+                    else:
+                        yield event, data
+            record_usage(usage, route, response)
+
+            iteration = 0
+            while wants_tools(response, iteration):
+                for tool_use in tool_uses(response):
+                    tools_used.add(tool_use.name)
+                    yield 'tool', {"name": tool_use.name}
+                # Tools are blocking library calls, they run on the registry's thread pool
+                with request_trace.stage('tools'):
+                    tool_results = await tool_registry.run_all_async(tool_uses(response))
+                formatted_messages = build_tool_follow_up(formatted_messages, response, tool_results)
+                with request_trace.stage('provider'):
+                    async for event, data in call_model(endpoint, model, claude_request(formatted_messages, system=TOOL_FOLLOW_UP_SYSTEM_PROMPT), turn):
+                        if event == 'response':
+                            route, response = data
+                        else:
+                            yield event, data
+                record_usage(usage, route, response)
+                iteration += 1
+
+            bot_message = response_text(response)
+        else:
+            messages = request_messages
+
+            with request_trace.stage('provider'):
+                async for event, data in call_model(endpoint, model, openrouter_request(messages), turn):
+                    if event == 'response':
+                        route, response = data
+                    else:
+                        yield event, data
+
+            generation_id = response.id
+            bot_message = response_text(response)
+            if not bot_message:
+                logger.error(f"Empty stream from OpenRouter for generation {generation_id}")
+                raise InvalidTurn("Invalid response from OpenRouter")
+
+            record_usage(usage, route, response)
+
+        with request_trace.stage('save'):
+            if not cached:
+                await asyncio.to_thread(store_response, cache_key, bot_message, tools_used)
+            stats = usage.stats()
+            written = await finish_chat_turn(turn, bot_message, generation_id, usage, cached=cached)
+        trace_turn(request_trace, written, usage, cached, tools_used)
+        request_trace.finish('ok')
+        if not conversation_id:
+            yield 'conversation', {"conversation_id": written['conversation_id']}
+        yield 'done', {
+            "message": bot_message,
+            "message_id": written['message_id'],
+            "generation_id": generation_id,
+            "generation_stats": stats,
+            "stats_pending": generation_id is not None,
+            "cached": cached,
+            "conversation_id": written['conversation_id']
+        }
+    except Exception as e:
+        if not isinstance(e, InvalidTurn):
+            logger.error(f"Error in chat turn: {str(e)}", exc_info=True)
+        error = str(e) if isinstance(e, InvalidTurn) else f"An error occurred: {str(e)}"
+        # The user's message is kept, so a new conversation still gets its id out
+        failed_conversation_id = await abandon_chat_turn(turn) if turn else None
+        request_trace.set(conversation_id=failed_conversation_id, error=error)
+        request_trace.finish('error')
+        if failed_conversation_id and not conversation_id:
+            yield 'conversation', {"conversation_id": failed_conversation_id}
+        yield 'error', {"error": error}
+    finally:
+        # The client went away mid-stream
+        if turn:
+            await abandon_chat_turn(turn)
+        request_trace.finish('aborted')
+
+async def read_chat_request():
+    payload = await request.get_json()
+    model = payload.get('model', DEFAULT_MODEL)
+    if model not in model_catalog:
+        abort(400, "Invalid model selected")
+    if not payload.get('message') and not payload.get('image_data'):
+        abort(400, "No message or image provided")
+    try:
+        image = read_image(payload.get('image_data'))
+    except ValueError as e:
+        abort(400, str(e))
+    conversation_id = payload.get('conversation_id')
+    if conversation_id:
+        async with Session() as session:
+            if await live_conversation(session, conversation_id) is None:
+                abort(404, "Conversation not found")
+    return model, payload.get('message'), payload.get('image_data'), image, conversation_id
+
+async def admit_chat(model):
+    """Wait for an admission slot for this chat turn; None once admitted, else a 429 response."""
+    client = request.headers.get('X-API-Key') or request.remote_addr or 'unknown'
+    priority = request_priority(CLIENT_PRIORITIES.get(client, DEFAULT_PRIORITY), request.headers.get('X-Priority'))
+    try:
+        slot = await admission.admit(client, model, priority, model_routes(model))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected chat from {client}: {e.reason}")
+        response = jsonify({"error": e.reason})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    # The response, streamed or not, is sent from this task, so the slot is
+    # held until it ends, even if the client goes away first
+    asyncio.current_task().add_done_callback(lambda task: slot.release())
+    return None
+
+@app.errorhandler(400)
+async def bad_request(error):
+    return jsonify({"error": error.description}), 400
+
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify({"error": error.description}), 404
+
+def negotiated_response(payload, status=200):
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    if is_msgpack(mimetype):
+        response = Response(pack(payload), status=status, mimetype=mimetype)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+    response.vary.add('Accept')
+    return response
+
+async def page_response(mimetype, statement, key, serialize, cursor_key, has_more, cursor_from_first=False):
+    # has_more(session, key) runs in the session that streamed the rows
+    if is_msgpack(mimetype):
+        async with Session() as session:
+            rows = await session.stream_scalars(statement)
+            payload = await collect_page_async(
+                key, rows, serialize, cursor_key, lambda edge: has_more(session, edge), cursor_from_first
+            )
+        response = Response(pack(payload), mimetype=mimetype)
+    else:
+        async def generate():
+            async with Session() as session:
+                rows = await session.stream_scalars(statement)
+                async for chunk in stream_json_page_async(
+                    key, rows, serialize, cursor_key, lambda edge: has_more(session, edge), cursor_from_first
+                ):
+                    yield chunk
+
+        response = Response(generate(), mimetype='application/json')
+    response.vary.add('Accept')
+    return response
+
+async def compressed_body(body, encoding):
+    async with body as chunks:
+        async for chunk in compress_chunks_async(chunks, encoding):
+            yield chunk
+
+@app.after_request
+async def compress_response(response):
+    if not should_compress(response.mimetype, response.status_code, response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if isinstance(response.response, DataBody):
+        data = await response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    else:
+        response.response = IterableBody(compressed_body(response.response, encoding))
+        response.headers.pop('Content-Length', None)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# Routes
+@app.route('/api/conversations', methods=['GET'])
+async def get_conversations():
+    try:
+        page = parse_page_request(request.args, CONVERSATION_FIELDS)
+    except ValueError as e:
+        abort(400, str(e))
+
+    return await page_response(
+        negotiate_mimetype(request.accept_mimetypes),
+        conversation_page_statement(page),
+        'conversations',
+        lambda conv: serialize_fields(conv, CONVERSATION_FIELDS, page.fields),
+        lambda conv: (conv.created_at, conv.id),
+        lambda session, key: session.scalar(older_conversations_statement(key))
+    )
+
+@app.route('/api/conversations', methods=['POST'])
+async def create_conversation():
+    async with Session() as session:
+        new_conversation = await add_conversation(session)
+        await session.commit()
+        return jsonify({"id": new_conversation.id, "name": new_conversation.name})
+
+async def live_conversation(session, conversation_id):
+    return await session.scalar(select(Conversation).where(Conversation.id == conversation_id, Conversation.deleted_at.is_(None)))
+
+async def clear_conversation(session, conversation):
+    through_id = await session.scalar(select(func.max(ChatMessage.id)).where(ChatMessage.conversation_id == conversation.id))
+    if through_id is None or through_id <= conversation.cleared_through_id:
+        return None
+    conversation.cleared_through_id = through_id
+    job = job_runner.job('clear_messages', conversation_id=conversation.id, through_id=through_id)
+    session.add(job)
+    return job
+
+@app.route('/api/conversations/<int:conversation_id>', methods=['DELETE'])
+async def delete_conversation(conversation_id):
+    async with Session() as session:
+        conversation = await live_conversation(session, conversation_id)
+        if conversation is None:
+            return jsonify({"error": "Conversation not found"}), 404
+        conversation.deleted_at = datetime.utcnow()
+        job = job_runner.job('delete_conversation', conversation_id=conversation_id)
+        session.add(job)
+        await session.commit()
+    job_runner.wake()
+    context_cache.invalidate(conversation_id)
+    return jsonify({"status": "success", "job_id": job.id}), 202
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    model, user_message, image_data, image, conversation_id = await read_chat_request()
+    rejected = await admit_chat(model)
+    if rejected:
+        return rejected
+    async for event, data in run_chat_turn('chat', model, user_message, image_data, image, conversation_id):
+        if event == 'done':
+            return negotiated_response(data)
+        if event == 'error':
+            return jsonify(data), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    model, user_message, image_data, image, conversation_id = await read_chat_request()
+    rejected = await admit_chat(model)
+    if rejected:
+        return rejected
+
+    async def generate():
+        async for event, data in run_chat_turn('chat_stream', model, user_message, image_data, image, conversation_id):
+            yield format_sse(event, data)
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/generation_stats/<int:message_id>', methods=['GET'])
+async def get_generation_stats(message_id):
+    async with Session() as session:
+        message = await session.get(ChatMessage, message_id)
+    if message is None:
+        return jsonify({"error": "Message not found"}), 404
+    return jsonify({
+        "message_id": message.id,
+        "generation_id": message.generation_id,
+        "tokens_prompt": message.tokens_prompt,
+        "tokens_completion": message.tokens_completion,
+        "total_cost": message.total_cost,
+        "stats_pending": message.generation_id is not None and message.stats_reconciled_at is None
+    })
+
+@app.route('/api/usage/<any(models, conversations):group>', methods=['GET'])
+async def get_usage(group):
+    try:
+        filters = parse_usage_filters(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+    key, group_by = ('model', ProviderCall.model) if group == 'models' else ('conversation_id', ProviderCall.conversation_id)
+    async with Session() as session:
+        rows = await session.execute(usage_rollup_statement(group_by, **filters))
+    return jsonify({group: [serialize_rollup(key, row) for row in rows]})
+
+@app.route('/api/maintenance/<any(vacuum, analyze, prune):kind>', methods=['POST'])
+async def run_maintenance_job(kind):
+    try:
+        payload = maintenance_payload(kind, await request.get_json(silent=True))
+    except ValueError as e:
+        abort(400, str(e))
+    async with Session() as session:
+        job = job_runner.job(kind, **payload)
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+    job_runner.wake()
+    return jsonify(serialize_job(job)), 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+async def get_job(job_id):
+    async with Session() as session:
+        job = await session.get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(serialize_job(job))
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/models', methods=['GET'])
+async def get_models():
+    response = negotiated_response({
+        "models": model_catalog.listing(request.args.get('provider'), request.args.get('q')),
+        "default": DEFAULT_MODEL,
+    })
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+@app.route('/api/providers/stats', methods=['GET'])
+async def get_provider_stats():
+    return jsonify({**provider_router.stats(), "admission": admission.stats()})
+
+@app.route('/api/tool_cache/stats', methods=['GET'])
+async def get_tool_cache_stats():
+    return jsonify(tool_cache.stats())
+
+@app.route('/api/images/<digest>', methods=['GET'])
+async def get_image(digest):
+    async with Session() as session:
+        media_type = await session.scalar(
+            select(ChatMessage.image_media_type).where(ChatMessage.image_hash == digest).limit(1)
+        )
+    if media_type is None:
+        return jsonify({"error": "Image not found"}), 404
+
+    # Blobs are content addressed, so a given URL never changes
+    headers = {'ETag': f'"{digest}"', 'Cache-Control': 'public, max-age=31536000, immutable'}
+    if digest in request.if_none_match:
+        return Response(b'', status=304, headers=headers)
+    try:
+        data = await asyncio.to_thread(blob_store.get, digest)
+    except FileNotFoundError:
+        logger.error(f"Blob {digest} is referenced by a message but missing from the blob store")
+        return jsonify({"error": "Image not found"}), 404
+    return Response(data, mimetype=media_type, headers=headers)
+
+@app.route('/api/chat_history/<int:conversation_id>', methods=['GET'])
+async def get_chat_history(conversation_id):
+    try:
+        page = parse_page_request(request.args, MESSAGE_FIELDS)
+    except ValueError as e:
+        abort(400, str(e))
+
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    async with Session() as session:
+        if await live_conversation(session, conversation_id) is None:
+            return jsonify({"error": "Conversation not found"}), 404
+        version = (await session.execute(history_version_statement(conversation_id, page))).one()
+    etag = history_etag(version, mimetype, request.query_string.decode())
+    headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+    if request.if_none_match.contains_weak(etag):
+        return Response(b'', status=304, headers=headers)
+
+    response = await page_response(
+        mimetype,
+        message_page_statement(conversation_id, page),
+        'messages',
+        lambda msg: serialize_fields(msg, MESSAGE_FIELDS, page.fields),
+        lambda msg: (msg.timestamp, msg.id),
+        lambda session, key: session.scalar(older_messages_statement(conversation_id, key)),
+        cursor_from_first=True
+    )
+    response.headers.update(headers)
+    return response
+
+@app.route('/api/search', methods=['GET'])
+async def search_messages():
+    try:
+        search = parse_search_request(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+    async with Session() as session:
+        rows = (await session.execute(message_search.statement(engine.dialect.name, search))).all()
+    return negotiated_response(search_page(rows, search))
+
+@app.route('/api/chat_history/reset', methods=['POST'])
+async def reset_chat_history():
+    payload = await request.get_json()
+    conversation_id = payload.get('conversation_id')
+    if not conversation_id:
+        return jsonify({"status": "error", "message": "Conversation ID is required"}), 400
+
+    try:
+        async with Session() as session:
+            conversation = await live_conversation(session, conversation_id)
+            if conversation is None:
+                return jsonify({"status": "error", "message": "Conversation not found"}), 404
+            job = await clear_conversation(session, conversation)
+            await session.commit()
+        job_runner.wake()
+        context_cache.invalidate(conversation_id)
+        return jsonify({
+            "status": "success",
+            "message": "Chat history reset successfully",
+            "job_id": job.id if job else None
+        }), 202
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+if __name__ == '__main__':
+    app.run(port=5000)
@@ -0,0 +1,22 @@
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Async drivers for the backends the sync app can be pointed at
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+def make_async_url(url):
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {url.get_backend_name()}")
+    return url.set(drivername=driver)
+
+def create_session_factory(url, **engine_options):
+    """Build an AsyncEngine and session factory over the sync app's database URL.
+
+    The Flask-SQLAlchemy models are plain mapped classes, so they can be
+    used with AsyncSession and select() unchanged.
+    """
+    engine = create_async_engine(make_async_url(url), **engine_options)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
@@ -0,0 +1,552 @@
+"""Load test /api/chat and the history endpoints with a realistic conversation mix.
+
+Each worker holds a conversation open for a few turns, mixing plain,
+streamed and tool-using chat turns with history and conversation list
+fetches, then starts a new one. Reports throughput, p50/p95/p99
+latency per operation and the database time the server spent, read
+from its /metrics before and after the run.
+
+Against a server that is already running (pointed at a fake provider):
+
+    python benchmarks/bench_chat_load.py --url http://127.0.0.1:5000 --requests 500
+
+Or let it start the fake provider and a server on a throwaway SQLite
+database, then save the run and check a later one against it:
+
+    python benchmarks/bench_chat_load.py --spawn flask --output baseline.json
+    python benchmarks/bench_chat_load.py --spawn flask --env GROUP_COMMIT=true --compare baseline.json
+
+With --workers, several app processes share the database (pass
+--database-url for Postgres) and each worker's requests rotate across
+them, so consecutive turns of a conversation land on different
+processes:
+
+    python benchmarks/bench_chat_load.py --spawn flask --workers 3 --database-url postgresql://localhost/bench
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+DEFAULT_MIX = 'chat=45,stream=25,tool=10,history=15,conversations=5'
+DEFAULT_MODELS = 'claude-3-haiku-20240307=3,openai/gpt-4o-mini-2024-07-18=1'
+
+TICKERS = ('AAPL', 'MSFT', 'NVDA', 'AMZN', 'GOOG', 'TSLA', 'META', 'NFLX')
+
+SHORT_PROMPTS = (
+    "hi",
+    "thanks, that helps",
+    "can you say that more simply?",
+    "what should I read next on this?",
+    "give me three bullet points",
+)
+
+FILLER = (
+    "I am comparing a few options for a side project and would like a careful answer that weighs "
+    "cost, maintenance and how quickly a small team can ship with each of them. "
+)
+
+def prompt(rng, op):
+    if op == 'tool':
+        return f"What's the stock price of {rng.choice(TICKERS)} right now?"
+    # Mostly short follow-ups, with the occasional long pasted message
+    if rng.random() < 0.2:
+        return FILLER * rng.randint(4, 20)
+    return rng.choice(SHORT_PROMPTS)
+
+def parse_weights(text):
+    weights = {}
+    for item in text.split(','):
+        name, _, weight = item.strip().rpartition('=')
+        weights[name] = float(weight)
+    return weights
+
+def pick(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+class Client:
+    """One keep-alive connection per worker, reopened whenever the server closes it."""
+
+    def __init__(self, url, timeout, headers=None):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.connection = None
+
+    def request(self, method, path, payload=None, headers=None, on_line=None):
+        """Return (status, headers, body); on_line(line) sees each body line as it arrives."""
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = dict(self.headers, **(headers or {}), **({'Content-Type': 'application/json'} if body else {}))
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            if on_line:
+                chunks = []
+                for line in iter(response.readline, b''):
+                    on_line(line)
+                    chunks.append(line)
+                data = b''.join(chunks)
+            else:
+                data = response.read()
+        except Exception:
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        return response.status, response.headers, data
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class Worker:
+    def __init__(self, driver, index):
+        self.driver = driver
+        self.rng = random.Random(driver.args.seed * 1000 + index)
+        # Each worker is its own client to the app's admission control
+        self.clients = [Client(url, driver.args.timeout, {'X-API-Key': f'bench-{index}'}) for url in driver.args.urls]
+        self.client = self.clients[0]
+        self.sent = 0
+        self.conversation_id = None
+        self.turns_left = 0
+        self.etag = None
+
+    def run(self, budget):
+        while budget.take():
+            op = pick(self.rng, self.driver.mix)
+            if op == 'history' and self.conversation_id is None:
+                op = 'chat'
+            self.client = self.clients[self.sent % len(self.clients)]
+            self.sent += 1
+            started = time.perf_counter()
+            first_token = None
+            try:
+                status, first_token = getattr(self, op)()
+            except Exception as e:
+                status = 0
+                self.driver.note_error(op, e)
+            elapsed = time.perf_counter() - started
+            self.driver.record(op, status, elapsed, first_token - started if first_token else None)
+        for client in self.clients:
+            client.close()
+
+    def next_turn(self):
+        if self.turns_left <= 0:
+            # Conversations last a geometric number of turns, averaging --turns
+            self.conversation_id = None
+            self.etag = None
+            self.turns_left = 1
+            while self.rng.random() > 1 / self.driver.args.turns:
+                self.turns_left += 1
+        self.turns_left -= 1
+
+    def chat_payload(self, op):
+        self.next_turn()
+        return {
+            "message": prompt(self.rng, op),
+            "model": pick(self.rng, self.driver.models),
+            "conversation_id": self.conversation_id,
+        }
+
+    def chat(self, op='chat'):
+        status, headers, data = self.client.request('POST', '/api/chat', self.chat_payload(op))
+        if status == 200:
+            self.conversation_id = json.loads(data).get('conversation_id') or self.conversation_id
+        return status, None
+
+    def tool(self):
+        return self.chat('tool')
+
+    def stream(self):
+        first_token = []
+        conversation = []
+
+        def on_line(line):
+            if line.startswith(b'event: delta') and not first_token:
+                first_token.append(time.perf_counter())
+            if conversation == [None]:
+                conversation[0] = json.loads(line[len(b'data: '):]).get('conversation_id')
+            elif line.startswith(b'event: conversation'):
+                conversation.append(None)
+
+        status, headers, data = self.client.request('POST', '/api/chat/stream', self.chat_payload('stream'), on_line=on_line)
+        if status == 200 and b'event: error' in data:
+            status = 500
+        if conversation and conversation[0]:
+            self.conversation_id = conversation[0]
+        return status, first_token[0] if first_token else None
+
+    def history(self):
+        # Revalidate like a browser does when it still holds the page
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        status, response_headers, data = self.client.request('GET', f'/api/chat_history/{self.conversation_id}?limit=50', headers=headers)
+        self.etag = response_headers.get('ETag') or self.etag
+        return status, None
+
+    def conversations(self):
+        status, headers, data = self.client.request('GET', '/api/conversations?limit=20')
+        return status, None
+
+class Budget:
+    """Shared stop condition: a request count, a deadline, or both."""
+
+    def __init__(self, requests=None, duration=None):
+        self.remaining = requests
+        self.deadline = time.perf_counter() + duration if duration else None
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.deadline and time.perf_counter() >= self.deadline:
+            return False
+        if self.remaining is None:
+            return True
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+class LoadDriver:
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_weights(args.mix)
+        self.models = parse_weights(args.models)
+        self.samples = []
+        self.errors = {}
+        self._lock = threading.Lock()
+        self.recording = False
+
+    def record(self, op, status, seconds, first_token):
+        if not self.recording:
+            return
+        with self._lock:
+            self.samples.append((op, status, seconds, first_token))
+
+    def note_error(self, op, error):
+        with self._lock:
+            key = f"{op}: {type(error).__name__}: {error}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def run_workers(self, budget):
+        workers = [Worker(self, index) for index in range(self.args.concurrency)]
+        threads = [threading.Thread(target=worker.run, args=(budget,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run(self):
+        if self.args.warmup:
+            self.run_workers(Budget(requests=self.args.warmup))
+        before = scrape_all(self.args.urls)
+        self.recording = True
+        started = time.perf_counter()
+        self.run_workers(Budget(requests=self.args.requests, duration=self.args.duration))
+        wall = time.perf_counter() - started
+        self.recording = False
+        after = scrape_all(self.args.urls)
+        return summarize(self.samples, wall, before, after, self.args)
+
+def scrape_metrics(url):
+    """Parse /metrics into {(name, labels): value}; empty if the server has none."""
+    try:
+        text = urllib.request.urlopen(url.rstrip('/') + '/metrics', timeout=10).read().decode()
+    except OSError:
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, _, value = line.rpartition(' ')
+        name, _, labels = series.partition('{')
+        samples[(name, labels.rstrip('}'))] = float(value)
+    return samples
+
+def scrape_all(urls):
+    # Counters from every app process, added up
+    samples = {}
+    for url in urls:
+        for key, value in scrape_metrics(url).items():
+            samples[key] = samples.get(key, 0.0) + value
+    return samples
+
+def metric_delta(before, after, name, label=None):
+    """Growth of a metric over the run, summed over its series or split by one label."""
+    totals = {}
+    for (sample, labels), value in after.items():
+        if sample != name:
+            continue
+        key = None
+        if label:
+            match = re.search(rf'{label}="([^"]*)"', labels)
+            key = match.group(1) if match else ''
+        totals[key] = totals.get(key, 0.0) + value - before.get((sample, labels), 0.0)
+    return totals if label else totals.get(None, 0.0)
+
+def latency_summary(samples):
+    seconds = [sample[2] for sample in samples if 200 <= sample[1] < 400]
+    first_tokens = [sample[3] for sample in samples if sample[3] is not None]
+    summary = {
+        "count": len(samples),
+        "errors": sum(1 for sample in samples if not 200 <= sample[1] < 400),
+    }
+    for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        value = percentile(seconds, q)
+        summary[f"{name}_ms"] = round(value * 1000, 2) if value is not None else None
+    summary["mean_ms"] = round(sum(seconds) / len(seconds) * 1000, 2) if seconds else None
+    if first_tokens:
+        summary["first_token_p50_ms"] = round(percentile(first_tokens, 0.5) * 1000, 2)
+        summary["first_token_p95_ms"] = round(percentile(first_tokens, 0.95) * 1000, 2)
+    return summary
+
+def summarize(samples, wall, before, after, args):
+    operations = {}
+    for op in sorted({sample[0] for sample in samples}):
+        operations[op] = latency_summary([sample for sample in samples if sample[0] == op])
+    succeeded = sum(1 for sample in samples if 200 <= sample[1] < 400)
+    chat_turns = sum(1 for sample in samples if sample[0] in ('chat', 'stream', 'tool'))
+    db_seconds = metric_delta(before, after, 'db_query_seconds_sum')
+    db_queries = metric_delta(before, after, 'db_query_seconds_count')
+    stage_seconds = metric_delta(before, after, 'chat_stage_seconds_sum', 'stage')
+    return {
+        "config": {
+            "url": args.url,
+            "server": args.spawn,
+            "workers": len(args.urls),
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "models": args.models,
+            "env": args.env,
+        },
+        "wall_seconds": round(wall, 3),
+        "requests": len(samples),
+        "throughput_rps": round(succeeded / wall, 2) if wall else None,
+        "overall": latency_summary(samples),
+        "operations": operations,
+        "db": {
+            "seconds": round(db_seconds, 4),
+            "queries": int(db_queries),
+            "ms_per_request": round(db_seconds / len(samples) * 1000, 3) if samples else None,
+            "queries_per_request": round(db_queries / len(samples), 2) if samples else None,
+        } if after else None,
+        # Mean time per chat turn spent in each stage of chat()
+        "stages_ms_per_turn": {
+            stage: round(seconds / chat_turns * 1000, 3) for stage, seconds in sorted(stage_seconds.items())
+        } if after and chat_turns else None,
+    }
+
+def format_ms(value):
+    return f"{value:9.2f}" if value is not None else f"{'-':>9}"
+
+def print_report(result, errors):
+    print(f"\n{result['requests']} requests in {result['wall_seconds']:.1f} s, "
+          f"{result['throughput_rps']} req/s, {result['overall']['errors']} errors")
+    print(f"{'operation':<14} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft p50':>9}")
+    for op, summary in list(result['operations'].items()) + [('all', result['overall'])]:
+        print(f"{op:<14} {summary['count']:>6} {summary['errors']:>6} {format_ms(summary['p50_ms'])} "
+              f"{format_ms(summary['p95_ms'])} {format_ms(summary['p99_ms'])} {format_ms(summary.get('first_token_p50_ms'))}")
+    if result['db']:
+        db = result['db']
+        print(f"DB: {db['seconds']:.3f} s over {db['queries']} statements, "
+              f"{db['ms_per_request']} ms and {db['queries_per_request']} statements per request")
+    if result['stages_ms_per_turn']:
+        print("Stages per chat turn: " + ", ".join(f"{stage} {ms:.2f} ms" for stage, ms in result['stages_ms_per_turn'].items()))
+    for error, count in sorted(errors.items(), key=lambda item: -item[1])[:5]:
+        print(f"  {count} x {error}")
+
+def comparisons(result, baseline):
+    """(name, baseline, current, higher_is_better) for every number worth comparing."""
+    yield "throughput req/s", baseline['throughput_rps'], result['throughput_rps'], True
+    for op in sorted(set(result['operations']) | {'all'}):
+        current = result['overall'] if op == 'all' else result['operations'].get(op)
+        previous = baseline['overall'] if op == 'all' else baseline['operations'].get(op)
+        if not current or not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'first_token_p50_ms'):
+            if current.get(metric) is not None and previous.get(metric) is not None:
+                yield f"{op} {metric}", previous[metric], current[metric], False
+    if result.get('db') and baseline.get('db'):
+        yield "db ms/request", baseline['db']['ms_per_request'], result['db']['ms_per_request'], False
+        yield "db statements/request", baseline['db']['queries_per_request'], result['db']['queries_per_request'], False
+
+def compare(result, baseline, threshold, min_delta_ms):
+    """Print the change against a saved run; return the regressions."""
+    regressions = []
+    print(f"\n{'metric':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, previous, current, higher_is_better in comparisons(result, baseline):
+        change = (current - previous) / previous if previous else 0.0
+        worse = -change if higher_is_better else change
+        # Sub-millisecond moves on fast endpoints are noise, whatever the percentage
+        noticeable = higher_is_better or not name.endswith('_ms') or abs(current - previous) >= min_delta_ms
+        flag = ""
+        if worse > threshold and noticeable:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif -worse > threshold and noticeable:
+            flag = "  improved"
+        print(f"{name:<28} {previous:>10} {current:>10} {change:>+8.1%}{flag}")
+    return regressions
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode} before it was ready")
+        try:
+            urllib.request.urlopen(url, timeout=2)
+            return
+        except urllib.error.HTTPError:
+            # Answering at all means it is up
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} was not ready after {timeout} s")
+
+def start_stack(args, workdir):
+    """Start the fake provider and the app on a fresh database; return the processes."""
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    provider_port = free_port()
+    provider = subprocess.Popen([
+        sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_provider.py'),
+        '--port', str(provider_port),
+        '--latency', str(args.provider_latency),
+        '--tokens-per-second', str(args.tokens_per_second),
+        '--output-tokens', str(args.output_tokens),
+        '--tool-rate', str(args.tool_rate),
+        '--error-rate', str(args.error_rate),
+        '--seed', str(args.seed),
+    ], stdout=log, stderr=subprocess.STDOUT)
+    processes = [provider]
+
+    provider_url = f"http://127.0.0.1:{provider_port}"
+    env = dict(
+        os.environ,
+        ANTHROPIC_API_KEY='benchmark',
+        OPENROUTER_API_KEY='benchmark',
+        ANTHROPIC_BASE_URL=provider_url,
+        OPENROUTER_BASE_URL=f"{provider_url}/api/v1",
+        DATABASE_URL=args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        TURN_JOURNAL_PATH=os.path.join(workdir, 'turns'),
+        BLOB_STORE_PATH=os.path.join(workdir, 'blobs'),
+        REQUEST_LOG='false',
+        # Measure the app, not the per-client rate limit; --env CLIENT_RATE_LIMIT=... to include it
+        CLIENT_RATE_LIMIT='0',
+        # The stub shadows the real yfinance, so tool calls stay offline
+        PYTHONPATH=os.pathsep.join(filter(None, [os.path.join(BENCHMARKS_DIR, 'stubs'), BACKEND_DIR, os.environ.get('PYTHONPATH')])),
+    )
+    env.update(item.split('=', 1) for item in args.env)
+
+    wait_until_ready(f"{provider_url}/api/v1/generation?id=ready", provider)
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'db', 'upgrade'],
+                   cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+
+    args.urls = []
+    for _ in range(args.workers):
+        app_port = free_port()
+        if args.spawn == 'asgi':
+            command = [sys.executable, '-m', 'hypercorn', 'asgi:app', '--bind', f"127.0.0.1:{app_port}"]
+        else:
+            command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(app_port), '--with-threads', '--no-reload', '--no-debugger']
+        server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        processes.append(server)
+        args.urls.append(f"http://127.0.0.1:{app_port}")
+        wait_until_ready(f"{args.urls[-1]}/metrics", server)
+    args.url = args.urls[0]
+    return processes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', choices=('flask', 'asgi'), help="start a fake provider and this server instead of using --url")
+    parser.add_argument('--database-url', help="database for --spawn; defaults to a throwaway SQLite file")
+    parser.add_argument('--workers', type=int, default=1, help="app processes for --spawn, sharing its database")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="extra server setting for --spawn, repeatable")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--duration', type=float, help="stop after this many seconds instead of --requests")
+    parser.add_argument('--warmup', type=int, default=20, help="requests sent before measuring")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="operation weights")
+    parser.add_argument('--models', default=DEFAULT_MODELS, help="model weights for chat turns")
+    parser.add_argument('--turns', type=float, default=4, help="mean turns per conversation")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--provider-latency', type=float, default=0.2, help="fake provider time to first token, for --spawn")
+    parser.add_argument('--tokens-per-second', type=float, default=200)
+    parser.add_argument('--output-tokens', type=int, default=60)
+    parser.add_argument('--tool-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help="save the results as JSON")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare with a saved run and exit 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=0.10, help="relative change that counts as a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help="ignore latency changes smaller than this")
+    args = parser.parse_args()
+    if args.duration:
+        args.requests = None
+    args.urls = [args.url]
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if args.spawn:
+                processes = start_stack(args, workdir)
+                print(f"Started {args.spawn} at {', '.join(args.urls)}")
+            driver = LoadDriver(args)
+            result = driver.run()
+        except Exception:
+            log = os.path.join(workdir, 'server.log')
+            if os.path.exists(log):
+                sys.stderr.write(open(log).read()[-4000:])
+            raise
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+
+    print_report(result, driver.errors)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo regressions over {args.threshold:.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Compare the per-turn history query with and without the composite index.
+
+Builds a throwaway SQLite database shaped like chat_message, then times
+the query chat() and /api/chat_history run for random conversations:
+
+    python benchmarks/bench_history_index.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HISTORY_QUERY = (
+    "SELECT id, role, content FROM chat_message "
+    "WHERE conversation_id = ? ORDER BY timestamp"
+)
+
+PAGE_QUERY = (
+    "SELECT id, role, content FROM chat_message "
+    "WHERE conversation_id = ? ORDER BY timestamp DESC, id DESC LIMIT 50"
+)
+
+def build_database(path, rows, conversations, batch_size=50000):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(
+        "CREATE TABLE chat_message ("
+        "id INTEGER PRIMARY KEY, conversation_id INTEGER NOT NULL, role VARCHAR(10) NOT NULL, "
+        "content TEXT NOT NULL, timestamp DATETIME)"
+    )
+    start = datetime(2024, 1, 1)
+    # Turns from many conversations interleave in insertion order, as they do in production
+    batch = []
+    for i in range(rows):
+        batch.append((
+            random.randrange(conversations),
+            'user' if i % 2 == 0 else 'assistant',
+            'x' * random.randint(50, 400),
+            (start + timedelta(seconds=i)).isoformat(' '),
+        ))
+        if len(batch) == batch_size:
+            conn.executemany("INSERT INTO chat_message (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO chat_message (conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    return conn
+
+def query_plan(conn, sql):
+    return "; ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", (0,)))
+
+def time_query(conn, sql, conversation_ids):
+    timings = []
+    for conversation_id in conversation_ids:
+        started = time.perf_counter()
+        conn.execute(sql, (conversation_id,)).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+def report(label, conn, conversation_ids):
+    for name, sql in (("history", HISTORY_QUERY), ("last page", PAGE_QUERY)):
+        median, worst = time_query(conn, sql, conversation_ids)
+        print(f"{label:<10} {name:<10} median {median:9.3f} ms   max {worst:9.3f} ms   plan: {query_plan(conn, sql)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--conversations', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        print(f"Building {args.rows} rows across {args.conversations} conversations...")
+        conn = build_database(path, args.rows, args.conversations)
+        conversation_ids = [random.randrange(args.conversations) for _ in range(args.queries)]
+
+        report("scan", conn, conversation_ids)
+
+        started = time.perf_counter()
+        conn.execute("CREATE INDEX ix_chat_message_conversation_id_timestamp ON chat_message (conversation_id, timestamp)")
+        conn.execute("ANALYZE")
+        print(f"Index built in {time.perf_counter() - started:.1f} s")
+
+        report("index", conn, conversation_ids)
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Local stand-in for the Anthropic and OpenRouter APIs.
+
+Answers the Messages API at /v1/messages and OpenRouter's chat
+completions and generation stats under /api/v1, streamed or not, with
+a configurable time to first token, output speed and tool use, so the
+app can be load tested without network calls or token spend:
+
+    python benchmarks/fake_provider.py --port 8700 --latency 0.3 --tokens-per-second 80
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8700 OPENROUTER_BASE_URL=http://127.0.0.1:8700/api/v1 python app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WORDS = (
+    "the market moved on earnings while analysts weighed guidance for the coming quarter and "
+    "investors rotated between sectors as yields settled and volatility eased into the close"
+).split()
+
+# Words are the fake tokenizer's tokens; prompts are counted at four characters a token
+CHARS_PER_TOKEN = 4
+
+class ProviderBehavior:
+    def __init__(self, latency=0.0, tokens_per_second=0.0, output_tokens=60, tool_rate=0.0,
+                 tool_keywords=('stock', 'price'), error_rate=0.0, seed=None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.tool_rate = tool_rate
+        self.tool_keywords = tool_keywords
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def chance(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def reply_words(self):
+        with self._lock:
+            start = self.random.randrange(len(WORDS))
+        return [WORDS[(start + index) % len(WORDS)] for index in range(self.output_tokens)]
+
+    def wants_tool(self, text):
+        text = text.lower()
+        return any(keyword in text for keyword in self.tool_keywords) or self.chance(self.tool_rate)
+
+    def paced(self, tokens):
+        """Yield tokens no faster than tokens_per_second, after the first-token latency."""
+        time.sleep(self.latency)
+        started = time.perf_counter()
+        for index, token in enumerate(tokens):
+            if self.tokens_per_second:
+                delay = started + index / self.tokens_per_second - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield token
+
+def ticker_in(text):
+    match = re.search(r'\b[A-Z]{2,5}\b', text)
+    return match.group(0) if match else 'AAPL'
+
+def prompt_tokens(payload):
+    return max(1, len(json.dumps(payload.get('messages', []))) // CHARS_PER_TOKEN)
+
+def text_of(content):
+    if isinstance(content, str):
+        return content
+    return " ".join(block.get('text', '') for block in content if isinstance(block, dict))
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    behavior = ProviderBehavior()
+    generations = OrderedDict()
+    generations_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_events(self):
+        # Streams end when the connection closes, so they need no length or chunking
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def send_event(self, data, event=None):
+        lines = (f"event: {event}\n" if event else "") + f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+        self.wfile.write(lines.encode())
+        self.wfile.flush()
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        payload = self.read_json()
+        if path.endswith('/v1/messages') and not path.startswith('/api'):
+            handler = self.anthropic_messages
+        elif path.endswith('/chat/completions'):
+            handler = self.chat_completions
+        else:
+            return self.send_json(404, {"error": {"message": f"No route for {path}"}})
+        if self.behavior.chance(self.behavior.error_rate):
+            time.sleep(self.behavior.latency)
+            return self.send_json(529 if handler == self.anthropic_messages else 503, {
+                "type": "error",
+                "error": {"type": "overloaded_error", "message": "Overloaded"},
+            })
+        try:
+            handler(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # The app gave up on the request, such as a hedge that lost the race
+            self.close_connection = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith('/generation'):
+            generation_id = parse_qs(url.query).get('id', [''])[0]
+            with self.generations_lock:
+                stats = self.generations.get(generation_id)
+            if stats is None:
+                return self.send_json(404, {"error": {"message": "Generation not found"}})
+            return self.send_json(200, {"data": dict(stats, id=generation_id)})
+        self.send_json(404, {"error": {"message": f"No route for {url.path}"}})
+
+    # Anthropic
+    def anthropic_reply(self, payload):
+        messages = payload.get('messages', [])
+        last = messages[-1]['content'] if messages else ''
+        answered_tool = isinstance(last, list) and any(
+            isinstance(block, dict) and block.get('type') == 'tool_result' for block in last
+        )
+        tools = payload.get('tools') or []
+        if tools and not answered_tool and self.behavior.wants_tool(text_of(last)):
+            tool = next((tool for tool in tools if tool['name'] == 'fetch_stock_data'), tools[0])
+            return "Let me look that up.", {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                "name": tool['name'],
+                "input": {"ticker": ticker_in(text_of(last))},
+            }
+        return None, None
+
+    def anthropic_messages(self, payload):
+        model = payload.get('model')
+        input_tokens = prompt_tokens(payload)
+        preamble, tool_use = self.anthropic_reply(payload)
+        words = preamble.split() if tool_use else self.behavior.reply_words()
+        stop_reason = 'tool_use' if tool_use else 'end_turn'
+        usage = {"input_tokens": input_tokens, "output_tokens": len(words), "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "stop_reason": None,
+            "stop_sequence": None,
+        }
+        if not payload.get('stream'):
+            text = " ".join(self.behavior.paced(words))
+            content = [{"type": "text", "text": text}] + ([tool_use] if tool_use else [])
+            return self.send_json(200, dict(message, content=content, stop_reason=stop_reason, usage=usage))
+
+        self.start_events()
+        self.send_event({"type": "message_start", "message": dict(message, content=[], usage=dict(usage, output_tokens=1))}, 'message_start')
+        self.send_event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}, 'content_block_start')
+        for index, word in enumerate(self.behavior.paced(words)):
+            delta = {"type": "text_delta", "text": (" " if index else "") + word}
+            self.send_event({"type": "content_block_delta", "index": 0, "delta": delta}, 'content_block_delta')
+        self.send_event({"type": "content_block_stop", "index": 0}, 'content_block_stop')
+        if tool_use:
+            self.send_event({"type": "content_block_start", "index": 1, "content_block": dict(tool_use, input={})}, 'content_block_start')
+            delta = {"type": "input_json_delta", "partial_json": json.dumps(tool_use['input'])}
+            self.send_event({"type": "content_block_delta", "index": 1, "delta": delta}, 'content_block_delta')
+            self.send_event({"type": "content_block_stop", "index": 1}, 'content_block_stop')
+        self.send_event({
+            "type": "message_delta",
+            "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+            "usage": {"output_tokens": len(words)},
+        }, 'message_delta')
+        self.send_event({"type": "message_stop"}, 'message_stop')
+
+    # OpenRouter
+    def openai_reply(self, payload):
+        messages = payload.get('messages', [])
+        last = messages[-1] if messages else {}
+        tools = payload.get('tools') or []
+        if tools and last.get('role') != 'tool' and self.behavior.wants_tool(text_of(last.get('content') or '')):
+            tool = next((tool for tool in tools if tool['function']['name'] == 'fetch_stock_data'), tools[0])
+            return {
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": tool['function']['name'], "arguments": json.dumps({"ticker": ticker_in(text_of(last.get('content') or ''))})},
+            }
+        return None
+
+    def record_generation(self, generation_id, input_tokens, output_tokens):
+        with self.generations_lock:
+            self.generations[generation_id] = {
+                "tokens_prompt": input_tokens,
+                "tokens_completion": output_tokens,
+                "total_cost": round((input_tokens * 0.15 + output_tokens * 0.6) / 1e6, 8),
+            }
+            while len(self.generations) > 10000:
+                self.generations.popitem(last=False)
+
+    def chat_completions(self, payload):
+        model = payload.get('model')
+        generation_id = f"gen-{uuid.uuid4().hex[:24]}"
+        input_tokens = prompt_tokens(payload)
+        tool_call = self.openai_reply(payload)
+        words = [] if tool_call else self.behavior.reply_words()
+        finish_reason = 'tool_calls' if tool_call else 'stop'
+        output_tokens = max(len(words), 1)
+        usage = {"prompt_tokens": input_tokens, "completion_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        chunk = {"id": generation_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        self.record_generation(generation_id, input_tokens, output_tokens)
+
+        if not payload.get('stream'):
+            text = " ".join(self.behavior.paced(words)) if words else None
+            if tool_call:
+                time.sleep(self.behavior.latency)
+            return self.send_json(200, {
+                "id": generation_id,
+                "object": "chat.completion",
+                "created": chunk['created'],
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text, "tool_calls": [tool_call] if tool_call else None},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            })
+
+        self.start_events()
+        for index, word in enumerate(self.behavior.paced(words)):
+            delta = {"content": (" " if index else "") + word}
+            if index == 0:
+                delta["role"] = "assistant"
+            self.send_event(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        if tool_call:
+            delta = {"role": "assistant", "tool_calls": [dict(tool_call, index=0)]}
+            self.send_event(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        self.send_event(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+        if (payload.get('stream_options') or {}).get('include_usage'):
+            self.send_event(dict(chunk, choices=[], usage=usage))
+        self.send_event("[DONE]")
+
+def make_server(host='127.0.0.1', port=8700, **behavior):
+    handler = type('Handler', (FakeProviderHandler,), {
+        'behavior': ProviderBehavior(**behavior),
+        'generations': OrderedDict(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="output speed; 0 sends everything at once")
+    parser.add_argument('--output-tokens', type=int, default=60)
+    parser.add_argument('--tool-rate', type=float, default=0.0, help="share of other prompts that also get a tool call")
+    parser.add_argument('--tool-keywords', default='stock,price', help="prompts with any of these words get a tool call")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of calls answered 529/503")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host,
+        args.port,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        tool_rate=args.tool_rate,
+        tool_keywords=tuple(keyword.strip().lower() for keyword in args.tool_keywords.split(',') if keyword.strip()),
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"Fake provider listening on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
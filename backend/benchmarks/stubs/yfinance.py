@@ -0,0 +1,35 @@
+"""Offline stand-in for yfinance.
+
+Put benchmarks/stubs first on PYTHONPATH and the app's `import yfinance`
+gets this module instead: Ticker(symbol).info returns a made-up quote
+after YFINANCE_STUB_LATENCY seconds, so stock tool calls cost about what
+a real lookup does without touching the network.
+"""
+import os
+import time
+import zlib
+
+LATENCY = float(os.getenv('YFINANCE_STUB_LATENCY', 0.05))
+
+class Ticker:
+    def __init__(self, ticker):
+        self.ticker = ticker.upper()
+
+    @property
+    def info(self):
+        time.sleep(LATENCY)
+        # Stable per symbol, so repeated lookups look like the same stock
+        seed = zlib.crc32(self.ticker.encode())
+        price = round(20 + seed % 48000 / 100, 2)
+        return {
+            'symbol': self.ticker,
+            'shortName': f"{self.ticker} Holdings Inc.",
+            'currency': 'USD',
+            'currentPrice': price,
+            'previousClose': round(price * 0.99, 2),
+            'dayHigh': round(price * 1.01, 2),
+            'dayLow': round(price * 0.98, 2),
+            'marketCap': seed % 900 * 10 ** 9,
+            'volume': seed % 50000000,
+            'trailingPE': round(10 + seed % 3000 / 100, 2),
+        }
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+DEFAULT_MEDIA_TYPE = 'image/png'
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+DATA_URL_PATTERN = re.compile(r'^data:(?P<media_type>[\w.+-]+/[\w.+-]+)?(?:;[^,]*)?,')
+
+def data_url_media_type(data_url):
+    match = DATA_URL_PATTERN.match(data_url)
+    return (match and match.group('media_type')) or DEFAULT_MEDIA_TYPE
+
+def parse_data_url(data_url):
+    """Split a base64 data URL (or bare base64) into its media type and bytes."""
+    match = DATA_URL_PATTERN.match(data_url)
+    payload = data_url[match.end():] if match else data_url
+    media_type = data_url_media_type(data_url)
+    try:
+        return media_type, base64.b64decode(payload, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"Image data is not valid base64: {str(e)}")
+
+def to_data_url(media_type, data):
+    return f"data:{media_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+class BlobStore:
+    """Content-addressed files on local disk, keyed by SHA-256.
+
+    Identical uploads share one file, and a blob never changes once
+    written, which is what lets the image route cache it forever.
+    Files are only removed by delete(), once no message refers to them;
+    see collect_blobs in app.py.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        if not DIGEST_PATTERN.match(digest):
+            raise ValueError(f"Invalid blob digest: {digest}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            # A new reference that is not saved yet; delete(older_than=...) leaves it alone
+            os.utime(path)
+            return digest
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def delete(self, digest, older_than=None):
+        """Remove a blob, returning whether it was removed.
+
+        With older_than (a timestamp), a blob written or reused since
+        then is kept.
+        """
+        path = self.path(digest)
+        try:
+            if older_than is not None and os.path.getmtime(path) > older_than:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def digests(self):
+        for directory, _, names in os.walk(self.root):
+            # Skips the temp files of writes in progress
+            yield from (name for name in names if DIGEST_PATTERN.match(name))
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+ContextSnapshot = namedtuple(
+    'ContextSnapshot',
+    ['claude_messages', 'claude_tokens', 'openrouter_messages', 'openrouter_tokens']
+)
+
+# Stands in for a ChatMessage row once its session is gone
+ContextMessage = namedtuple('ContextMessage', ['id', 'role', 'content', 'token_estimate'])
+
+class ConversationContext:
+    """Provider-ready message lists for one conversation, grown one turn at a time."""
+
+    def __init__(self):
+        self.last_message_id = 0
+        # What the database looked like when this was loaded; see ConversationContextCache.get
+        self.watermark = None
+        self.claude_messages = []
+        self.claude_tokens = []
+        self.openrouter_messages = []
+        self.openrouter_tokens = []
+
+    def append(self, message_id, role, content, tokens):
+        self.last_message_id = message_id
+        self.openrouter_messages.append({"role": role, "content": content})
+        self.openrouter_tokens.append(tokens)
+        # Claude rejects consecutive turns from the same role, so merge them
+        if not self.claude_messages or self.claude_messages[-1]['role'] != role:
+            self.claude_messages.append({"role": role, "content": content})
+            self.claude_tokens.append(tokens)
+        else:
+            self.claude_messages[-1]['content'] += f"\n\n{content}"
+            self.claude_tokens[-1] += tokens
+
+    def snapshot(self):
+        # Callers attach images to the last turn, so hand out copies of the dicts
+        return ContextSnapshot(
+            [dict(message) for message in self.claude_messages],
+            list(self.claude_tokens),
+            [dict(message) for message in self.openrouter_messages],
+            list(self.openrouter_tokens),
+        )
+
+class ConversationContextCache:
+    """Per-process LRU of conversation contexts.
+
+    Other workers write turns, reset conversations and store summaries
+    without this process hearing about it, so each lookup passes the
+    conversation's current watermark (the count and the first and last
+    ids of its visible messages, its reset point and summary version) and a cached context that no
+    longer matches it is rebuilt.
+    """
+
+    def __init__(self, estimate_tokens, max_conversations=256):
+        self.estimate_tokens = estimate_tokens
+        self.max_conversations = max_conversations
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id, watermark=None):
+        with self._lock:
+            context = self._contexts.get(conversation_id)
+            if context is None:
+                return None
+            if watermark is not None and context.watermark != watermark:
+                del self._contexts[conversation_id]
+                return None
+            self._contexts.move_to_end(conversation_id)
+            return context.snapshot()
+
+    def load(self, conversation_id, messages, watermark=None):
+        context = ConversationContext()
+        for message in messages:
+            context.append(message.id, message.role, message.content, self._tokens(message))
+        # Read before the messages, so a turn written in between shows up as a mismatch next time
+        context.watermark = watermark
+        with self._lock:
+            self._contexts[conversation_id] = context
+            self._contexts.move_to_end(conversation_id)
+            while len(self._contexts) > self.max_conversations:
+                self._contexts.popitem(last=False)
+            return context.snapshot()
+
+    def tokens(self, conversation_id):
+        """Estimated tokens of a cached conversation's context, or None if it is not cached."""
+        with self._lock:
+            context = self._contexts.get(conversation_id)
+            return sum(context.openrouter_tokens) if context is not None else None
+
+    def append(self, conversation_id, message):
+        with self._lock:
+            context = self._contexts.get(conversation_id)
+            if context is None:
+                return
+            if message.id <= context.last_message_id:
+                # Turns landed out of order; rebuild from the database next time
+                del self._contexts[conversation_id]
+                return
+            context.append(message.id, message.role, message.content, self._tokens(message))
+            if context.watermark is not None:
+                # Turns this process writes move the watermark the way they move the database
+                count, first_id, _, cleared_through_id, summary_version = context.watermark
+                context.watermark = (count + 1, first_id or message.id, message.id, cleared_through_id, summary_version)
+
+    def _tokens(self, message):
+        if message.token_estimate is not None:
+            return message.token_estimate
+        return self.estimate_tokens(message.content)
+
+    def extend(self, snapshot, message):
+        """Return `snapshot` (or an empty context) plus a message not in the database yet."""
+        context = ConversationContext()
+        if snapshot is not None:
+            context.claude_messages, context.claude_tokens, context.openrouter_messages, context.openrouter_tokens = snapshot
+        context.append(message.id, message.role, message.content, self._tokens(message))
+        return context.snapshot()
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._contexts.pop(conversation_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
@@ -0,0 +1,56 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Direct Anthropic models are not listed in the OpenRouter export
+CLAUDE_CONTEXT_LIMITS = {
+    'claude-3-5-sonnet-20240620': 200000,
+    'claude-3-opus-20240229': 200000,
+    'claude-3-sonnet-20240229': 200000,
+    'claude-3-haiku-20240307': 200000,
+}
+
+DEFAULT_CONTEXT_LIMIT = 8192
+
+# Rough per-turn overhead for role markers and message framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Upper bound of what Claude charges for one image in a prompt
+IMAGE_TOKEN_ESTIMATE = 1600
+
+def estimate_tokens(text):
+    # About four characters per token for English text and code
+    return len(text or "") // 4 + MESSAGE_OVERHEAD_TOKENS
+
+class ContextWindow:
+    """Trims conversation history to fit a model's context and a token budget."""
+
+    def __init__(self, context_limits, token_budget=None, default_limit=DEFAULT_CONTEXT_LIMIT):
+        self.context_limits = context_limits
+        self.token_budget = token_budget
+        self.default_limit = default_limit
+
+    def budget(self, model, reserved_tokens=0):
+        available = self.context_limits.get(model, self.default_limit) - reserved_tokens
+        if self.token_budget:
+            available = min(available, self.token_budget)
+        return max(available, 0)
+
+    def trim(self, model, messages, token_counts, reserved_tokens=0):
+        budget = self.budget(model, reserved_tokens)
+        kept, total = 0, 0
+        # Walk back from the newest turn, which is always kept
+        for tokens in reversed(token_counts):
+            if kept and total + tokens > budget:
+                break
+            total += tokens
+            kept += 1
+
+        start = len(messages) - kept
+        # The window has to open on a user turn
+        while start < len(messages) - 1 and messages[start]['role'] != 'user':
+            start += 1
+
+        if start:
+            logger.info(f"Trimmed {start} of {len(messages)} turns to fit {budget} tokens for {model}")
+        return messages[start:]
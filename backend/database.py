@@ -0,0 +1,58 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URL = 'sqlite:///chat_history.db'
+
+def database_url_from_env():
+    url = os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL)
+    # Some hosts still hand out the postgres:// scheme SQLAlchemy dropped
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def engine_options_from_env(url):
+    """Connection pool settings for server databases.
+
+    SQLite keeps SQLAlchemy's default pool, since every connection is
+    just a file handle.
+    """
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+    }
+
+def sqlite_pragmas_from_env():
+    return {
+        # WAL lets readers keep going while a chat turn commits
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        # NORMAL only fsyncs at checkpoints, which is durable enough under WAL
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        # Negative values are in KiB, so this is a 64 MiB page cache per connection
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64 * 1024)),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
+    }
+
+def configure_engine(engine, pragmas=None):
+    """Apply SQLite PRAGMAs to every new connection of an engine.
+
+    Other backends are left alone. Accepts the sync_engine of an
+    AsyncEngine as well.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas_from_env() if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
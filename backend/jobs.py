@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update
+
+logger = logging.getLogger(__name__)
+
+def delete_in_chunks(session, model, *criteria, chunk_size=500, pause=0.05):
+    """Delete matching rows a chunk per transaction, returning the count.
+
+    Each chunk commits on its own, so the write lock is only held briefly
+    and chat commits waiting on it get in between chunks.
+    """
+    deleted = 0
+    while True:
+        ids = session.scalars(select(model.id).where(*criteria).limit(chunk_size)).all()
+        if not ids:
+            return deleted
+        session.execute(delete(model).where(model.id.in_(ids)))
+        session.commit()
+        deleted += len(ids)
+        time.sleep(pause)
+
+def update_in_chunks(session, model, values, *criteria, chunk_size=500, pause=0.05):
+    updated = 0
+    while True:
+        ids = session.scalars(select(model.id).where(*criteria).limit(chunk_size)).all()
+        if not ids:
+            return updated
+        session.execute(update(model).where(model.id.in_(ids)).values(values))
+        session.commit()
+        updated += len(ids)
+        time.sleep(pause)
+
+class JobRunner:
+    """Runs jobs stored in the job table on a background thread.
+
+    Any process can enqueue a job by adding a row; runners in every
+    process claim rows with a conditional UPDATE, so each job runs once at
+    a time. A claimed job is leased: if its process dies, the job becomes
+    claimable again once the lease runs out, so handlers must be safe to
+    run twice. Failed jobs are retried with backoff up to max_attempts.
+    """
+
+    def __init__(self, db, job_model, app_context, poll_interval=1.0, lease=300, max_attempts=5,
+                 retry_delay=30, clock=datetime.utcnow):
+        self.db = db
+        self.job_model = job_model
+        self.app_context = app_context
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self.handlers = {}
+        self.schedules = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def handler(self, kind):
+        def register(function):
+            self.handlers[kind] = function
+            return function
+        return register
+
+    def schedule(self, kind, every, **payload):
+        """Enqueue `kind` every `every` seconds unless one is already pending."""
+        self.schedules.append({"kind": kind, "every": every, "payload": payload, "due": time.monotonic()})
+
+    def job(self, kind, **payload):
+        return self.job_model(kind=kind, payload=json.dumps(payload), status='queued', run_after=self.clock())
+
+    def enqueue(self, kind, unique=False, **payload):
+        """Add a job to the current session; it runs once the session commits."""
+        if unique and self.pending(kind):
+            return None
+        job = self.job(kind, **payload)
+        self.db.session.add(job)
+        return job
+
+    def pending(self, kind):
+        Job = self.job_model
+        return self.db.session.scalar(
+            select(Job.id).where(Job.kind == kind, Job.status.in_(('queued', 'running'))).limit(1)
+        ) is not None
+
+    def start(self):
+        # Threads do not survive a fork, so start one per process
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app_context():
+                    self._enqueue_scheduled()
+                    ran = self.run_next()
+            except Exception as e:
+                logger.error(f"Job runner error: {str(e)}", exc_info=True)
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _enqueue_scheduled(self):
+        for schedule in self.schedules:
+            if time.monotonic() < schedule["due"]:
+                continue
+            schedule["due"] = time.monotonic() + schedule["every"]
+            if self.enqueue(schedule["kind"], unique=True, **schedule["payload"]):
+                self.db.session.commit()
+
+    def claimable(self, now):
+        Job = self.job_model
+        return or_(
+            and_(Job.status == 'queued', Job.run_after <= now),
+            and_(Job.status == 'running', Job.locked_until < now),
+        )
+
+    def claim(self):
+        Job = self.job_model
+        session = self.db.session
+        now = self.clock()
+        job_id = session.scalar(select(Job.id).where(self.claimable(now)).order_by(Job.run_after, Job.id).limit(1))
+        if job_id is None:
+            return None
+        claimed = session.execute(
+            update(Job)
+            .where(Job.id == job_id, self.claimable(now))
+            .values(status='running', attempts=Job.attempts + 1, locked_until=now + timedelta(seconds=self.lease))
+        )
+        session.commit()
+        # Another runner got there first
+        if claimed.rowcount != 1:
+            return None
+        return session.get(Job, job_id)
+
+    def run_next(self):
+        """Run one due job, returning whether there was one."""
+        job = self.claim()
+        if job is None:
+            return False
+        session = self.db.session
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            handler(**json.loads(job.payload))
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}", exc_info=True)
+            job.last_error = str(e)
+            job.locked_until = None
+            if job.attempts >= self.max_attempts:
+                job.status = 'failed'
+                job.finished_at = self.clock()
+            else:
+                job.status = 'queued'
+                job.run_after = self.clock() + timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'done'
+            job.locked_until = None
+            job.finished_at = self.clock()
+        session.commit()
+        return True
+
+def serialize_job(job):
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,210 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from sqlalchemy import event
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400)
+
+# Spans only leave the process once an OpenTelemetry SDK and exporter are configured
+tracer = trace.get_tracer('chat') if trace else None
+
+request_logger = logging.getLogger('chat.requests')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+def format_value(value):
+    return "+Inf" if value == float('inf') else repr(float(value))
+
+class Metric:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(f"{self.name}_total", key, value) for key, value in sorted(values.items())]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key + (('le', format_value(bound)),), count))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, counts[-1]))
+        return samples
+
+class MetricsRegistry:
+    """Metrics rendered in the Prometheus text format.
+
+    Collectors are called at scrape time and return (labels, value) pairs
+    of a counter kept elsewhere, such as the tool cache's hit counts.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name, documentation, collect):
+        self._collectors.append((name, documentation, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for name, labels, value in metric.samples())
+        for name, documentation, collect in self._collectors:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}_total{format_labels(sorted(labels.items()))} {format_value(value)}" for labels, value in collect())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram('chat_request_seconds', "Chat request duration", ('endpoint', 'model', 'status'))
+STAGE_SECONDS = registry.histogram('chat_stage_seconds', "Time spent in each stage of a chat request", ('stage', 'model'))
+PROVIDER_SECONDS = registry.histogram('provider_request_seconds', "Provider call duration, per attempt", ('provider', 'model'))
+TIME_TO_FIRST_TOKEN = registry.histogram('provider_time_to_first_token_seconds', "Time until a streamed reply's first token", ('provider', 'model'))
+TOKENS_PER_SECOND = registry.histogram('provider_output_tokens_per_second', "Completion tokens per second of provider time", ('provider', 'model'), THROUGHPUT_BUCKETS)
+PROVIDER_ERRORS = registry.counter('provider_errors', "Failed provider attempts", ('provider', 'model', 'retryable'))
+PROVIDER_FALLBACKS = registry.counter('provider_fallbacks', "Requests moved on to the next route", ('provider', 'model'))
+PROVIDER_HEDGES = registry.counter('provider_hedges', "Requests also sent to a backup route for being slow", ('provider', 'model'))
+CACHE_REQUESTS = registry.counter('cache_requests', "Cache lookups by result", ('cache', 'result'))
+PROVIDER_TOKENS = registry.counter('provider_tokens', "Tokens billed by providers", ('provider', 'model', 'kind'))
+DB_SECONDS = registry.histogram('db_query_seconds', "Database statement execution time", ('operation',))
+ADMISSION_DECISIONS = registry.counter('admission_decisions', "Chat turns admitted, queued or rejected by the admission controller", ('result', 'priority'))
+ADMISSION_QUEUE_SECONDS = registry.histogram('admission_queue_seconds', "Time chat turns waited for a provider slot", ('priority',))
+
+def observe_provider_call(route, seconds, response=None):
+    PROVIDER_SECONDS.observe(seconds, provider=route.provider, model=route.model)
+    output_tokens = getattr(getattr(response, 'usage', None), 'output_tokens', None)
+    if output_tokens and seconds > 0:
+        TOKENS_PER_SECOND.observe(output_tokens / seconds, provider=route.provider, model=route.model)
+
+def observe_queries(engine):
+    """Time every statement an engine executes into db_query_seconds.
+
+    Accepts the sync_engine of an AsyncEngine as well. Rows fetched
+    after execute, as streamed pages are, are not counted.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def observe_query(conn, cursor, statement, parameters, context, executemany):
+        operation = (statement.split(None, 1) or ['other'])[0].upper()
+        DB_SECONDS.observe(time.perf_counter() - conn.info['query_started'], operation=operation)
+
+def observe_usage(call):
+    for kind in ('prompt', 'completion', 'cache_read', 'cache_creation'):
+        if call[f'tokens_{kind}']:
+            PROVIDER_TOKENS.inc(call[f'tokens_{kind}'], provider=call['provider'], model=call['model'], kind=kind)
+
+class RequestTrace:
+    """Stage timings for one chat request.
+
+    Each stage feeds chat_stage_seconds and, when OpenTelemetry is
+    installed, a span; finish() writes the request's JSON log line.
+    """
+
+    def __init__(self, endpoint, model=None, clock=time.perf_counter):
+        self.endpoint = endpoint
+        self.model = model
+        self.clock = clock
+        self.started = clock()
+        self.stages = {}
+        self.fields = {}
+        self.status = None
+
+    @contextmanager
+    def stage(self, name):
+        span = tracer.start_as_current_span(f"chat.{name}", attributes={"model": self.model}) if tracer else nullcontext()
+        started = self.clock()
+        try:
+            with span:
+                yield
+        finally:
+            elapsed = self.clock() - started
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            STAGE_SECONDS.observe(elapsed, stage=name, model=self.model)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def finish(self, status):
+        # Only the first call counts, so a finally can catch abandoned streams
+        if self.status is not None:
+            return
+        self.status = status
+        duration = self.clock() - self.started
+        REQUEST_SECONDS.observe(duration, endpoint=self.endpoint, model=self.model, status=status)
+        request_logger.info(json.dumps({
+            "event": "chat_request",
+            "endpoint": self.endpoint,
+            "model": self.model,
+            "status": status,
+            "duration": round(duration, 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            **self.fields,
+        }, default=str))
@@ -0,0 +1,52 @@
+"""Add provider_call usage ledger
+
+Revision ID: 15cd8b791804
+Revises: a159d41bf3d1
+Create Date: 2026-10-17 12:48:09.311842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '15cd8b791804'
+down_revision = 'a159d41bf3d1'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('provider_call',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=True),
+        sa.Column('provider', sa.String(length=20), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=False),
+        sa.Column('generation_id', sa.String(length=50), nullable=True),
+        sa.Column('tokens_prompt', sa.Integer(), nullable=True),
+        sa.Column('tokens_completion', sa.Integer(), nullable=True),
+        sa.Column('cost', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_provider_call_conversation_id', 'provider_call', ['conversation_id'])
+    op.create_index('ix_provider_call_message_id', 'provider_call', ['message_id'])
+    op.create_index('ix_provider_call_model', 'provider_call', ['model'])
+    op.create_index('ix_provider_call_generation_id', 'provider_call', ['generation_id'])
+
+    # Carry over the usage already recorded on assistant messages. Their model
+    # was never stored, and only the first call of a tool round trip was counted.
+    op.execute(
+        "INSERT INTO provider_call (conversation_id, message_id, provider, model, generation_id, "
+        "tokens_prompt, tokens_completion, cost, created_at) "
+        "SELECT conversation_id, id, "
+        "CASE WHEN generation_id IS NULL THEN 'anthropic' ELSE 'openrouter' END, 'unknown', generation_id, "
+        "tokens_prompt, tokens_completion, total_cost, timestamp "
+        "FROM chat_message WHERE role = 'assistant' AND (generation_id IS NOT NULL OR total_cost IS NOT NULL)"
+    )
+
+def downgrade():
+    op.drop_index('ix_provider_call_generation_id', table_name='provider_call')
+    op.drop_index('ix_provider_call_model', table_name='provider_call')
+    op.drop_index('ix_provider_call_message_id', table_name='provider_call')
+    op.drop_index('ix_provider_call_conversation_id', table_name='provider_call')
+    op.drop_table('provider_call')
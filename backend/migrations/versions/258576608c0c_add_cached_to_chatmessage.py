@@ -0,0 +1,22 @@
+"""Add cached flag to ChatMessage
+
+Revision ID: 258576608c0c
+Revises: 15cd8b791804
+Create Date: 2026-10-17 13:05:41.127364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '258576608c0c'
+down_revision = '15cd8b791804'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('chat_message', sa.Column('cached', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+def downgrade():
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.drop_column('cached')
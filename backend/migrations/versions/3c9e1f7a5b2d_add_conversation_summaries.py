@@ -0,0 +1,33 @@
+"""Add conversation summaries
+
+Revision ID: 3c9e1f7a5b2d
+Revises: 787d97941f6e
+Create Date: 2026-10-17 16:48:12.530417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f7a5b2d'
+down_revision = '787d97941f6e'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('conversation_summary',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('first_message_id', sa.Integer(), nullable=False),
+        sa.Column('through_message_id', sa.Integer(), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('conversation_id', 'version', name='uq_conversation_summary_version')
+    )
+
+def downgrade():
+    op.drop_table('conversation_summary')
@@ -15,6 +15,12 @@ branch_labels = None
 depends_on = None
 
 def upgrade():
+    # Other backends alter the column in place; the previous revision
+    # already added the foreign key there
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('chat_message', 'conversation_id', existing_type=sa.Integer(), nullable=False)
+        return
+
     # Create a new table with the desired schema
     op.create_table('new_chat_message',
         sa.Column('id', sa.Integer(), nullable=False),
@@ -41,6 +47,10 @@ def upgrade():
     op.rename_table('new_chat_message', 'chat_message')
 
 def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('chat_message', 'conversation_id', existing_type=sa.Integer(), nullable=True)
+        return
+
     # Create the old table without the foreign key constraint
     op.create_table('old_chat_message',
         sa.Column('id', sa.Integer(), nullable=False),
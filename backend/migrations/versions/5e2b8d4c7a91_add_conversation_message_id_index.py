@@ -0,0 +1,22 @@
+"""Add an index for the context cache watermark
+
+Revision ID: 5e2b8d4c7a91
+Revises: 3c9e1f7a5b2d
+Create Date: 2026-10-17 19:05:37.214480
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5e2b8d4c7a91'
+down_revision = '3c9e1f7a5b2d'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Every turn counts a conversation's visible messages and reads their id range
+    op.create_index('ix_chat_message_conversation_id_id', 'chat_message', ['conversation_id', 'id'])
+
+def downgrade():
+    op.drop_index('ix_chat_message_conversation_id_id', table_name='chat_message')
@@ -0,0 +1,64 @@
+"""Add full-text search over messages and a model column
+
+Revision ID: 787d97941f6e
+Revises: a965d0f28345
+Create Date: 2026-10-17 15:12:08.532117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '787d97941f6e'
+down_revision = 'a965d0f28345'
+branch_labels = None
+depends_on = None
+
+SQLITE_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5("
+    "content, content='chat_message', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+
+def upgrade():
+    op.add_column('chat_message', sa.Column('model', sa.String(length=100), nullable=True))
+    # Replies were billed under their model, so the usage ledger knows it;
+    # older user messages are left without one
+    op.execute(
+        "UPDATE chat_message SET model = ("
+        "SELECT provider_call.model FROM provider_call WHERE provider_call.message_id = chat_message.id "
+        "ORDER BY provider_call.id LIMIT 1"
+        ") WHERE role = 'assistant'"
+    )
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_SEARCH_DDL:
+            op.execute(statement)
+        # Index every existing message in one pass
+        op.execute("INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.create_index(
+            'ix_chat_message_content_search',
+            'chat_message',
+            [sa.text("to_tsvector('english', content)")],
+            postgresql_using='gin'
+        )
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f"DROP TRIGGER chat_message_fts_{trigger}")
+        op.execute("DROP TABLE chat_message_fts")
+    elif dialect == 'postgresql':
+        op.drop_index('ix_chat_message_content_search', table_name='chat_message')
+
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.drop_column('model')
@@ -0,0 +1,26 @@
+"""Add prompt cache token counts to ChatMessage and ProviderCall
+
+Revision ID: 828ed9869118
+Revises: 258576608c0c
+Create Date: 2026-10-17 13:24:12.584903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '828ed9869118'
+down_revision = '258576608c0c'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    for table in ('chat_message', 'provider_call'):
+        op.add_column(table, sa.Column('tokens_cache_read', sa.Integer(), nullable=True))
+        op.add_column(table, sa.Column('tokens_cache_creation', sa.Integer(), nullable=True))
+
+def downgrade():
+    for table in ('provider_call', 'chat_message'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('tokens_cache_creation')
+            batch_op.drop_column('tokens_cache_read')
@@ -0,0 +1,82 @@
+"""Move image payloads out of chat_message into the blob store
+
+Revision ID: 8bd472da099f
+Revises: ecbcf976e096
+Create Date: 2026-10-17 10:03:18.552907
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+from blob_store import BlobStore, parse_data_url, to_data_url
+
+# revision identifiers, used by Alembic.
+revision = '8bd472da099f'
+down_revision = 'ecbcf976e096'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.env')
+
+BATCH_SIZE = 100
+
+def upgrade():
+    op.add_column('chat_message', sa.Column('image_hash', sa.String(length=64), nullable=True))
+    op.add_column('chat_message', sa.Column('image_media_type', sa.String(length=50), nullable=True))
+    op.create_index('ix_chat_message_image_hash', 'chat_message', ['image_hash'])
+
+    # Copy every inline image into the blob store, a batch of rows at a time
+    blob_store = BlobStore(current_app.config['BLOB_STORE_PATH'])
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text('SELECT id, image_data FROM chat_message WHERE image_data IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit'),
+            {'last_id': last_id, 'limit': BATCH_SIZE}
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            try:
+                media_type, data = parse_data_url(row.image_data)
+            except ValueError as e:
+                # One unreadable legacy row should not block the migration; it loses its image
+                logger.warning(f"Dropping the image of chat message {row.id}: {str(e)}")
+                continue
+            conn.execute(
+                sa.text('UPDATE chat_message SET image_hash = :hash, image_media_type = :media_type WHERE id = :id'),
+                {'hash': blob_store.put(data), 'media_type': media_type, 'id': row.id}
+            )
+        last_id = rows[-1].id
+
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.drop_column('image_data')
+
+def downgrade():
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.add_column(sa.Column('image_data', sa.Text(), nullable=True))
+
+    # Inline the blobs again; the files themselves are left in place
+    blob_store = BlobStore(current_app.config['BLOB_STORE_PATH'])
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text('SELECT id, image_hash, image_media_type FROM chat_message WHERE image_hash IS NOT NULL')
+    ).fetchall()
+    for row in rows:
+        try:
+            data = blob_store.get(row.image_hash)
+        except FileNotFoundError:
+            logger.warning(f"Blob {row.image_hash} of chat message {row.id} is missing; leaving it without an image")
+            continue
+        conn.execute(
+            sa.text('UPDATE chat_message SET image_data = :image_data WHERE id = :id'),
+            {'image_data': to_data_url(row.image_media_type, data), 'id': row.id}
+        )
+
+    op.drop_index('ix_chat_message_image_hash', table_name='chat_message')
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.drop_column('image_media_type')
+        batch_op.drop_column('image_hash')
@@ -0,0 +1,60 @@
+"""Never reuse chat_message ids on SQLite
+
+Revision ID: 9d4f2a6c1e83
+Revises: 5e2b8d4c7a91
+Create Date: 2026-10-17 21:40:12.906318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9d4f2a6c1e83'
+down_revision = '5e2b8d4c7a91'
+branch_labels = None
+depends_on = None
+
+SEARCH_TRIGGERS = (
+    "CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+
+def rebuild_chat_message(autoincrement):
+    # Copying the table drops its search triggers; the FTS rows keep their
+    # rowids because the ids are copied as they are
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute(f"DROP TRIGGER chat_message_fts_{trigger}")
+    with op.batch_alter_table('chat_message', recreate='always', table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    for statement in SEARCH_TRIGGERS:
+        op.execute(statement)
+
+def upgrade():
+    # Postgres sequences never hand out an id twice. SQLite without
+    # AUTOINCREMENT reuses the ids of purged rows, which then fall under a
+    # conversation's reset watermark and point old ledger rows at new messages
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    rebuild_chat_message(True)
+    # Ids already purged past the newest remaining row must not come back either
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'chat_message', 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'chat_message')"
+    )
+    op.execute(
+        "UPDATE sqlite_sequence SET seq = max(seq, "
+        "(SELECT coalesce(max(cleared_through_id), 0) FROM conversation), "
+        "(SELECT coalesce(max(through_message_id), 0) FROM conversation_summary), "
+        "(SELECT coalesce(max(message_id), 0) FROM provider_call)"
+        ") WHERE name = 'chat_message'"
+    )
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    rebuild_chat_message(False)
@@ -0,0 +1,24 @@
+"""Add indexes for the chat history queries
+
+Revision ID: a159d41bf3d1
+Revises: 8bd472da099f
+Create Date: 2026-10-17 11:20:52.604113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a159d41bf3d1'
+down_revision = '8bd472da099f'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Every turn and history page filters by conversation and orders by time
+    op.create_index('ix_chat_message_conversation_id_timestamp', 'chat_message', ['conversation_id', 'timestamp'])
+    op.create_index('ix_conversation_created_at', 'conversation', ['created_at'])
+
+def downgrade():
+    op.drop_index('ix_conversation_created_at', table_name='conversation')
+    op.drop_index('ix_chat_message_conversation_id_timestamp', table_name='chat_message')
@@ -14,6 +14,8 @@ down_revision = 'fa1090a0210a'
 branch_labels = None
 depends_on = None
 
+FOREIGN_KEY_NAME = 'fk_chat_message_conversation_id_conversation'
+
 def upgrade():
     # Create the conversation table
     op.create_table('conversation',
@@ -30,10 +32,14 @@ def upgrade():
     if 'conversation_id' not in [c['name'] for c in columns]:
         op.add_column('chat_message', sa.Column('conversation_id', sa.Integer(), nullable=True))
     
-    # Add foreign key constraint
-    op.create_foreign_key(None, 'chat_message', 'conversation', ['conversation_id'], ['id'])
+    # Add foreign key constraint. SQLite cannot ALTER constraints; there the
+    # next revision rebuilds chat_message with the foreign key instead.
+    if conn.dialect.name != 'sqlite':
+        op.create_foreign_key(FOREIGN_KEY_NAME, 'chat_message', 'conversation', ['conversation_id'], ['id'])
 
 def downgrade():
-    op.drop_constraint(None, 'chat_message', type_='foreignkey')
-    op.drop_column('chat_message', 'conversation_id')
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint(FOREIGN_KEY_NAME, 'chat_message', type_='foreignkey')
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.drop_column('conversation_id')
     op.drop_table('conversation')
\ No newline at end of file
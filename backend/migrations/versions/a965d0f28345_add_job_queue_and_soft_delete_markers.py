@@ -0,0 +1,44 @@
+"""Add job queue and conversation soft-delete markers
+
+Revision ID: a965d0f28345
+Revises: 828ed9869118
+Create Date: 2026-10-17 14:02:37.410926
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a965d0f28345'
+down_revision = '828ed9869118'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('run_after', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_status_run_after', 'job', ['status', 'run_after'])
+
+    op.add_column('conversation', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('conversation', sa.Column('cleared_through_id', sa.Integer(), nullable=False, server_default='0'))
+    op.create_index('ix_conversation_deleted_at', 'conversation', ['deleted_at'])
+
+def downgrade():
+    op.drop_index('ix_conversation_deleted_at', table_name='conversation')
+    with op.batch_alter_table('conversation') as batch_op:
+        batch_op.drop_column('cleared_through_id')
+        batch_op.drop_column('deleted_at')
+
+    op.drop_index('ix_job_status_run_after', table_name='job')
+    op.drop_table('job')
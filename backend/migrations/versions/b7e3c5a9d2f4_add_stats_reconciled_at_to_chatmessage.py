@@ -0,0 +1,52 @@
+"""Add stats_reconciled_at to ChatMessage
+
+Revision ID: b7e3c5a9d2f4
+Revises: 9d4f2a6c1e83
+Create Date: 2026-10-17 22:18:54.127730
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3c5a9d2f4'
+down_revision = '9d4f2a6c1e83'
+branch_labels = None
+depends_on = None
+
+SEARCH_TRIGGERS = (
+    "CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+
+def upgrade():
+    op.add_column('chat_message', sa.Column('stats_reconciled_at', sa.DateTime(), nullable=True))
+
+    # An older reply's cost cannot be told apart from an estimate, but only
+    # the last day is looked up again on start, so the rest count as done
+    op.get_bind().execute(
+        sa.text(
+            "UPDATE chat_message SET stats_reconciled_at = timestamp "
+            "WHERE generation_id IS NOT NULL AND total_cost IS NOT NULL AND timestamp < :cutoff"
+        ),
+        {"cutoff": datetime.utcnow() - timedelta(days=1)}
+    )
+
+def downgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    if sqlite:
+        # The batch copy drops the search triggers and needs AUTOINCREMENT restated
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f"DROP TRIGGER chat_message_fts_{trigger}")
+    with op.batch_alter_table('chat_message', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_column('stats_reconciled_at')
+    if sqlite:
+        for statement in SEARCH_TRIGGERS:
+            op.execute(statement)
@@ -0,0 +1,25 @@
+"""Add token_estimate to ChatMessage
+
+Revision ID: ecbcf976e096
+Revises: 4609ceba0a41
+Create Date: 2026-10-17 09:12:40.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'ecbcf976e096'
+down_revision = '4609ceba0a41'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('chat_message', sa.Column('token_estimate', sa.Integer(), nullable=True))
+
+    # Backfill with the same heuristic as context_window.estimate_tokens
+    op.execute('UPDATE chat_message SET token_estimate = length(content) / 4 + 4')
+
+def downgrade():
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.drop_column('token_estimate')
@@ -17,6 +17,21 @@ depends_on = None
 
 
 def upgrade():
+    # Databases created before migrations existed already have chat_message
+    # from db.create_all(); a fresh database needs the original table
+    if not sa.inspect(op.get_bind()).has_table('chat_message'):
+        op.create_table('chat_message',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('role', sa.String(length=10), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.Column('generation_id', sa.String(length=50), nullable=True),
+            sa.Column('tokens_prompt', sa.Integer(), nullable=True),
+            sa.Column('tokens_completion', sa.Integer(), nullable=True),
+            sa.Column('total_cost', sa.Float(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
     # ### commands auto generated by Alembic - please adjust! ###
     op.add_column('chat_message', sa.Column('image_data', sa.Text(), nullable=True))
     # ### end Alembic commands ###
@@ -24,5 +39,6 @@ def upgrade():
 
 def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_column('chat_message', 'image_data')
+    with op.batch_alter_table('chat_message') as batch_op:
+        batch_op.drop_column('image_data')
     # ### end Alembic commands ###
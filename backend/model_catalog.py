@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+
+from context_window import CLAUDE_CONTEXT_LIMITS
+from pricing import CLAUDE_PRICES, parse_price
+
+logger = logging.getLogger(__name__)
+
+MODELS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'open_router_models.json')
+
+# Called through Anthropic directly, so they are not in the OpenRouter export
+CLAUDE_MODELS = {
+    'claude-3-haiku-20240307': 'Claude 3 Haiku',
+    'claude-3-5-sonnet-20240620': 'Claude 3.5 Sonnet',
+    'claude-3-opus-20240229': 'Claude 3 Opus',
+    'claude-3-sonnet-20240229': 'Claude 3 Sonnet',
+}
+
+# Listed first in the model picker
+DEFAULT_FEATURED_MODELS = [
+    'claude-3-haiku-20240307',
+    'claude-3-5-sonnet-20240620',
+    'claude-3-opus-20240229',
+    'openai/gpt-4o-2024-08-06',
+    'openai/gpt-4o-mini-2024-07-18',
+]
+
+# Passed as `enabled` (or CHAT_MODELS=all) to let chats use every model in the catalog
+ALL_MODELS = 'all'
+
+def claude_entry(model_id, name):
+    prices = CLAUDE_PRICES.get(model_id, (None, None))
+    return {
+        "id": model_id,
+        "name": name,
+        "provider": "anthropic",
+        "context_length": CLAUDE_CONTEXT_LIMITS.get(model_id),
+        "prompt_price": prices[0],
+        "completion_price": prices[1],
+        "moderation": None,
+    }
+
+def openrouter_entry(model):
+    context_length = model.get("Context (tokens)")
+    return {
+        "id": model["ID"],
+        "name": model.get("Model Name") or model["ID"],
+        "provider": "openrouter",
+        "context_length": context_length if isinstance(context_length, int) else None,
+        "prompt_price": parse_price(model.get("Prompt cost")),
+        "completion_price": parse_price(model.get("Completion cost")),
+        "moderation": model.get("Moderation"),
+    }
+
+class ModelCatalog:
+    """The models chat requests may use, parsed once and indexed by id.
+
+    Prices and context limits for the pricing engine and the context
+    window come from the same entries, so the export is read only once.
+    Chats may use the featured models unless `enabled` names others, or
+    is ALL_MODELS to allow the whole export.
+    """
+
+    def __init__(self, models, featured=(), enabled=None):
+        self.models = {}
+        for model in models:
+            self.models.setdefault(model["id"], model)
+        self.featured = [model_id for model_id in featured if model_id in self.models]
+        # None serves the whole catalog; otherwise only these ids pass validation
+        self.enabled = None if enabled == ALL_MODELS else set(self.featured if enabled is None else enabled) & set(self.models)
+        rank = {model_id: index for index, model_id in enumerate(self.featured)}
+        # Featured models in their configured order, then direct Claude models, then by name
+        self._listing = [
+            dict(model, featured=model["id"] in rank)
+            for model in sorted(self.available(), key=lambda model: (rank.get(model["id"], len(rank)), model["provider"] != "anthropic", model["name"].lower()))
+        ]
+
+    def __contains__(self, model_id):
+        return model_id in self.models and (self.enabled is None or model_id in self.enabled)
+
+    def get(self, model_id):
+        return self.models.get(model_id) if model_id in self else None
+
+    def available(self):
+        return [model for model in self.models.values() if model["id"] in self]
+
+    def listing(self, provider=None, query=None):
+        """Serialized entries, featured models first, optionally filtered."""
+        models = self._listing
+        if provider:
+            models = [model for model in models if model["provider"] == provider]
+        if query:
+            query = query.lower()
+            models = [model for model in models if query in model["id"].lower() or query in model["name"].lower()]
+        return models
+
+    def prices(self):
+        return {
+            model_id: (model["prompt_price"], model["completion_price"])
+            for model_id, model in self.models.items()
+            if model["prompt_price"] is not None and model["completion_price"] is not None
+        }
+
+    def context_limits(self):
+        return {model_id: model["context_length"] for model_id, model in self.models.items() if model["context_length"]}
+
+def load_catalog(path=MODELS_FILE, featured=None, enabled=None):
+    models = [claude_entry(model_id, name) for model_id, name in CLAUDE_MODELS.items()]
+    try:
+        with open(path) as f:
+            exported = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read the model catalog from {path}: {str(e)}")
+        exported = []
+    models.extend(openrouter_entry(model) for model in exported if model.get("ID"))
+    return ModelCatalog(models, DEFAULT_FEATURED_MODELS if featured is None else featured, enabled)
+
+def catalog_from_env(env, path=MODELS_FILE, default_model=None):
+    """Build the catalog; FEATURED_MODELS and CHAT_MODELS take comma separated model ids.
+
+    Without CHAT_MODELS only the featured models and default_model are
+    enabled, and CHAT_MODELS=all enables every model in the export.
+    """
+    def ids(name):
+        value = env.get(name)
+        return [model_id.strip() for model_id in value.split(',') if model_id.strip()] if value else None
+    featured = ids('FEATURED_MODELS') or DEFAULT_FEATURED_MODELS
+    enabled = ALL_MODELS if (env.get('CHAT_MODELS') or '').strip().lower() == ALL_MODELS else ids('CHAT_MODELS')
+    if enabled is None:
+        enabled = [*featured, default_model] if default_model else featured
+    return load_catalog(path, featured, enabled)
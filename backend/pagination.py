@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class PageRequest:
+    def __init__(self, limit, cursor, fields):
+        self.limit = limit
+        self.cursor = cursor
+        self.fields = fields
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+# Ranked results have no stable key to seek from, so their cursor is an offset
+def encode_offset_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode().rstrip('=')
+
+def decode_offset_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        offset = int(json.loads(raw)['offset'])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+def parse_page_request(args, allowed_fields):
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+
+    cursor = args.get('cursor')
+    fields = args.get('fields')
+    if fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in allowed_fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        fields = list(allowed_fields)
+
+    return PageRequest(min(limit, MAX_PAGE_SIZE), decode_cursor(cursor) if cursor else None, fields)
+
+def before(timestamp_column, id_column, key):
+    # Row-value comparison so the (timestamp, id) index serves the seek
+    return tuple_(timestamp_column, id_column) < tuple_(*key)
+
+def stream_json_page(key, rows, serialize, cursor_key, has_more, cursor_from_first=False):
+    """Serialize rows into {key: [...], "next_cursor": ...} one row at a time.
+
+    The cursor points at the first or last row of the page (whichever is
+    the oldest), and is only emitted when has_more says older rows exist.
+    """
+    yield f'{{"{key}": ['
+    edge = None
+    for index, row in enumerate(rows):
+        if index == 0 or not cursor_from_first:
+            edge = cursor_key(row)
+        yield (', ' if index else '') + json.dumps(serialize(row))
+    next_cursor = encode_cursor(*edge) if edge is not None and has_more(edge) else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+async def stream_json_page_async(key, rows, serialize, cursor_key, has_more, cursor_from_first=False):
+    yield f'{{"{key}": ['
+    edge = None
+    index = 0
+    async for row in rows:
+        if index == 0 or not cursor_from_first:
+            edge = cursor_key(row)
+        yield (', ' if index else '') + json.dumps(serialize(row))
+        index += 1
+    next_cursor = encode_cursor(*edge) if edge is not None and await has_more(edge) else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+def collect_page(key, rows, serialize, cursor_key, has_more, cursor_from_first=False):
+    """The page stream_json_page would send, as a dict for other encodings."""
+    items = []
+    edge = None
+    for index, row in enumerate(rows):
+        if index == 0 or not cursor_from_first:
+            edge = cursor_key(row)
+        items.append(serialize(row))
+    return {key: items, "next_cursor": encode_cursor(*edge) if edge is not None and has_more(edge) else None}
+
+async def collect_page_async(key, rows, serialize, cursor_key, has_more, cursor_from_first=False):
+    items = []
+    edge = None
+    async for row in rows:
+        if not items or not cursor_from_first:
+            edge = cursor_key(row)
+        items.append(serialize(row))
+    return {key: items, "next_cursor": encode_cursor(*edge) if edge is not None and await has_more(edge) else None}
@@ -0,0 +1,87 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Direct Anthropic models, in USD per million prompt and completion tokens
+CLAUDE_PRICES = {
+    'claude-3-5-sonnet-20240620': (3.00, 15.00),
+    'claude-3-opus-20240229': (15.00, 75.00),
+    'claude-3-sonnet-20240229': (3.00, 15.00),
+    'claude-3-haiku-20240307': (0.25, 1.25),
+}
+
+# Anthropic bills prompt cache writes and reads relative to the input price
+CACHE_WRITE_MULTIPLIER = 1.25
+CACHE_READ_MULTIPLIER = 0.1
+
+def parse_price(value):
+    # The OpenRouter export lists prices as "$0.35" per million tokens
+    if not isinstance(value, str) or not value.startswith('$'):
+        return None
+    try:
+        return float(value[1:])
+    except ValueError:
+        return None
+
+class PricingEngine:
+    def __init__(self, prices):
+        self.prices = prices
+        self._unpriced = set()
+
+    def cost(self, model, tokens_prompt, tokens_completion, tokens_cache_read=0, tokens_cache_creation=0):
+        if model not in self.prices:
+            if model not in self._unpriced:
+                self._unpriced.add(model)
+                logger.error(f"No price for model {model}, counting its usage as free")
+            return 0.0
+        prompt_price, completion_price = self.prices[model]
+        prompt_tokens = (
+            tokens_prompt
+            + tokens_cache_creation * CACHE_WRITE_MULTIPLIER
+            + tokens_cache_read * CACHE_READ_MULTIPLIER
+        )
+        return (prompt_tokens * prompt_price + tokens_completion * completion_price) / 1000000
+
+USAGE_FIELDS = ('tokens_prompt', 'tokens_completion', 'tokens_cache_read', 'tokens_cache_creation')
+
+class TurnUsage:
+    """Usage of every provider call made while answering one message.
+
+    Calls whose usage is not known yet (OpenRouter streams, until the
+    generation stats are fetched) leave the turn's totals pending.
+    """
+
+    def __init__(self, pricing):
+        self.pricing = pricing
+        self.calls = []
+
+    def add(self, provider, model, tokens_prompt=None, tokens_completion=None, generation_id=None,
+            tokens_cache_read=0, tokens_cache_creation=0):
+        known = tokens_prompt is not None and tokens_completion is not None
+        self.calls.append({
+            'provider': provider,
+            'model': model,
+            'generation_id': generation_id,
+            'tokens_prompt': tokens_prompt,
+            'tokens_completion': tokens_completion,
+            'tokens_cache_read': tokens_cache_read,
+            'tokens_cache_creation': tokens_cache_creation,
+            'cost': self.pricing.cost(model, tokens_prompt, tokens_completion, tokens_cache_read, tokens_cache_creation) if known else None,
+        })
+
+    def add_claude(self, model, usage):
+        # input_tokens only counts the prompt after the last cache breakpoint
+        self.add(
+            'anthropic', model, usage.input_tokens, usage.output_tokens,
+            tokens_cache_read=getattr(usage, 'cache_read_input_tokens', None) or 0,
+            tokens_cache_creation=getattr(usage, 'cache_creation_input_tokens', None) or 0,
+        )
+
+    def stats(self):
+        # A turn answered from the response cache has no calls and costs nothing
+        if any(call['cost'] is None for call in self.calls):
+            return dict.fromkeys(USAGE_FIELDS + ('total_cost',))
+        return {
+            **{field: sum(call[field] for call in self.calls) for field in USAGE_FIELDS},
+            'total_cost': sum((call['cost'] for call in self.calls), 0.0),
+        }
@@ -0,0 +1,35 @@
+import copy
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+def cached_tools(tools):
+    """Tool definitions with a breakpoint on the last one, caching them all."""
+    if not tools:
+        return tools
+    return [*tools[:-1], {**tools[-1], "cache_control": CACHE_CONTROL}]
+
+def with_cache_breakpoints(messages, breakpoints=2):
+    """Copy of Claude messages with cache breakpoints on the last user turns.
+
+    The breakpoint on the newest turn writes the prompt prefix to the
+    cache; the one on the turn before it reads what the previous request
+    wrote. Prefixes shorter than the model's minimum are simply not cached.
+    """
+    messages = list(messages)
+    user_indexes = [index for index, message in enumerate(messages) if message["role"] == "user"]
+    for index in user_indexes[-breakpoints:]:
+        message = messages[index]
+        content = message["content"]
+        if isinstance(content, str):
+            # Empty text blocks are rejected, and an image-only turn stores ""
+            if not content:
+                continue
+            content = [{"type": "text", "text": content}]
+        else:
+            # History snapshots are shared with the context cache, never mutate them
+            content = copy.copy(content)
+        if not content:
+            continue
+        content[-1] = {**content[-1], "cache_control": CACHE_CONTROL}
+        messages[index] = {**message, "content": content}
+    return messages
@@ -0,0 +1,408 @@
+import asyncio
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+
+from metrics import PROVIDER_ERRORS, PROVIDER_FALLBACKS, PROVIDER_HEDGES, TIME_TO_FIRST_TOKEN, observe_provider_call
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {408, 409, 429}
+
+# The request itself is at fault, another provider would reject it too
+NO_FALLBACK_STATUSES = {400, 413, 422}
+
+SDK_MODULES = ('anthropic', 'openai')
+
+class ProviderUnavailable(Exception):
+    pass
+
+def sdk_errors(name):
+    # The SDKs are imported with their clients; one never imported raised nothing
+    return tuple(getattr(sys.modules[module], name) for module in SDK_MODULES if module in sys.modules)
+
+def is_retryable(error):
+    if isinstance(error, sdk_errors('APIConnectionError')):
+        return True
+    if isinstance(error, sdk_errors('APIStatusError')):
+        return error.status_code in RETRYABLE_STATUSES or error.status_code >= 500
+    return False
+
+def is_provider_failure(error):
+    # What the circuit breaker counts: the provider being down, slow or
+    # overloaded, not a request it was right to reject
+    if is_retryable(error):
+        return True
+    transport_errors = (sys.modules['httpx'].TransportError,) if 'httpx' in sys.modules else ()
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError, FutureTimeoutError, ConnectionError) + transport_errors)
+
+def should_fall_back(error):
+    return not (isinstance(error, sdk_errors('APIStatusError')) and error.status_code in NO_FALLBACK_STATUSES)
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, error=None):
+        # Full jitter keeps clients that failed together from retrying together
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(error)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay))
+        return delay
+
+class CircuitBreaker:
+    """Per-route circuit breaker.
+
+    A route opens after `threshold` consecutive failures and is skipped
+    until `reset_after` seconds have passed. Then one request probes it
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_after=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self._failures = {}
+        self._opened_at = {}
+        self._probing = set()
+        self._lock = threading.Lock()
+
+    def allows(self, name):
+        with self._lock:
+            opened_at = self._opened_at.get(name)
+            if opened_at is None:
+                return True
+            if self.clock() - opened_at < self.reset_after or name in self._probing:
+                return False
+            self._probing.add(name)
+            return True
+
+    def is_open(self, name):
+        with self._lock:
+            return name in self._opened_at
+
+    def success(self, name):
+        with self._lock:
+            self._failures.pop(name, None)
+            self._opened_at.pop(name, None)
+            self._probing.discard(name)
+
+    def failure(self, name):
+        with self._lock:
+            probing = name in self._probing
+            self._probing.discard(name)
+            self._failures[name] = self._failures.get(name, 0) + 1
+            if probing or self._failures[name] >= self.threshold:
+                if probing or name not in self._opened_at:
+                    logger.error(f"Opening circuit for {name} after {self._failures[name]} failures")
+                self._opened_at[name] = self.clock()
+
+    def state(self, name):
+        with self._lock:
+            if name not in self._opened_at:
+                return 'closed'
+            if name in self._probing or self.clock() - self._opened_at[name] >= self.reset_after:
+                return 'half_open'
+            return 'open'
+
+    def stats(self):
+        with self._lock:
+            failures = dict(self._failures)
+            names = set(failures) | set(self._opened_at)
+        return {name: {"state": self.state(name), "failures": failures.get(name, 0)} for name in names}
+
+class LatencyTracker:
+    """Recent latencies per route, for the hedging threshold."""
+
+    def __init__(self, default_delay=5.0, percentile=0.95, window=200, min_samples=20):
+        self.default_delay = default_delay
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def threshold(self, name):
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return samples[min(int(len(samples) * self.percentile), len(samples) - 1)]
+
+    def stats(self):
+        with self._lock:
+            counts = {name: len(samples) for name, samples in self._samples.items()}
+        return {name: {"samples": count, "hedge_after": self.threshold(name)} for name, count in counts.items()}
+
+class ProviderRouter:
+    """Send a request down an ordered list of routes (see providers.py).
+
+    Each route is retried with jittered backoff on transient errors, then
+    the next route is tried. Routes with an open circuit, or whose
+    provider has said its rate limit is used up, are skipped.
+    With hedging on, a non-streaming request that outlives the primary
+    route's p95 latency is also sent to the next route and the first reply
+    wins; the other reply is still paid for, so it is handed to the
+    caller's on_discarded(route, response) when it arrives. Streams only
+    retry or fall back before their first token.
+    """
+
+    def __init__(self, retry=None, breaker=None, latency=None, hedging=False, max_workers=16, clock=time.monotonic, limits=None):
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self.limits = limits
+        self.hedging = hedging
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provider')
+        # Losing hedges still running on the event loop, kept so they are not collected
+        self._losers = set()
+
+    def available(self, routes):
+        for route in routes:
+            if self.limits and self.limits.blocked_for(route.provider, route.model) > 0:
+                logger.warning(f"Skipping {route.name}, its rate limit is used up")
+            elif self.breaker.allows(route.name):
+                yield route
+            else:
+                logger.warning(f"Skipping {route.name}, its circuit is open")
+
+    def unavailable(self, routes):
+        return ProviderUnavailable(f"No provider available for {', '.join(route.name for route in routes)}")
+
+    def should_retry(self, route, error, attempt):
+        if is_provider_failure(error):
+            self.breaker.failure(route.name)
+        PROVIDER_ERRORS.inc(provider=route.provider, model=route.model, retryable=str(is_retryable(error)).lower())
+        logger.error(f"{route.name} failed on attempt {attempt + 1}: {str(error)}")
+        return (
+            attempt + 1 < self.retry.max_attempts
+            and is_retryable(error)
+            and not self.breaker.is_open(route.name)
+        )
+
+    def call(self, route, request):
+        for attempt in range(self.retry.max_attempts):
+            started = self.clock()
+            try:
+                response = route.create(request)
+            except Exception as e:
+                if not self.should_retry(route, e, attempt):
+                    raise
+                time.sleep(self.retry.delay(attempt, e))
+                continue
+            elapsed = self.clock() - started
+            self.latency.record(route.name, elapsed)
+            observe_provider_call(route, elapsed, response)
+            self.breaker.success(route.name)
+            return response
+
+    async def call_async(self, route, request):
+        for attempt in range(self.retry.max_attempts):
+            started = self.clock()
+            try:
+                response = await route.create(request)
+            except Exception as e:
+                if not self.should_retry(route, e, attempt):
+                    raise
+                await asyncio.sleep(self.retry.delay(attempt, e))
+                continue
+            elapsed = self.clock() - started
+            self.latency.record(route.name, elapsed)
+            observe_provider_call(route, elapsed, response)
+            self.breaker.success(route.name)
+            return response
+
+    def discard(self, route, future, on_discarded):
+        """Hand the losing reply of a hedge to on_discarded once it arrives."""
+        if future.cancelled() or future.exception() is not None or on_discarded is None:
+            return
+        try:
+            on_discarded(route, future.result())
+        except Exception as e:
+            logger.error(f"Could not record the discarded reply from {route.name}: {str(e)}", exc_info=True)
+
+    def hedged_call(self, route, candidates, request, on_discarded=None):
+        started = threading.Event()
+
+        def primary_call():
+            started.set()
+            return self.call(route, request)
+
+        primary = self.executor.submit(primary_call)
+        # Time spent waiting for a free worker is not the provider being slow
+        started.wait()
+        try:
+            return route, primary.result(timeout=self.latency.threshold(route.name))
+        except FutureTimeoutError:
+            pass
+        backup = next(candidates, None)
+        if backup is None:
+            return route, primary.result()
+        logger.warning(f"{route.name} is slow, hedging with {backup.name}")
+        PROVIDER_HEDGES.inc(provider=route.provider, model=route.model)
+        futures = {primary: route, self.executor.submit(self.call, backup, request): backup}
+        error = None
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                error = e
+                continue
+            for loser, loser_route in futures.items():
+                if loser is not future:
+                    loser.add_done_callback(lambda loser, loser_route=loser_route: self.discard(loser_route, loser, on_discarded))
+            return futures[future], response
+        raise error
+
+    async def hedged_call_async(self, route, candidates, request, on_discarded=None):
+        primary = asyncio.ensure_future(self.call_async(route, request))
+        done, _ = await asyncio.wait({primary}, timeout=self.latency.threshold(route.name))
+        backup = None if done else next(candidates, None)
+        if backup is None:
+            return route, await primary
+        logger.warning(f"{route.name} is slow, hedging with {backup.name}")
+        PROVIDER_HEDGES.inc(provider=route.provider, model=route.model)
+        tasks = {primary: route, asyncio.ensure_future(self.call_async(backup, request)): backup}
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                for loser in pending:
+                    self._losers.add(loser)
+                    loser.add_done_callback(lambda loser: self.discard_async(tasks[loser], loser, on_discarded))
+                return tasks[task], task.result()
+        raise error
+
+    def discard_async(self, route, task, on_discarded):
+        self._losers.discard(task)
+        # on_discarded may write to the database, keep it off the event loop
+        self.executor.submit(self.discard, route, task, on_discarded)
+
+    def create(self, routes, request, on_discarded=None):
+        """Return (route, response) from the first route that answers."""
+        candidates = self.available(routes)
+        error = None
+        for route in candidates:
+            try:
+                if self.hedging:
+                    return self.hedged_call(route, candidates, request, on_discarded)
+                return route, self.call(route, request)
+            except Exception as e:
+                if not should_fall_back(e):
+                    raise
+                PROVIDER_FALLBACKS.inc(provider=route.provider, model=route.model)
+                error = e
+        raise error or self.unavailable(routes)
+
+    async def create_async(self, routes, request, on_discarded=None):
+        candidates = self.available(routes)
+        error = None
+        for route in candidates:
+            try:
+                if self.hedging:
+                    return await self.hedged_call_async(route, candidates, request, on_discarded)
+                return route, await self.call_async(route, request)
+            except Exception as e:
+                if not should_fall_back(e):
+                    raise
+                PROVIDER_FALLBACKS.inc(provider=route.provider, model=route.model)
+                error = e
+        raise error or self.unavailable(routes)
+
+    def stream(self, routes, request):
+        """Yield ('delta', text) events, then ('response', (route, response))."""
+        error = None
+        for route in self.available(routes):
+            for attempt in range(self.retry.max_attempts):
+                streaming = False
+                started = self.clock()
+                try:
+                    for event, data in route.stream(request):
+                        if event == 'response':
+                            observe_provider_call(route, self.clock() - started, data)
+                            self.breaker.success(route.name)
+                            yield event, (route, data)
+                        else:
+                            if not streaming:
+                                TIME_TO_FIRST_TOKEN.observe(self.clock() - started, provider=route.provider, model=route.model)
+                            streaming = True
+                            yield event, data
+                    return
+                except Exception as e:
+                    error = e
+                    if streaming:
+                        if is_provider_failure(e):
+                            self.breaker.failure(route.name)
+                        raise
+                    if self.should_retry(route, e, attempt):
+                        time.sleep(self.retry.delay(attempt, e))
+                        continue
+                    if not should_fall_back(e):
+                        raise
+                    PROVIDER_FALLBACKS.inc(provider=route.provider, model=route.model)
+                    break
+        raise error or self.unavailable(routes)
+
+    async def stream_async(self, routes, request):
+        error = None
+        for route in self.available(routes):
+            for attempt in range(self.retry.max_attempts):
+                streaming = False
+                started = self.clock()
+                try:
+                    async for event, data in route.stream(request):
+                        if event == 'response':
+                            observe_provider_call(route, self.clock() - started, data)
+                            self.breaker.success(route.name)
+                            yield event, (route, data)
+                        else:
+                            if not streaming:
+                                TIME_TO_FIRST_TOKEN.observe(self.clock() - started, provider=route.provider, model=route.model)
+                            streaming = True
+                            yield event, data
+                    return
+                except Exception as e:
+                    error = e
+                    if streaming:
+                        if is_provider_failure(e):
+                            self.breaker.failure(route.name)
+                        raise
+                    if self.should_retry(route, e, attempt):
+                        await asyncio.sleep(self.retry.delay(attempt, e))
+                        continue
+                    if not should_fall_back(e):
+                        raise
+                    PROVIDER_FALLBACKS.inc(provider=route.provider, model=route.model)
+                    break
+        raise error or self.unavailable(routes)
+
+    def stats(self):
+        stats = {"circuits": self.breaker.stats(), "latency": self.latency.stats()}
+        if self.limits:
+            stats["rate_limits"] = self.limits.stats()
+        return stats
@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1")
+
+# OpenAI finish reasons and the Anthropic stop reasons the chat loop expects
+STOP_REASONS = {
+    'stop': 'end_turn',
+    'tool_calls': 'tool_use',
+    'function_call': 'tool_use',
+    'length': 'max_tokens',
+}
+
+class InvalidProviderResponse(Exception):
+    pass
+
+class LazyClient:
+    """Stands in for a provider SDK client and builds it on first use.
+
+    Importing the SDKs is most of the app's start-up time, and a worker
+    that only serves history never needs them.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+def as_dict(block):
+    return block if isinstance(block, dict) else block.model_dump()
+
+def tool_result_text(content):
+    if isinstance(content, str):
+        return content
+    return "".join(as_dict(block).get("text", "") for block in content or [])
+
+def openai_messages(messages, system=None):
+    """Translate Claude-format messages to OpenAI chat messages.
+
+    Messages already in OpenAI format (plain strings, text and image_url
+    parts) pass through unchanged, so one request shape serves both.
+    """
+    converted = [{"role": "system", "content": system}] if system else []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            converted.append({"role": message["role"], "content": content})
+            continue
+
+        parts, tool_calls = [], []
+        for block in map(as_dict, content):
+            kind = block.get("type")
+            if kind == "text":
+                parts.append({"type": "text", "text": block["text"]})
+            elif kind == "image":
+                source = block["source"]
+                parts.append({"type": "image_url", "image_url": {"url": f"data:{source['media_type']};base64,{source['data']}"}})
+            elif kind == "image_url":
+                parts.append(block)
+            elif kind == "tool_use":
+                tool_calls.append({
+                    "id": block["id"],
+                    "type": "function",
+                    "function": {"name": block["name"], "arguments": json.dumps(block["input"])},
+                })
+            elif kind == "tool_result":
+                converted.append({"role": "tool", "tool_call_id": block["tool_use_id"], "content": tool_result_text(block.get("content"))})
+
+        if message["role"] == "assistant":
+            reply = {"role": "assistant", "content": "".join(part["text"] for part in parts if part["type"] == "text") or None}
+            if tool_calls:
+                reply["tool_calls"] = tool_calls
+            converted.append(reply)
+        elif parts:
+            converted.append({"role": message["role"], "content": parts})
+    return converted
+
+def openai_tools(tools):
+    return [
+        {
+            "type": "function",
+            "function": {"name": tool["name"], "description": tool["description"], "parameters": tool["input_schema"]},
+        }
+        for tool in tools or []
+    ]
+
+def to_message(generation_id, model, text, tool_calls, finish_reason, usage):
+    from anthropic.types import Message, TextBlock, ToolUseBlock, Usage
+
+    content = [TextBlock(type="text", text=text)] if text else []
+    for call in tool_calls:
+        content.append(ToolUseBlock(type="tool_use", id=call["id"], name=call["name"], input=json.loads(call["arguments"] or "{}")))
+    # Usage is unknown until OpenRouter reports it, so skip validation
+    return Message.model_construct(
+        id=generation_id,
+        type="message",
+        role="assistant",
+        model=model,
+        content=content,
+        stop_reason=STOP_REASONS.get(finish_reason, 'end_turn'),
+        stop_sequence=None,
+        usage=Usage.model_construct(
+            input_tokens=usage.prompt_tokens if usage else None,
+            output_tokens=usage.completion_tokens if usage else None,
+            cache_read_input_tokens=0,
+            cache_creation_input_tokens=0,
+        ),
+    )
+
+def completion_message(model, completion):
+    if not completion.choices or not completion.choices[0].message:
+        raise InvalidProviderResponse(f"Invalid response from OpenRouter: {completion}")
+    choice = completion.choices[0]
+    tool_calls = [
+        {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+        for call in choice.message.tool_calls or []
+    ]
+    return to_message(completion.id, model, choice.message.content, tool_calls, choice.finish_reason, completion.usage)
+
+class ChunkAccumulator:
+    """Rebuilds a full reply from OpenAI stream chunks."""
+
+    def __init__(self, model):
+        self.model = model
+        self.generation_id = None
+        self.text = []
+        self.tool_calls = {}
+        self.finish_reason = None
+        self.usage = None
+
+    def add(self, chunk):
+        """Record a chunk and return its text delta, if any."""
+        self.generation_id = self.generation_id or chunk.id
+        self.usage = getattr(chunk, 'usage', None) or self.usage
+        if not chunk.choices:
+            return None
+        choice = chunk.choices[0]
+        self.finish_reason = choice.finish_reason or self.finish_reason
+        for call in choice.delta.tool_calls or []:
+            entry = self.tool_calls.setdefault(call.index, {"id": None, "name": "", "arguments": ""})
+            entry["id"] = call.id or entry["id"]
+            if call.function:
+                entry["name"] += call.function.name or ""
+                entry["arguments"] += call.function.arguments or ""
+        if choice.delta.content:
+            self.text.append(choice.delta.content)
+        return choice.delta.content
+
+    def message(self):
+        tool_calls = [self.tool_calls[index] for index in sorted(self.tool_calls)]
+        return to_message(self.generation_id, self.model, "".join(self.text), tool_calls, self.finish_reason, self.usage)
+
+class AnthropicRoute:
+    provider = 'anthropic'
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+        self.name = f"{self.provider}:{model}"
+
+    def create(self, request):
+        return self.client.messages.create(model=self.model, **request)
+
+    def stream(self, request):
+        with self.client.messages.stream(model=self.model, **request) as stream:
+            for text in stream.text_stream:
+                yield 'delta', text
+            yield 'response', stream.get_final_message()
+
+class AsyncAnthropicRoute(AnthropicRoute):
+    async def stream(self, request):
+        async with self.client.messages.stream(model=self.model, **request) as stream:
+            async for text in stream.text_stream:
+                yield 'delta', text
+            yield 'response', await stream.get_final_message()
+
+class OpenRouterRoute:
+    """Any model through OpenRouter, speaking the Claude request and reply shape."""
+
+    provider = 'openrouter'
+
+    def __init__(self, client, model, headers=None):
+        self.client = client
+        self.model = model
+        self.headers = headers
+        self.name = f"{self.provider}:{model}"
+
+    def completion_options(self, request):
+        options = {
+            "extra_headers": self.headers,
+            "model": self.model,
+            "messages": openai_messages(request["messages"], request.get("system")),
+            "max_tokens": request["max_tokens"],
+        }
+        if request.get("tools"):
+            options["tools"] = openai_tools(request["tools"])
+        return options
+
+    def create(self, request):
+        return completion_message(self.model, self.client.chat.completions.create(**self.completion_options(request)))
+
+    def stream(self, request):
+        accumulator = ChunkAccumulator(self.model)
+        for chunk in self.client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **self.completion_options(request)
+        ):
+            text = accumulator.add(chunk)
+            if text:
+                yield 'delta', text
+        yield 'response', accumulator.message()
+
+class AsyncOpenRouterRoute(OpenRouterRoute):
+    async def create(self, request):
+        return completion_message(self.model, await self.client.chat.completions.create(**self.completion_options(request)))
+
+    async def stream(self, request):
+        accumulator = ChunkAccumulator(self.model)
+        chunks = await self.client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **self.completion_options(request)
+        )
+        async for chunk in chunks:
+            text = accumulator.add(chunk)
+            if text:
+                yield 'delta', text
+        yield 'response', accumulator.message()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def normalize(value):
+    # Surrounding whitespace does not change what the model is asked
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    return value
+
+def response_cache_key(model, messages, tools=None, max_tokens=None):
+    payload = json.dumps({
+        'model': model,
+        'messages': normalize(messages),
+        'tools': tools,
+        'max_tokens': max_tokens,
+    }, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class MemoryResponseCache:
+    def __init__(self, ttl=3600, max_entries=1000, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, reply = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return reply
+
+    def set(self, key, reply):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class DiskResponseCache:
+    """The same cache in a local SQLite file, so it survives restarts.
+
+    Every process on the host can share the file; least recently used
+    entries beyond max_entries are dropped on write.
+    """
+
+    def __init__(self, path, ttl=3600, max_entries=1000, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_used_at ON response_cache (used_at)")
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reply FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE response_cache SET used_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, reply):
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, reply, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                    (key, reply, now + self.ttl, now)
+                )
+                self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE key IN ("
+                    "SELECT key FROM response_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+def response_cache_from_env(default_path):
+    """Build the cache selected by RESPONSE_CACHE ('memory' or 'disk'); off by default."""
+    backend = os.getenv('RESPONSE_CACHE', 'off').lower()
+    ttl = int(os.getenv('RESPONSE_CACHE_TTL', 3600))
+    max_entries = int(os.getenv('RESPONSE_CACHE_SIZE', 1000))
+    if backend == 'memory':
+        return MemoryResponseCache(ttl=ttl, max_entries=max_entries)
+    if backend == 'disk':
+        return DiskResponseCache(os.getenv('RESPONSE_CACHE_PATH', default_path), ttl=ttl, max_entries=max_entries)
+    if backend not in ('', 'off'):
+        raise ValueError(f"Unknown RESPONSE_CACHE backend: {backend}")
+    return None
@@ -0,0 +1,185 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import DDL, column, event, func, literal_column, select, table
+
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_offset_cursor, encode_offset_cursor
+
+# SQLite keeps an external-content FTS5 index next to chat_message; the
+# triggers update it in the same transaction as every insert, update and
+# delete, so it never needs a rebuild after the initial backfill
+FTS_TABLE = 'chat_message_fts'
+
+SQLITE_SEARCH_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "content, content='chat_message', content_rowid='id', tokenize='porter unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON chat_message BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON chat_message BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF content ON chat_message BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+)
+
+# Postgres only uses the GIN index when the query repeats its expression,
+# including the configuration as a literal rather than a bound parameter
+SEARCH_CONFIG = literal_column("'english'")
+
+SNIPPET_WORDS = 16
+
+def create_sqlite_search(message_table):
+    """Create the FTS5 index alongside chat_message in create_all()."""
+    for statement in SQLITE_SEARCH_DDL:
+        event.listen(message_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(message_table, 'before_drop', DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}").execute_if(dialect='sqlite'))
+
+def fts5_query(text):
+    # Quote every term so user input can never be read as FTS5 syntax.
+    # Like Postgres' websearch_to_tsquery, quoted phrases stay phrases,
+    # terms are ANDed and a bare OR between two terms is kept
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if word == 'OR':
+            if terms and terms[-1] != 'OR':
+                terms.append('OR')
+            continue
+        words = re.findall(r'\w+', phrase or word)
+        if words:
+            terms.append('"' + ' '.join(words) + '"')
+    if terms and terms[-1] == 'OR':
+        terms.pop()
+    return ' '.join(terms)
+
+def split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+class SearchRequest:
+    def __init__(self, query, limit, offset, roles, models, conversation_id, since, until):
+        self.query = query
+        self.limit = limit
+        self.offset = offset
+        self.roles = roles
+        self.models = models
+        self.conversation_id = conversation_id
+        self.since = since
+        self.until = until
+
+def parse_search_request(args):
+    query = (args.get('q') or '').strip()
+    if not fts5_query(query):
+        raise ValueError("q must contain at least one word")
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    cursor = args.get('cursor')
+    since = args.get('since')
+    until = args.get('until')
+    return SearchRequest(
+        query,
+        min(limit, MAX_PAGE_SIZE),
+        decode_offset_cursor(cursor) if cursor else 0,
+        split_list(args.get('role')),
+        split_list(args.get('model')),
+        args.get('conversation_id', type=int),
+        datetime.fromisoformat(since) if since else None,
+        datetime.fromisoformat(until) if until else None,
+    )
+
+class MessageSearch:
+    """Ranked full-text search over chat messages.
+
+    SQLite matches against the FTS5 table and ranks with bm25; Postgres
+    matches to_tsvector(content) through its GIN index and ranks with
+    ts_rank_cd. Either way the best match comes first, messages hidden by
+    a delete or reset are left out, and only the page's rows get snippets.
+    """
+
+    def __init__(self, message_model, conversation_model):
+        self.message_model = message_model
+        self.conversation_model = conversation_model
+
+    def filters(self, search):
+        Message = self.message_model
+        Conversation = self.conversation_model
+        criteria = [Conversation.deleted_at.is_(None), Message.id > Conversation.cleared_through_id]
+        if search.roles:
+            criteria.append(Message.role.in_(search.roles))
+        if search.models:
+            criteria.append(Message.model.in_(search.models))
+        if search.conversation_id:
+            criteria.append(Message.conversation_id == search.conversation_id)
+        if search.since:
+            criteria.append(Message.timestamp >= search.since)
+        if search.until:
+            criteria.append(Message.timestamp < search.until)
+        return criteria
+
+    def columns(self):
+        Message = self.message_model
+        return (
+            Message.id,
+            Message.conversation_id,
+            self.conversation_model.name.label('conversation_name'),
+            Message.role,
+            Message.model,
+            Message.timestamp,
+        )
+
+    def statement(self, dialect, search):
+        Message = self.message_model
+        if dialect == 'sqlite':
+            fts = table(FTS_TABLE, column('rowid'))
+            index = literal_column(FTS_TABLE)
+            statement = (
+                select(
+                    *self.columns(),
+                    func.snippet(index, 0, '<mark>', '</mark>', '…', SNIPPET_WORDS).label('snippet'),
+                    func.bm25(index).label('rank'),
+                )
+                .select_from(fts)
+                .join(Message, Message.id == fts.c.rowid)
+                .where(index.op('MATCH')(fts5_query(search.query)))
+            )
+        else:
+            document = func.to_tsvector(SEARCH_CONFIG, Message.content)
+            query = func.websearch_to_tsquery(SEARCH_CONFIG, search.query)
+            statement = (
+                select(
+                    *self.columns(),
+                    func.ts_headline(
+                        SEARCH_CONFIG, Message.content, query,
+                        f'StartSel=<mark>, StopSel=</mark>, MaxFragments=1, MaxWords={SNIPPET_WORDS}, MinWords=4'
+                    ).label('snippet'),
+                    (-func.ts_rank_cd(document, query)).label('rank'),
+                )
+                .where(document.op('@@')(query))
+            )
+        # One extra row tells whether there is a next page
+        return (
+            statement
+            .join(self.conversation_model, self.conversation_model.id == Message.conversation_id)
+            .where(*self.filters(search))
+            .order_by(literal_column('rank'), Message.id)
+            .limit(search.limit + 1)
+            .offset(search.offset)
+        )
+
+def serialize_result(row):
+    return {
+        "message_id": row.id,
+        "conversation_id": row.conversation_id,
+        "conversation_name": row.conversation_name,
+        "role": row.role,
+        "model": row.model,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "snippet": row.snippet,
+        "rank": row.rank,
+    }
+
+def search_page(rows, search):
+    has_more = len(rows) > search.limit
+    return {
+        "results": [serialize_result(row) for row in rows[:search.limit]],
+        "next_cursor": encode_offset_cursor(search.offset + search.limit) if has_more else None,
+    }
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+
+from providers import OPENROUTER_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_GENERATION_URL = f"{OPENROUTER_BASE_URL}/generation"
+
+class StatsNotReady(Exception):
+    pass
+
+def stats_request_headers():
+    return {
+        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+        "HTTP-Referer": "http://localhost:3000",
+        "X-Title": "AI Chatbot",
+    }
+
+def parse_stats_response(response, generation_id):
+    # OpenRouter answers 404 until the generation has been accounted for
+    if response.status_code == 404:
+        raise StatsNotReady(generation_id)
+    response.raise_for_status()
+    data = response.json()['data']
+    return {
+        'tokens_prompt': data.get('tokens_prompt'),
+        'tokens_completion': data.get('tokens_completion'),
+        'total_cost': data.get('total_cost'),
+    }
+
+def fetch_openrouter_stats(session, generation_id):
+    response = session.get(
+        OPENROUTER_GENERATION_URL,
+        params={"id": generation_id},
+        headers=stats_request_headers(),
+        timeout=10,
+    )
+    return parse_stats_response(response, generation_id)
+
+async def fetch_openrouter_stats_async(client, generation_id):
+    response = await client.get(
+        OPENROUTER_GENERATION_URL,
+        params={"id": generation_id},
+        headers=stats_request_headers(),
+    )
+    return parse_stats_response(response, generation_id)
+
+def backoff_delay(attempt, initial_delay=1.0, backoff=2.0, max_delay=30.0):
+    return min(initial_delay * backoff ** attempt, max_delay)
+
+async def reconcile_stats_async(client, message_id, generation_id, on_stats, max_attempts=6,
+                                initial_delay=1.0, backoff=2.0, max_delay=30.0):
+    """Coroutine counterpart of StatsReconciler for the ASGI app."""
+    await asyncio.sleep(initial_delay)
+    for attempt in range(1, max_attempts + 1):
+        try:
+            stats = await fetch_openrouter_stats_async(client, generation_id)
+        except Exception as e:
+            if not isinstance(e, StatsNotReady):
+                logger.warning(f"Stats lookup for generation {generation_id} failed: {str(e)}")
+            if attempt < max_attempts:
+                await asyncio.sleep(backoff_delay(attempt, initial_delay, backoff, max_delay))
+            continue
+        await on_stats(message_id, stats)
+        return
+    logger.error(f"Giving up on stats for generation {generation_id} after {max_attempts} attempts")
+
+class StatsReconciler:
+    """Looks up OpenRouter generation stats off the request path.
+
+    Jobs are kept in a heap ordered by their next attempt time, so one
+    generation that is slow to show up never delays the others.
+    """
+
+    def __init__(self, on_stats, fetch_stats=fetch_openrouter_stats, max_attempts=6,
+                 initial_delay=1.0, backoff=2.0, max_delay=30.0):
+        self.on_stats = on_stats
+        self.fetch_stats = fetch_stats
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self._jobs = []
+        self._pending = set()
+        self._condition = threading.Condition()
+        self._session = None
+        self._thread = None
+        self._pid = None
+
+    def submit(self, message_id, generation_id, delay=None):
+        with self._condition:
+            if message_id in self._pending:
+                return
+            self._pending.add(message_id)
+            due = time.monotonic() + (self.initial_delay if delay is None else delay)
+            heapq.heappush(self._jobs, (due, message_id, generation_id, 1))
+            self._ensure_started()
+            self._condition.notify()
+
+    def _ensure_started(self):
+        # Worker threads do not survive a fork, so start one per process
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        import requests
+        self._pid = os.getpid()
+        self._session = requests.Session()
+        self._thread = threading.Thread(target=self._run, name="stats-reconciler", daemon=True)
+        self._thread.start()
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                if self._jobs:
+                    wait = self._jobs[0][0] - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._jobs)
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            _, message_id, generation_id, attempt = self._next_job()
+            try:
+                stats = self.fetch_stats(self._session, generation_id)
+            except Exception as e:
+                if not isinstance(e, StatsNotReady):
+                    logger.warning(f"Stats lookup for generation {generation_id} failed: {str(e)}")
+                self._retry(message_id, generation_id, attempt)
+                continue
+
+            try:
+                self.on_stats(message_id, stats)
+            except Exception as e:
+                logger.error(f"Error saving stats for message {message_id}: {str(e)}", exc_info=True)
+            with self._condition:
+                self._pending.discard(message_id)
+
+    def _retry(self, message_id, generation_id, attempt):
+        with self._condition:
+            if attempt >= self.max_attempts:
+                logger.error(f"Giving up on stats for generation {generation_id} after {attempt} attempts")
+                self._pending.discard(message_id)
+                return
+            delay = backoff_delay(attempt, self.initial_delay, self.backoff, self.max_delay)
+            heapq.heappush(self._jobs, (time.monotonic() + delay, message_id, generation_id, attempt + 1))
@@ -0,0 +1,81 @@
+import threading
+import time
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You condense chat transcripts. Write a summary of the conversation so far that lets an assistant "
+    "continue it: the user's goals, facts and numbers they gave, decisions made, answers already given "
+    "and open questions. Use short paragraphs or bullet points and no preamble."
+)
+
+# Prefixes the summary where it stands in for the turns it covers
+SUMMARY_CONTEXT_PREFIX = "Summary of our conversation so far:\n\n"
+
+class ConversationSummarizer:
+    """Decides when and how much of a conversation to fold into its rolling summary.
+
+    Once the turns after a conversation's latest summary reach
+    trigger_tokens, everything but the newest keep_tokens of them is
+    condensed into a new summary version, which later turns send in
+    place of the turns it covers.
+    """
+
+    def __init__(self, trigger_tokens=24000, keep_tokens=8000, cooldown=120, clock=time.monotonic):
+        self.trigger_tokens = trigger_tokens
+        self.keep_tokens = keep_tokens
+        self.cooldown = cooldown
+        self.clock = clock
+        self._requested = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.trigger_tokens > 0
+
+    def should_request(self, conversation_id, tokens):
+        """Whether a write that left `tokens` unsummarized should enqueue a summary job.
+
+        Asks at most once per cooldown for each conversation, so the
+        turns written while a job is queued do not enqueue more.
+        """
+        if not self.enabled or tokens is None or tokens < self.trigger_tokens:
+            return False
+        now = self.clock()
+        with self._lock:
+            if now - self._requested.get(conversation_id, -self.cooldown) < self.cooldown:
+                return False
+            self._requested[conversation_id] = now
+            # Forget conversations whose cooldown ran out long ago
+            if len(self._requested) > 10000:
+                self._requested = {key: at for key, at in self._requested.items() if now - at < self.cooldown}
+            return True
+
+    def summarized(self, conversation_id):
+        # The turns after the new summary count from zero, so the next request need not wait
+        with self._lock:
+            self._requested.pop(conversation_id, None)
+
+    def split(self, messages, tokens, summary_tokens=0):
+        """How many of the oldest messages to summarize, or 0 if it is not time yet.
+
+        The newest keep_tokens stay as they are, and the summarized part
+        ends on an assistant reply so the kept turns open with the user.
+        """
+        if not self.enabled or summary_tokens + sum(tokens) < self.trigger_tokens:
+            return 0
+        kept, count = 0, len(messages)
+        while count and kept + tokens[count - 1] <= self.keep_tokens:
+            count -= 1
+            kept += tokens[count]
+        while count and messages[count - 1].role != 'assistant':
+            count -= 1
+        return count
+
+    def prompt(self, previous_summary, messages):
+        transcript = "\n\n".join(f"{message.role.upper()}: {message.content}" for message in messages)
+        if previous_summary:
+            return (
+                f"Earlier summary:\n\n{previous_summary}\n\n"
+                f"Conversation since then:\n\n{transcript}\n\n"
+                "Write one updated summary covering both."
+            )
+        return f"Conversation:\n\n{transcript}"
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class ToolResultCache:
+    """Size-bounded LRU of tool results, each kept for its tool's TTL.
+
+    Concurrent calls with the same tool input share a single computation
+    (single-flight): the first caller runs it and the others wait for its
+    result. Exceptions are passed to every waiter and never cached, so the
+    next call retries.
+    """
+
+    def __init__(self, ttls=None, default_ttl=60, max_entries=1024, clock=time.monotonic):
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def ttl(self, tool_name):
+        return self.ttls.get(tool_name, self.default_ttl)
+
+    def key(self, tool_name, tool_input):
+        return tool_name, json.dumps(tool_input, sort_keys=True, default=str)
+
+    def get_or_compute(self, tool_name, tool_input, compute):
+        key = self.key(tool_name, tool_input)
+        leader = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                flight = self._in_flight[key] = _Flight()
+                leader = True
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            self._store(key, self.ttl(tool_name), flight.result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+        return flight.result
+
+    def _store(self, key, ttl, result):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+class Tool:
+    def __init__(self, name, description, input_schema, handler, timeout=10, cache_ttl=0, normalize=None, cacheable=False):
+        self.name = name
+        self.description = description
+        self.input_schema = input_schema
+        self.handler = handler
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.normalize = normalize or (lambda tool_input: tool_input)
+        # Whether a reply built from this tool's output may be served from the response cache
+        self.cacheable = cacheable
+
+    def spec(self):
+        return {
+            "name": self.name,
+            "description": self.description,
+            "input_schema": self.input_schema,
+        }
+
+class ToolRegistry:
+    """Tools the model can call, run through the result cache.
+
+    Handlers are blocking functions taking the tool input. All tool_use
+    blocks of one response run at once on a bounded thread pool, each
+    limited to its tool's timeout. A tool that times out keeps its worker
+    until it returns, but the turn moves on with an error result.
+    """
+
+    def __init__(self, cache, max_workers=8):
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tool')
+        self._tools = {}
+
+    def register(self, tool):
+        self._tools[tool.name] = tool
+        self.cache.ttls[tool.name] = tool.cache_ttl
+        return tool
+
+    def specs(self):
+        return [tool.spec() for tool in self._tools.values()]
+
+    def call(self, tool_name, tool_input):
+        """Run one tool, returning (content, is_error)."""
+        tool = self._tools.get(tool_name)
+        if tool is None:
+            return f"Unsupported tool: {tool_name}", True
+        try:
+            tool_input = tool.normalize(tool_input)
+        except Exception as e:
+            # The model sent input the tool cannot use; tell it instead of failing the turn
+            logger.error(f"Tool {tool_name} got invalid input {tool_input!r}: {str(e)}")
+            return f"Invalid input for {tool_name}: {type(e).__name__}: {str(e)}", True
+        try:
+            return self.cache.get_or_compute(tool_name, tool_input, lambda: tool.handler(tool_input)), False
+        except Exception as e:
+            # Failures are not cached, so the next call runs the tool again
+            logger.error(f"Tool {tool_name} failed: {str(e)}")
+            return f"Error running {tool_name}: {str(e)}", True
+
+    def cacheable(self, tool_names):
+        return all(tool_name in self._tools and self._tools[tool_name].cacheable for tool_name in tool_names)
+
+    def timeout(self, tool_name):
+        tool = self._tools.get(tool_name)
+        return tool.timeout if tool else 0
+
+    def run_all(self, tool_uses):
+        """Run tool_use blocks in parallel and return their tool_result blocks, in order."""
+        started = time.monotonic()
+        # Unknown tools are answered right away rather than timing out on the pool
+        futures = [
+            self.executor.submit(self.call, tool_use.name, tool_use.input) if tool_use.name in self._tools else None
+            for tool_use in tool_uses
+        ]
+        results = []
+        for tool_use, future in zip(tool_uses, futures):
+            if future is None:
+                results.append(tool_result(tool_use, *self.call(tool_use.name, tool_use.input)))
+                continue
+            remaining = self.timeout(tool_use.name) - (time.monotonic() - started)
+            try:
+                content, is_error = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                content, is_error = self.timed_out(tool_use.name)
+            results.append(tool_result(tool_use, content, is_error))
+        return results
+
+    async def run_all_async(self, tool_uses):
+        loop = asyncio.get_running_loop()
+
+        async def run(tool_use):
+            if tool_use.name not in self._tools:
+                return tool_result(tool_use, *self.call(tool_use.name, tool_use.input))
+            try:
+                content, is_error = await asyncio.wait_for(
+                    loop.run_in_executor(self.executor, self.call, tool_use.name, tool_use.input),
+                    self.timeout(tool_use.name)
+                )
+            except asyncio.TimeoutError:
+                content, is_error = self.timed_out(tool_use.name)
+            return tool_result(tool_use, content, is_error)
+
+        return await asyncio.gather(*(run(tool_use) for tool_use in tool_uses))
+
+    def timed_out(self, tool_name):
+        logger.error(f"Tool {tool_name} timed out after {self.timeout(tool_name)}s")
+        return f"Error running {tool_name}: timed out after {self.timeout(tool_name)}s", True
+
+def tool_result(tool_use, content, is_error=False):
+    block = {
+        "type": "tool_result",
+        "tool_use_id": tool_use.id,
+        "content": content
+    }
+    if is_error:
+        block["is_error"] = True
+    return block
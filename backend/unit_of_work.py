@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: journals cannot be locked, so every other journal counts as abandoned
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class TurnJournal:
+    """Crash-safe record of chat turns whose rows are not committed yet.
+
+    A turn's user message is written to the database in one transaction
+    with the reply. Until then it sits in an append-only file owned (and
+    locked) by this process. recover() hands the unfinished turns of
+    processes that died mid-turn back to the caller to write.
+    """
+
+    def __init__(self, directory, fsync=False):
+        self.directory = directory
+        self.fsync = fsync
+        self._file = None
+        self._pid = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # A forked worker gets its own journal rather than its parent's
+        if self._pid == os.getpid():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = open(os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"), 'a', encoding='utf-8')
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._pid = os.getpid()
+        self._pending = set()
+
+    def _append(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def begin(self, turn):
+        turn = dict(turn, turn=uuid.uuid4().hex)
+        with self._lock:
+            self._open()
+            self._append(turn)
+            self._pending.add(turn['turn'])
+        return turn
+
+    def end(self, turn):
+        with self._lock:
+            if self._pid != os.getpid() or turn['turn'] not in self._pending:
+                return
+            self._pending.discard(turn['turn'])
+            if self._pending:
+                self._append({"done": turn['turn']})
+            else:
+                # Nothing is in flight, so the journal can start over
+                self._file.truncate(0)
+
+    def is_pending(self, turn):
+        with self._lock:
+            return turn['turn'] in self._pending
+
+    def recover(self, write):
+        """Call write(turns) with each abandoned journal's unfinished turns, then delete it.
+
+        write() must commit before returning; a journal whose write fails
+        is kept for the next attempt.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        recovered = 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.jsonl'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                journal = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with journal:
+                if not self._claim(journal, path):
+                    continue
+                turns = unfinished_turns(journal)
+                if turns:
+                    write(turns)
+                os.remove(path)
+                recovered += len(turns)
+        if recovered:
+            logger.warning(f"Recovered {recovered} chat turns from {self.directory}")
+        return recovered
+
+    def _claim(self, journal, path):
+        if self._file is not None and self._pid == os.getpid() and os.path.samefile(path, self._file.name):
+            return False
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Its process is still alive
+            return False
+        # Another process may have recovered and deleted it in the meantime
+        try:
+            return os.stat(path).st_ino == os.fstat(journal.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+def unfinished_turns(lines):
+    turns = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # The process died halfway through writing this line
+            continue
+        if 'done' in record:
+            turns.pop(record['done'], None)
+        else:
+            turns[record['turn']] = record
+    return list(turns.values())
+
+class GroupCommitter:
+    """Commits writes from concurrent requests in one transaction.
+
+    A write is a function of a session that adds rows (flushing for ids
+    if it needs them) and returns a result. Writes queue up while the
+    previous batch commits and go out together, so N requests share one
+    fsync instead of paying for N. If a batch fails, its writes are
+    retried one by one so a bad write only fails its own request.
+    """
+
+    def __init__(self, db, app_context, window=0.0, max_batch=64):
+        self.db = db
+        self.app_context = app_context
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def submit(self, write, on_commit=None):
+        """Run write(session) in the next batch and return its result once committed.
+
+        on_commit(result) runs right after the commit, before submit returns.
+        """
+        self.start()
+        future = Future()
+        self._queue.put((write, on_commit, future))
+        return future.result()
+
+    def _batch(self):
+        batch = [self._queue.get()]
+        if self.window:
+            time.sleep(self.window)
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._batch()
+            try:
+                with self.app_context():
+                    self.commit(batch)
+            except Exception as e:
+                for write, on_commit, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def commit(self, batch):
+        session = self.db.session
+        try:
+            results = [write(session) for write, on_commit, future in batch]
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            logger.warning(f"Group commit of {len(batch)} writes failed, retrying them one by one: {str(e)}")
+            for item in batch:
+                self.commit([item])
+            return
+        for (write, on_commit, future), result in zip(batch, results):
+            settle(future, on_commit, result)
+
+class AsyncGroupCommitter:
+    """GroupCommitter for async sessions; writes are coroutine functions."""
+
+    def __init__(self, session_factory, window=0.0, max_batch=64):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+
+    async def submit(self, write, on_commit=None):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((write, on_commit, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.window:
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self.commit(batch)
+
+    async def commit(self, batch):
+        async with self.session_factory() as session:
+            try:
+                results = [await write(session) for write, on_commit, future in batch]
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                error = e
+            else:
+                # Post-commit hooks touch the database and files, so keep them off the event loop
+                await asyncio.to_thread(run_hooks, batch, results)
+                for (write, on_commit, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+                return
+        if len(batch) == 1:
+            if not batch[0][2].done():
+                batch[0][2].set_exception(error)
+            return
+        logger.warning(f"Group commit of {len(batch)} writes failed, retrying them one by one: {str(error)}")
+        for item in batch:
+            await self.commit([item])
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+def run_hook(on_commit, result):
+    # on_commit runs even if the waiting request has gone away, since the rows are in
+    try:
+        if on_commit:
+            on_commit(result)
+    except Exception as e:
+        logger.error(f"Post-commit hook failed: {str(e)}", exc_info=True)
+
+def run_hooks(batch, results):
+    for (write, on_commit, future), result in zip(batch, results):
+        run_hook(on_commit, result)
+
+def settle(future, on_commit, result):
+    run_hook(on_commit, result)
+    if not future.done():
+        future.set_result(result)
@@ -16,9 +16,13 @@ function App() {
   const [activeConversation, setActiveConversation] = useState(null);
   const [isSidebarVisible, setIsSidebarVisible] = useState(true);
   const [selectedModel, setSelectedModel] = useState('claude-3-haiku-20240307'); // New state for selected model
+  const [models, setModels] = useState([]);
+  const [conversationsCursor, setConversationsCursor] = useState(null);
+  const [historyCursor, setHistoryCursor] = useState(null);
 
   useEffect(() => {
     fetchConversations();
+    fetchModels();
   }, []);
 
   useEffect(() => {
@@ -27,32 +31,55 @@ function App() {
     }
   }, [chat]);
 
-  const fetchConversations = async () => {
+  const fetchConversations = async (cursor = null) => {
     try {
-      const response = await fetch('/api/conversations');
+      const params = new URLSearchParams({ fields: 'id,name' });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`/api/conversations?${params}`);
       const data = await response.json();
-      setConversations(data);
-      if (data.length > 0) {
-        setActiveConversation(data[0].id);
-        fetchChatHistory(data[0].id);
+      setConversationsCursor(data.next_cursor);
+      if (cursor) {
+        setConversations(prevConversations => [...prevConversations, ...data.conversations]);
+        return;
+      }
+      setConversations(data.conversations);
+      if (data.conversations.length > 0) {
+        setActiveConversation(data.conversations[0].id);
+        fetchChatHistory(data.conversations[0].id);
       }
     } catch (error) {
       console.error('Error fetching conversations:', error);
     }
   };
 
-  const fetchChatHistory = async (conversationId) => {
+  const fetchModels = async () => {
+    try {
+      const response = await fetch('/api/models');
+      const data = await response.json();
+      setModels(data.models);
+      setSelectedModel(data.default);
+    } catch (error) {
+      console.error('Error fetching models:', error);
+    }
+  };
+
+  const fetchChatHistory = async (conversationId, cursor = null) => {
     try {
-      const response = await fetch(`/api/chat_history/${conversationId}`);
+      const params = new URLSearchParams({ limit: 50 });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`/api/chat_history/${conversationId}?${params}`);
       const data = await response.json();
-      setChat(data.map(msg => ({
+      const messages = data.messages.map(msg => ({
+        id: msg.id,
         role: msg.role,
         content: msg.content,
         tokens_prompt: msg.tokens_prompt,
         tokens_completion: msg.tokens_completion,
         total_cost: msg.total_cost,
-        imageUrl: msg.image_data
-      })));
+        imageUrl: msg.image_url
+      }));
+      setHistoryCursor(data.next_cursor);
+      setChat(prevChat => cursor ? [...messages, ...prevChat] : messages);
     } catch (error) {
       console.error('Error fetching chat history:', error);
     }
@@ -64,6 +91,7 @@ function App() {
       const newConversation = await response.json();
       setConversations([...conversations, newConversation]);
       setActiveConversation(newConversation.id);
+      setHistoryCursor(null);
       setChat([]);
     } catch (error) {
       console.error('Error creating new conversation:', error);
@@ -81,6 +109,7 @@ function App() {
           fetchChatHistory(newActive.id);
         } else {
           setActiveConversation(null);
+          setHistoryCursor(null);
           setChat([]);
         }
       }
@@ -89,6 +118,47 @@ function App() {
     }
   };
 
+  const parseSseEvent = (rawEvent) => {
+    let event = 'message';
+    let data = '';
+    rawEvent.split('\n').forEach(line => {
+      if (line.startsWith('event:')) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith('data:')) {
+        data += line.slice(5).trim();
+      }
+    });
+    return { event, data: data ? JSON.parse(data) : {} };
+  };
+
+  const updateLastMessage = (update) => {
+    setChat(prevChat => {
+      const lastMessage = prevChat[prevChat.length - 1];
+      return [...prevChat.slice(0, -1), { ...lastMessage, ...update(lastMessage) }];
+    });
+  };
+
+  const pollGenerationStats = async (messageId, attempt = 0) => {
+    if (attempt >= 6) return;
+    await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+    try {
+      const response = await fetch(`/api/generation_stats/${messageId}`);
+      const stats = await response.json();
+      if (stats.stats_pending) {
+        pollGenerationStats(messageId, attempt + 1);
+        return;
+      }
+      setChat(prevChat => prevChat.map(msg => msg.id === messageId ? {
+        ...msg,
+        tokens_prompt: stats.tokens_prompt,
+        tokens_completion: stats.tokens_completion,
+        total_cost: stats.total_cost
+      } : msg));
+    } catch (error) {
+      console.error('Error fetching generation stats:', error);
+    }
+  };
+
   const sendMessage = async () => {
     if (!message.trim() && !imageUrl) return;
     setIsLoading(true);
@@ -97,7 +167,7 @@ function App() {
     setMessage('');
     setImageUrl('');
     try {
-      const response = await fetch('/api/chat', {
+      const response = await fetch('/api/chat/stream', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
         body: JSON.stringify({ 
@@ -107,21 +177,57 @@ function App() {
           model: selectedModel
         })
       });
-      const data = await response.json();
       if (!response.ok) {
+        const data = await response.json();
         throw new Error(data.error || `HTTP error! status: ${response.status}`);
       }
-      if (data.error) {
-        throw new Error(data.error);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let started = false;
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const rawEvents = buffer.split('\n\n');
+        buffer = rawEvents.pop();
+
+        for (const rawEvent of rawEvents) {
+          const { event, data } = parseSseEvent(rawEvent);
+          if (event === 'error') {
+            throw new Error(data.error);
+          }
+          if (event === 'conversation' && !activeConversation) {
+            setActiveConversation(data.conversation_id);
+          } else if (event === 'delta') {
+            if (!started) {
+              started = true;
+              setIsLoading(false);
+              setChat(prevChat => [...prevChat, { role: 'assistant', content: '' }]);
+            }
+            updateLastMessage(last => ({ content: last.content + data.text }));
+          } else if (event === 'done') {
+            const botResponse = {
+              id: data.message_id,
+              role: 'assistant',
+              content: data.message,
+              tokens_prompt: data.generation_stats.tokens_prompt,
+              tokens_completion: data.generation_stats.tokens_completion,
+              total_cost: data.generation_stats.total_cost
+            };
+            if (started) {
+              updateLastMessage(() => botResponse);
+            } else {
+              setChat(prevChat => [...prevChat, botResponse]);
+            }
+            if (data.stats_pending) {
+              pollGenerationStats(data.message_id);
+            }
+          }
+        }
       }
-      const botResponse = {
-        role: 'assistant',
-        content: data.message,
-        tokens_prompt: data.generation_stats.tokens_prompt,
-        tokens_completion: data.generation_stats.tokens_completion,
-        total_cost: data.generation_stats.total_cost
-      };
-      setChat(prevChat => [...prevChat, botResponse]);
     } catch (error) {
       console.error('Error:', error);
       let errorMessage = error.message || 'An unexpected error occurred';
@@ -167,6 +273,7 @@ function App() {
       });
       const data = await response.json();
       if (data.status === 'success') {
+        setHistoryCursor(null);
         setChat([]);
         console.log('Chat history reset successfully');
       } else {
@@ -276,20 +383,38 @@ function App() {
             </button>
           </div>
         ))}
+        {conversationsCursor && (
+          <button onClick={() => fetchConversations(conversationsCursor)} className="load-more-btn">
+            Load more
+          </button>
+        )}
       </div>
       <div className="main-content">
         <h1 className="header">AI Chatbot</h1>
         <div className="model-selection">
           <label htmlFor="model-select">Select Model:</label>
           <select id="model-select" value={selectedModel} onChange={handleModelChange}>
-            <option value="claude-3-haiku-20240307">claude-3-haiku-20240307</option>
-            <option value="claude-3-5-sonnet-20240620">claude-3-5-sonnet-20240620</option>
-            <option value="claude-3-opus-20240229">claude-3-opus-20240229</option>
-            <option value="openai/gpt-4o-2024-08-06">openai/gpt-4o-2024-08-06</option>
-            <option value="openai/gpt-4o-mini-2024-07-18">openai/gpt-4o-mini-2024-07-18</option>
+            {models.length === 0 && <option value={selectedModel}>{selectedModel}</option>}
+            <optgroup label="Featured">
+              {models.filter(model => model.featured).map(model => (
+                <option key={model.id} value={model.id}>{model.id}</option>
+              ))}
+            </optgroup>
+            {models.some(model => !model.featured) && (
+              <optgroup label="All models">
+                {models.filter(model => !model.featured).map(model => (
+                  <option key={model.id} value={model.id}>{model.name}</option>
+                ))}
+              </optgroup>
+            )}
           </select>
         </div>
         <div className={`chat-container ${chat.length > 0 ? 'visible' : ''}`} ref={chatContainerRef}>
+          {historyCursor && (
+            <button onClick={() => fetchChatHistory(activeConversation, historyCursor)} className="load-more-btn">
+              Load earlier messages
+            </button>
+          )}
           {chat.map((message, index) => (
             <div key={index} className={`message ${message.role}-message`}>
               <div className="message-content">{renderMessage(message)}</div>